@@ -0,0 +1,61 @@
+import pathlib as pl
+import argparse
+import sys
+import time
+import numpy as np
+
+import inputcard_converter
+from inputcard_converter import Inputcard
+
+
+def sweep_cards(inputcard, num_points):
+    # num_points inputcards of a lattice constant x k-mesh sweep around the lattice constant of inputcard
+    lattice_constant = inputcard.get_parameter('lattice')['lattice-constant']
+    k_meshes = [10, 20, 30, 40]
+    lattice_constants = np.linspace(0.9, 1.1, -(-num_points // len(k_meshes))) * lattice_constant
+
+    cards = []
+    for k_mesh in k_meshes:
+        for alat in lattice_constants:
+            card = inputcard.derive('lattice', {'lattice-constant': float(alat)})
+            card.change_parameter('k-points', {'KMAX': [k_mesh] * 3})
+            cards.append(card)
+
+    return cards[:num_points]
+
+
+def bench(cards, cached=True):
+    inputcard_converter.clear_render_cache()
+    start = time.perf_counter()
+    for card in cards:
+        if not cached:
+            inputcard_converter.clear_render_cache()
+        str(card)
+    return len(cards) / (time.perf_counter() - start)
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Benchmark of the inputcard renderer for parameter sweeps")
+
+    parser.add_argument('-i', '--json_input_path', dest='json_inp_path', default='inputcard_InN.json',
+                        help='json representation of the inputcard the sweep is based on')
+    parser.add_argument('-n', '--num_points', dest='num_points', type=int, default=10000,
+                        help='number of points of the sweep')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='number of repetitions, the best one is reported')
+
+    args = parser.parse_args()
+
+    inputcard = Inputcard()
+    inputcard.read_in_json(pl.Path(args.json_inp_path))
+    cards = sweep_cards(inputcard, args.num_points)
+
+    # uncached: every section is rendered for every card, cached: only the lattice and k-point sections change
+    for label, cached in [('uncached', False), ('cached', True)]:
+        rate = max(bench(cards, cached) for _ in range(args.repeat))
+        print(f"{label:<10}{len(cards)} cards: {rate:10.0f} cards/s", file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,27 @@
 import pathlib as pl
 import argparse
+import os
 import sys
 import numpy as np
 import pandas as pd
 import json
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
 
+from kkr_output import read_scf_iterations, read_last_iteration
 from lattice_relaxation import lattice_relax_postprocessing
-from matplotlib.ticker import StrMethodFormatter
+from results_db import ResultsDB
+from sweep_common import file_signature
+
+# per group data of the last crawl of a sweep, with the signature of the point files it was read from
+_CACHE_NAME = 'convergence_cache.json'
+# point files a group's data is read from
+_POINT_FILES = ['inputcard.json', 'output.csv', 'scf-calc/kkr.out']
 
 
 def plot_convergence(conv_para, values, unit, bound, out_path, converged_value = None, converged_para=None, size=None):
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import StrMethodFormatter
+
     if not size:
         size = (8,6)
     
@@ -38,72 +49,202 @@ def plot_convergence(conv_para, values, unit, bound, out_path, converged_value =
     plt.close()
 
 
-def determine_lat_convergence(path, conv_parameter, lat_threshold, en_threshold=1e-6, comparisons = 2):
-    energy_conv = []
-    convergence_path = path / 'convergence.csv'
-    if not convergence_path.exists():
-        for conv_path in path.iterdir():
-            print(conv_path)
-            
-            # read out the convergence_parameter and the energy of one of the sp calcs
-            lat_dirs = [sub_path for sub_path in sorted(conv_path.iterdir())]
-            lat_dir = lat_dirs[int(len(lat_dirs)/2)]
-            
-            with open(lat_dir / 'inputcard.json') as f:
-                inputcard_data = json.loads(f.read())
-
-            conv_para_value = inputcard_data[conv_parameter[0]][conv_parameter[1]]
-            if type(conv_para_value) == list:
-                conv_para_value = conv_para_value[0]
-
-            en_data = pd.read_csv(lat_dir / 'output.csv', index_col=0).loc['e_tot']
-            
-            if (conv_path / 'lat_const_out.csv').exists():
-                lat_data = pd.read_csv(conv_path / 'lat_const_out.csv').iloc[0]
-            else:
-                lat_data = lattice_relax_postprocessing(conv_path)
-
-            energy_conv.append([conv_para_value, en_data.value, en_data.unit, lat_data.value, lat_data.unit])
-        
-        energy_conv = pd.DataFrame(energy_conv, columns=['conv_para', 'e_tot', 'e_tot_unit', 'lat_const', 'lat_const_unit'])
-        energy_conv.set_index('conv_para', inplace=True)
-        
-        # save the convergence data
-        energy_conv.sort_index(inplace=True)
-        energy_conv.to_csv(convergence_path)
-    else:
-        energy_conv = pd.read_csv(convergence_path, index_col='conv_para')
+def plot_scf_history(iterations, bound, out_path, size=None):
+    # rms-error and fermi energy of every iteration of a single scf calculation
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import StrMethodFormatter
 
-    # check for convergence
-    if (path / 'output.dat').exists():
-        (path / 'output.dat').unlink()
+    if not size:
+        size = (8,6)
+
+    steps = [iteration.iteration for iteration in iterations]
+
+    fig, (ax_rms, ax_fermi) = plt.subplots(2,1, figsize=size, sharex=True)
+    ax_rms.semilogy(steps, [iteration.rms_error for iteration in iterations], marker='.')
+    ax_rms.axhline(bound, color='grey', linestyle='--')
+    ax_rms.set_ylabel('average rms-error')
+
+    ax_fermi.plot(steps, [iteration.e_fermi for iteration in iterations], marker='.')
+    ax_fermi.yaxis.set_major_formatter(StrMethodFormatter('{x:.5f}'))
+    ax_fermi.set_xlabel('Iteration')
+    ax_fermi.set_ylabel('$E_F$ [Ry]')
+
+    fig.savefig(out_path)
+    plt.close()
+
+
+def plot_scf_histories(path, kkr_out_file='kkr.out'):
+    # plots the scf history of every point calculation below path into <point>/scf_plot.png
+    for kkr_out_path in sorted(path.glob(f'*/*/scf-calc/{kkr_out_file}')):
+        point_path = kkr_out_path.parent.parent
+        with open(point_path / 'inputcard.json') as f:
+            bound = json.loads(f.read())['scf-cycle']['QBOUND']
+
+        plot_scf_history(read_scf_iterations(kkr_out_path), bound, point_path / 'scf_plot.png')
+
+
+def _conv_para_value(inputcard_data, conv_parameter):
+    conv_para_value = inputcard_data[conv_parameter[0]][conv_parameter[1]]
+    if type(conv_para_value) == list:
+        conv_para_value = conv_para_value[0]
+    return conv_para_value
+
+
+def read_group(conv_path, conv_parameter, results_db=None):
+    """
+    convergence parameter, energy (of the middle point) and equilibrium lattice constant of the conv_* directory conv_path
+    --> runs the lattice relaxation postprocessing if it wasn't done yet
+    --> with results_db the group is queried from it, the files are only read for groups without recorded points
+    """
+    points = results_db.group_points(conv_path) if results_db is not None else []
+    if points:
+        point = points[int(len(points)/2)]
+        group = results_db.group(conv_path)
+        # a fit recorded before the last point is outdated
+        if group is not None and group['recorded'] >= max(point['recorded'] for point in points):
+            lat_value, lat_unit = group['eq_lat_const'], group['lat_const_unit']
+        else:
+            lat_data = lattice_relax_postprocessing(conv_path, results_db)
+            lat_value, lat_unit = lat_data.value, lat_data.unit
+
+        return [_conv_para_value(point['parameters'], conv_parameter), point['e_tot'], point['energy_unit'], lat_value, lat_unit]
 
-    old = 0
+    # read out the convergence_parameter and the energy of one of the sp calcs
+    lat_dirs = [sub_path for sub_path in sorted(conv_path.iterdir()) if sub_path.is_dir()]
+    lat_dir = lat_dirs[int(len(lat_dirs)/2)]
+
+    with open(lat_dir / 'inputcard.json') as f:
+        conv_para_value = _conv_para_value(json.loads(f.read()), conv_parameter)
+
+    if (lat_dir / 'output.csv').exists():
+        en_data = pd.read_csv(lat_dir / 'output.csv', index_col=0).loc['e_tot']
+    else:
+        # postprocessing was not run (yet) - take the energy straight from the kkr output
+        en_data = pd.Series({'value': read_last_iteration(lat_dir / 'scf-calc' / 'kkr.out').e_tot, 'unit': 'Ry'})
+
+    # a fit older than one of the point outputs is outdated
+    lat_out_signature = file_signature(conv_path / 'lat_const_out.csv')
+    csv_signatures = [file_signature(sub_path / 'output.csv') for sub_path in lat_dirs]
+    if lat_out_signature is not None and all(lat_out_signature[1] >= signature[1] for signature in csv_signatures if signature is not None):
+        lat_data = pd.read_csv(conv_path / 'lat_const_out.csv').iloc[0]
+    else:
+        lat_data = lattice_relax_postprocessing(conv_path, results_db)
+
+    return [conv_para_value, en_data.value, en_data.unit, lat_data.value, lat_data.unit]
+
+
+def _numeric(value):
+    # conv_para values sort by number (10, 15, 100), values that aren't numbers after them
+    try:
+        return (0, float(value), '')
+    except (TypeError, ValueError):
+        return (1, 0, str(value))
+
+
+def group_signature(conv_path):
+    # size and mtime of the point files of a conv_* directory, changes as soon as one of its points does
+    return {sub_path.name: [file_signature(sub_path / point_file) for point_file in _POINT_FILES]
+            for sub_path in sorted(conv_path.iterdir()) if sub_path.is_dir()}
+
+
+def crawl_groups(path, conv_parameter, groups, results_db=None, max_workers=None):
+    """
+    reads the groups (conv_* directories) of the sweep path in parallel and returns their data sorted by the convergence parameter
+    --> the data of every group is cached in <path>/convergence_cache.json, only groups whose points changed are read again
+    --> groups without point directories are skipped
+    """
+    cache_path = path / _CACHE_NAME
+    cache = {}
+    if cache_path.exists():
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+
+    def crawl(conv_path):
+        signature = group_signature(conv_path)
+        if not signature:
+            return None
+        entry = cache.get(str(conv_path.resolve()))
+        if entry is not None and entry['conv_parameter'] == list(conv_parameter) and entry['signature'] == signature:
+            return entry
+        # one write per line, the groups are read in parallel
+        print(f'{conv_path}\n', end='')
+        row = [value.item() if isinstance(value, np.generic) else value for value in read_group(conv_path, conv_parameter, results_db)]
+        return {'conv_parameter': list(conv_parameter), 'signature': signature, 'row': row}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        entries = list(pool.map(crawl, groups))
+
+    for conv_path, entry in zip(groups, entries):
+        if entry is not None:
+            cache[str(conv_path.resolve())] = entry
+    # written next to the cache and renamed, an interrupted crawl leaves the old cache
+    tmp_path = cache_path.with_name(f'.{cache_path.name}.{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+    energy_conv = pd.DataFrame([entry['row'] for entry in entries if entry is not None],
+                               columns=['conv_para', 'e_tot', 'e_tot_unit', 'lat_const', 'lat_const_unit'])
+    energy_conv.set_index('conv_para', inplace=True)
+    return energy_conv.sort_index(key=lambda index: pd.Index([_numeric(value) for value in index]))
+
+
+def convergence_window(lat_consts, energies, lat_threshold, en_threshold=1e-6, comparisons=2, full_windows=False):
+    """
+    checks values ordered by the convergence parameter: the calculation is converged at the first value from which on the
+    lattice constants and energies of up to comparisons + 1 consecutive values agree within the thresholds
+    --> with full_windows only windows of comparisons + 1 values count (for values not starting at the smallest one)
+    --> returns whether it is converged and the index of that value (without convergence the start of the last window)
+    """
     old_lats = []
     old_energies = []
 
-    print(energy_conv)
-    for lat_const_idx in range(energy_conv.lat_const.size):
-        lat_const = energy_conv.iloc[lat_const_idx].lat_const
-        energy = energy_conv.iloc[lat_const_idx].e_tot
-        
+    for idx, (lat_const, energy) in enumerate(zip(lat_consts, energies)):
         lat_diffs = [np.abs(old_lat - lat_const) for old_lat in old_lats]
         en_diffs = [np.abs(energy - old_energy) for old_energy in old_energies]
-        
-        print(np.all(np.array(lat_diffs) < lat_threshold) and np.all(np.array(en_diffs) < en_threshold))
-
-        if np.all(np.array(lat_diffs) < lat_threshold) and np.all(np.array(en_diffs) < en_threshold) and lat_diffs != []:
-            print(energy_conv.iloc[lat_const_idx-len(old_lats)].name)
-            with open(path/'output.dat', 'w') as f:             
-                f.write(f'Lattice Convergence up to {lat_threshold}  and Energy Convergence up to {en_threshold} was achieved with {energy_conv.iloc[lat_const_idx - len(old_lats)].name} {conv_parameter[1]}')
-            break
-            
+
+        if np.all(np.array(lat_diffs) < lat_threshold) and np.all(np.array(en_diffs) < en_threshold) and lat_diffs != [] \
+                and (not full_windows or len(old_lats) == comparisons):
+            return True, idx - len(old_lats)
+
         old_lats.append(lat_const)
         old_energies.append(energy)
         if len(old_lats) > comparisons:
             old_lats.pop(0)
             old_energies.pop(0)
 
+    return False, len(lat_consts) - 1 - len(old_lats)
+
+
+def determine_lat_convergence(path, conv_parameter, lat_threshold, en_threshold=1e-6, comparisons = 2, groups=None, full_windows=False,
+                              results_db=None, max_workers=None):
+    # groups limits the check to these conv_* directories (e.g. the ones fitted so far), default are all conv_* directories in path
+    # full_windows only counts windows of comparisons + 1 values (see convergence_window)
+    # with results_db the groups and their points are queried from it instead of read from the files
+    # convergence.csv is rewritten by every check, it is only read if there are no groups (e.g. a copied sweep without the calculations)
+    convergence_path = path / 'convergence.csv'
+    if groups is None and results_db is not None:
+        groups = results_db.sweep_groups(path) or None
+    if groups is None:
+        groups = [conv_path for conv_path in path.glob('conv_*') if conv_path.is_dir()]
+
+    if groups or not convergence_path.exists():
+        energy_conv = crawl_groups(path, conv_parameter, groups, results_db, max_workers)
+        # save the convergence data
+        energy_conv.to_csv(convergence_path)
+    else:
+        energy_conv = pd.read_csv(convergence_path, index_col='conv_para')
+
+    # check for convergence
+    if (path / 'output.dat').exists():
+        (path / 'output.dat').unlink()
+
+    print(energy_conv)
+    converged, conv_idx = convergence_window(energy_conv.lat_const, energy_conv.e_tot, lat_threshold, en_threshold, comparisons, full_windows)
+    if converged:
+        print(energy_conv.iloc[conv_idx].name)
+        with open(path/'output.dat', 'w') as f:
+            f.write(f'Lattice Convergence up to {lat_threshold}  and Energy Convergence up to {en_threshold} was achieved with {energy_conv.iloc[conv_idx].name} {conv_parameter[1]}')
 
     # plot energy convergence
     plot_convergence(conv_para  = energy_conv.index, 
@@ -112,8 +253,8 @@ def determine_lat_convergence(path, conv_parameter, lat_threshold, en_threshold=
                      bound      = en_threshold, 
                      out_path   = path / 'energy_plot',
                      size       = (12,7),
-                     converged_value    = energy_conv.iloc[lat_const_idx - len(old_energies)].e_tot,
-                     converged_para     = energy_conv.iloc[lat_const_idx- len(old_energies)].name
+                     converged_value    = energy_conv.iloc[conv_idx].e_tot,
+                     converged_para     = energy_conv.iloc[conv_idx].name
                      )
     # plot lattice data convergence
     plot_convergence(conv_para          = energy_conv.index, 
@@ -121,9 +262,11 @@ def determine_lat_convergence(path, conv_parameter, lat_threshold, en_threshold=
                      unit               = energy_conv.loc[:,'lat_const_unit'].iloc[0], 
                      bound              = lat_threshold, 
                      out_path           = path / 'lat_plot', 
-                     converged_value    = energy_conv.iloc[lat_const_idx - len(old_lats)].lat_const, 
-                     converged_para     = energy_conv.iloc[lat_const_idx - len(old_lats)].name
+                     converged_value    = energy_conv.iloc[conv_idx].lat_const, 
+                     converged_para     = energy_conv.iloc[conv_idx].name
                      )
+
+    return converged, energy_conv.iloc[conv_idx].name
     
     
 
@@ -145,13 +288,25 @@ def main():
     parser.add_argument('--convergence_criterion', dest='conv_crit', default='lat-const',
                         help='the criterion on which the convergence of the calculation is to be evaluated # so far only lat-const implemented for now only 2 option <lat-const> and <energy>')
 
+    parser.add_argument('--results_db', dest='results_db', default=None,
+                        help='results database of the project (see results_db.py), the groups and points are queried from it instead of read from the files')
+
+    parser.add_argument('--max_workers', dest='max_workers', type=int, default=None,
+                        help='number of groups read at the same time. Default is chosen by the thread pool')
+
+    parser.add_argument('--plot_scf', dest='plot_scf', action='store_true',
+                        help='flag to plot the rms-error and fermi energy history of every point calculation into <point>/scf_plot.png')
 
 
     args = parser.parse_args()
 
     if args.conv_crit == 'lat-const':
         out_path = pl.Path(args.path)
-        determine_lat_convergence(out_path, args.conv_paras.split(':'), args.c_bound)
+        results_db = ResultsDB(args.results_db) if args.results_db else None
+        determine_lat_convergence(out_path, args.conv_paras.split(':'), args.c_bound, results_db=results_db, max_workers=args.max_workers)
+
+    if args.plot_scf:
+        plot_scf_histories(pl.Path(args.path))
 
 
 
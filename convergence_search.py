@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# strategies to find the converged value of a convergence parameter without calculating every value of the range
+# --> evaluate(idx) calculates value idx (ascending order) and returns its result
+# --> check(results, start) tells if the results of the consecutive values start, start + 1, ... are converged
+#     (e.g. convergence_window, with full windows only if start > 0)
+
+
+def _contiguous(results, start=0):
+    # results of the consecutive values start, start + 1, ... evaluated so far
+    contiguous = []
+    while start + len(contiguous) in results:
+        contiguous.append(results[start + len(contiguous)])
+    return contiguous
+
+
+def sequential_search(num_values, evaluate, check, parallel=1):
+    """
+    evaluates the values in ascending order, at most parallel at a time, until check holds for the consecutive values
+    finished so far - values that weren't started by then are cancelled (also if evaluate raises for a value)
+    --> returns the results {idx: result}, whether check held and the first value checked (0)
+    """
+    results = {}
+    converged = False
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = {pool.submit(evaluate, idx): idx for idx in range(num_values)}
+        pending = set(futures)
+        try:
+            while pending and not converged:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[futures[future]] = future.result()
+                converged = check(_contiguous(results), 0)
+        finally:
+            # converged or a value failed, the values not started yet aren't needed (the pool waits for them otherwise)
+            for future in pending:
+                future.cancel()
+
+    # values that were already running when the convergence was established
+    for future in pending:
+        if not future.cancelled():
+            results[futures[future]] = future.result()
+
+    return results, converged, 0
+
+
+def bisection_search(num_values, evaluate, agree, check, window, parallel=1):
+    """
+    assumes the results approach the one of the largest value monotonically: evaluates the largest value as reference,
+    bisects for the smallest value agreeing with it (agree(result, reference)) and checks the consecutive values from
+    window - 1 values below it on, evaluating window values at a time (at most parallel at once) until check holds
+    --> returns the results {idx: result}, whether check held and the first value checked
+    """
+    results = {}
+
+    def run(indices):
+        missing = [idx for idx in indices if idx not in results]
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            for idx, result in zip(missing, pool.map(evaluate, missing)):
+                results[idx] = result
+
+    top = num_values - 1
+    run([top])
+
+    low, high = 0, top
+    while low < high:
+        mid = (low + high) // 2
+        run([mid])
+        if agree(results[mid], results[top]):
+            high = mid
+        else:
+            low = mid + 1
+
+    # the smallest agreeing value can only be converged together with the values below it
+    start = max(low - window + 1, 0)
+    while True:
+        contiguous = _contiguous(results, start)
+        run(range(start + len(contiguous), min(start + len(contiguous) + window, num_values)))
+
+        contiguous = _contiguous(results, start)
+        converged = check(contiguous, start)
+        if converged or start + len(contiguous) >= num_values:
+            return results, converged, start
@@ -1,10 +1,17 @@
 import pathlib as pl
 import argparse
+import shlex
+import sys
 import numpy as np
-from subprocess import run
+from concurrent.futures import ThreadPoolExecutor
 
 from inputcard_converter import Inputcard
-from lattice_relaxation import prepare_lattice_relaxation
+from lattice_relaxation import prepare_lattice_relaxation, relax_adaptive
+from executor import SlurmExecutor, LocalExecutor
+from task_manifest import write_manifest
+from convergence_check import read_group, convergence_window, determine_lat_convergence
+from convergence_search import sequential_search, bisection_search
+from results_db import ResultsDB
 
 
 def main():
@@ -27,25 +34,62 @@ def main():
     parser.add_argument('--convergence_criterion', dest='conv_crit', default='lat-const',
                         help='the criterion on which the convergence of the calculation is to be evaluated # so far only lat-const implemented for now only 2 option <lat-const> and <energy>')
     
+    parser.add_argument('-b', '--conv_bound', dest='c_bound', type=float, default=None,
+                        help='bound on the lattice constant to achieve convergence (a0), needed by the sequential and bisection search')
+    parser.add_argument('--energy_bound', dest='en_bound', type=float, default=1e-6,
+                        help='bound on the total energy to achieve convergence (Ry)')
+    parser.add_argument('--comparisons', dest='comparisons', type=int, default=2,
+                        help='number of previous values a value has to agree with to be converged')
+    parser.add_argument('--search', dest='search', choices=['full', 'sequential', 'bisection'], default='full',
+                        help='<full> calculates every value of the range (default), <sequential> calculates the values in ascending order and stops '
+                             'once converged, <bisection> bisects for the smallest value agreeing with the largest one and checks the values from '
+                             'there on (both local executor only)')
+    parser.add_argument('--parallel_groups', dest='parallel_groups', type=int, default=None,
+                        help='number of values calculated at the same time by the sequential search. Default is comparisons + 1')
+
     parser.add_argument('--perform_lat_relaxation', dest='lat_bool', action='store_true',
                         help='flag for calculating the lattice constant, while not taking the convergence on lattice constant as the convergence criterion')
     parser.add_argument('--max_deviation', dest='max_dev', default=5,
                         help='max deviation of the lattice constant if > 1 in percent')
     parser.add_argument('--num_energy_points', dest='en_points', type=int, default=5,
                         help='number of energy points to be calculated for the lattice relaxation')
+    parser.add_argument('--adaptive_relaxation', dest='adaptive', action='store_true',
+                        help='place the energy points of every lattice relaxation one by one where they reduce the error of the equilibrium lattice constant most (local executor only)')
+    parser.add_argument('--lat_tolerance', dest='lat_tol', type=float, default=1e-3,
+                        help='error of the equilibrium lattice constant (in a0) at which the adaptive relaxation stops')
+    parser.add_argument('--max_energy_points', dest='max_en_points', type=int, default=9,
+                        help='maximal number of energy points of an adaptive relaxation')
 
     parser.add_argument('--slurm_script', dest='slurm_script', default='/home/agHeiliger/lauerm/bin/kkr_workflows/inputcard-converter/slurm_conv_s1.job',
                         help='path to the slurm script to be started at the end of the directory creation')
 
     parser.add_argument('--slurm_script_save_name', dest='slurm_name', default='',
                         help='name how the slurm_script is saved in path')
+
+    parser.add_argument('--executor', dest='executor', choices=['slurm', 'local'], default='slurm',
+                        help='<slurm> submits the sweep as array job (default), <local> runs all point calculations on this machine')
+    parser.add_argument('--kkr_cmd', dest='kkr_cmd', default='kkr.x',
+                        help='command of the kkr code used by the local executor (inputcard.scf is appended), e.g. a stub for testing')
+    parser.add_argument('--max_workers', dest='max_workers', type=int, default=None,
+                        help='number of point calculations run at the same time by the local executor. Default is one per cpu slot')
+    parser.add_argument('--cpus_per_task', dest='cpus_per_task', type=int, default=1,
+                        help='cpus (OMP_NUM_THREADS) of every point calculation of the local executor')
+    parser.add_argument('--pin_cpus', dest='pin_cpus', action='store_true',
+                        help='pin every point calculation of the local executor to its own cpus')
+    parser.add_argument('--supervise', dest='supervise', action='store_true',
+                        help='run the kkr code of the local executor under scf_supervisor.py')
+    parser.add_argument('--results_db', dest='results_db', default=None,
+                        help='results database the local executor records the points in (and the searches query), e.g. <project>/results.sqlite')
     # parser.add_argument('--slurm_script_name', dest='slurm_job_name', default='',
     #                     help='name how the slurm job is named')
     # This should definitly be a option in the new one yeah this would be very useful
     
     
     args = parser.parse_args()
-
+    if args.adaptive and args.executor != 'local':
+        parser.error('--adaptive_relaxation places every point after the previous ones finished and needs --executor local')
+    if args.search != 'full' and (args.executor != 'local' or args.c_bound is None):
+        parser.error(f'--search {args.search} checks the convergence while calculating and needs --executor local and --conv_bound')
 
 
     inputcard = Inputcard()
@@ -58,6 +102,8 @@ def main():
     conv_para_vals = [conv_para.split(':')[1] for conv_para in args.conv_paras]
     
     proto_change_dict = {key: {} for key in set(conv_para_keys)}
+    task_paths = []
+    groups = []
 
     if args.conv_crit == 'lat-const' or args.lat_bool:
 
@@ -73,20 +119,66 @@ def main():
                 inputcard.change_parameter(key, change_dict[key])
 
             para_path = path / f"conv_{para}"
-            prepare_lattice_relaxation(para_path, inputcard, args.max_dev, args.en_points)
+            if args.adaptive or args.search != 'full':
+                groups.append((para_path, inputcard.copy()))
+            else:
+                task_paths += prepare_lattice_relaxation(para_path, inputcard, args.max_dev, args.en_points)
 
-    slurm_path = pl.Path(args.slurm_script)
-    if args.slurm_name == '':
-        slurm_name = slurm_path.name
+    if args.executor == 'slurm':
+        executor = SlurmExecutor(args.slurm_script, args.slurm_name)
     else:
-        slurm_name = args.slurm_name 
-    
-    task_num = int(args.en_points) * len(conv_check) - 1
-    #change the array size of the slurm script and save it in the specified path
-    change_slurm_script_cmd = f"sed 's/CHANGE/{task_num}/g' {args.slurm_script} > {path.parent / slurm_name}"
-    run(change_slurm_script_cmd, shell=True)
-    sbatch_cmd = f"sbatch {path.parent / slurm_name} -p {path} -w {",".join(args.weight_rel)} -e {args.en_points}"
-    run(sbatch_cmd, shell=True)
+        executor = LocalExecutor(shlex.split(args.kkr_cmd), args.max_workers, args.cpus_per_task, args.pin_cpus, supervise=args.supervise,
+                                 results_db=args.results_db)
+
+    if args.adaptive or args.search != 'full':
+        # the lattice relaxations of the groups run at the same time and share the cpu slots of the executor
+        free_slots = executor.slot_queue()
+        results_db = ResultsDB(args.results_db) if args.results_db else None
+        conv_parameter = args.conv_paras[0].split(':')
+
+        def relax(idx):
+            para_path, group_inputcard = groups[idx]
+            if args.adaptive:
+                run_points = lambda calc_paths: executor.run_tasks(calc_paths, args.weight_rel, free_slots)
+                eq_lat_const, error, num_points = relax_adaptive(para_path, group_inputcard, float(args.max_dev), run_points, args.lat_tol,
+                                                                 max_points=args.max_en_points, results_db=results_db)
+                print(f"{para_path}: equilibrium lattice constant {eq_lat_const} +- {error} after {num_points} points", file=sys.stderr)
+            else:
+                executor.run_tasks(prepare_lattice_relaxation(para_path, group_inputcard, args.max_dev, args.en_points), args.weight_rel, free_slots)
+            return read_group(para_path, conv_parameter, results_db)
+
+        if args.search == 'full':
+            with ThreadPoolExecutor(max_workers=max(len(groups), 1)) as pool:
+                list(pool.map(relax, range(len(groups))))
+            return
+
+        def check(results, start):
+            return convergence_window([result[3] for result in results], [result[1] for result in results], args.c_bound, args.en_bound,
+                                      args.comparisons, full_windows=start > 0)[0]
+
+        def agree(result, reference):
+            return abs(result[3] - reference[3]) < args.c_bound and abs(result[1] - reference[1]) < args.en_bound
+
+        parallel = args.parallel_groups or args.comparisons + 1
+        if args.search == 'sequential':
+            results, converged, start = sequential_search(len(groups), relax, check, parallel)
+        else:
+            results, converged, start = bisection_search(len(groups), relax, agree, check, args.comparisons + 1, parallel)
+        print(f"{len(results)} of {len(groups)} values calculated, {'converged' if converged else 'not converged'}", file=sys.stderr)
+
+        # convergence.csv, output.dat and the plots of the consecutive values checked last
+        checked = []
+        while start + len(checked) in results:
+            checked.append(groups[start + len(checked)][0])
+        determine_lat_convergence(path, conv_parameter, args.c_bound, args.en_bound, args.comparisons, groups=checked, full_windows=start > 0,
+                                  results_db=results_db)
+        return
+
+    # array task n runs the point calculation in record n of the manifest
+    write_manifest(path, task_paths)
+
+    num_tasks = len(task_paths)
+    executor.submit(path, args.weight_rel, args.en_points, num_tasks)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,165 @@
+import pathlib as pl
+import os
+import queue
+import subprocess
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from task_manifest import MANIFEST_NAME, read_manifest
+
+_SCRIPT_DIR = pl.Path(__file__).resolve().parent
+_PRE_PY = _SCRIPT_DIR / 'scf_pre_old.py'
+_POST_PY = _SCRIPT_DIR / 'scf_post_old.py'
+_SUPER_PY = _SCRIPT_DIR / 'scf_supervisor.py'
+
+_JSON_NAME = 'inputcard.json'
+_INPUTCARD_NAME = 'inputcard.scf'
+
+# sets the cpu affinity and replaces itself by the command, children (kkr, voronoi, openmp threads) inherit the affinity
+_PIN_SCRIPT = "import os, sys; os.sched_setaffinity(0, [int(cpu) for cpu in sys.argv[1].split(',')]); os.execvp(sys.argv[2], sys.argv[2:])"
+
+TaskResult = namedtuple('TaskResult', ['task_path', 'scf_path', 'stage', 'exit_code', 'converged', 'message'])
+
+
+def sweep_tasks(path):
+    # point calculations <path>/<group>/<task> of a sweep, in the order of the task manifest (if written) or sorted
+    if (path / MANIFEST_NAME).exists():
+        return read_manifest(path / MANIFEST_NAME)
+    groups = sorted(group for group in path.iterdir() if group.is_dir())
+    return [task for group in groups for task in sorted(task for task in group.iterdir() if task.is_dir())]
+
+
+class SlurmExecutor:
+    """
+    submits the whole sweep as one SLURM array job - slurm_script is saved as <path>/../<slurm_name>
+    with CHANGE replaced by the last array index
+    """
+
+    def __init__(self, slurm_script, slurm_name=''):
+        self.slurm_script = pl.Path(slurm_script)
+        self.slurm_name = slurm_name if slurm_name else self.slurm_script.name
+
+    def submit(self, path, weight_relation, en_points, num_tasks):
+        job_path = path.parent / self.slurm_name
+        with open(self.slurm_script, 'r') as f:
+            job_script = f.read()
+        with open(job_path, 'w') as f:
+            f.write(job_script.replace('CHANGE', str(num_tasks - 1)))
+
+        subprocess.run(['sbatch', job_path, '-p', path, '-w', ",".join(weight_relation), '-e', str(en_points)])
+
+
+class LocalExecutor:
+    """
+    runs preprocessing, kkr code and postprocessing of every point calculation of a sweep on this machine
+    --> at most max_workers points at a time, each gets cpus_per_task cpus (OMP_NUM_THREADS, pinned with pin_cpus)
+    --> with pin_cpus max_workers is limited to the number of cpus / cpus_per_task
+    --> kkr_cmd is the command of the kkr code (list, inputcard.scf is appended) - can be a stub for testing
+    --> with supervise the kkr code runs under scf_supervisor.py, restarting runs that don't converge
+    --> with results_db the postprocessing records every point in this results database
+    """
+
+    def __init__(self, kkr_cmd=['kkr.x'], max_workers=None, cpus_per_task=1, pin_cpus=False, kkr_out_file='kkr.out',
+                 supervise=False, pre_args=[], results_db=None):
+        self.kkr_cmd = list(kkr_cmd)
+        self.cpus_per_task = cpus_per_task
+        self.pin_cpus = pin_cpus
+        self.kkr_out_file = kkr_out_file
+        self.supervise = supervise
+        self.pre_args = list(pre_args)
+        self.post_args = ['--results_db', results_db] if results_db is not None else []
+
+        cpus = sorted(os.sched_getaffinity(0))
+        self.slots = [cpus[idx:idx + cpus_per_task] for idx in range(0, len(cpus) - cpus_per_task + 1, cpus_per_task)]
+        if not self.slots:
+            raise ValueError(f"{cpus_per_task} cpus per task requested, only {len(cpus)} available")
+        # pinned tasks never share cpus, without pinning more tasks than slots may run (e.g. waiting on a stub)
+        self.max_workers = max_workers or len(self.slots)
+        if pin_cpus:
+            self.max_workers = min(self.max_workers, len(self.slots))
+
+    def _run(self, cmd, slot, **kwargs):
+        cmd = [str(arg) for arg in cmd]
+        if self.pin_cpus:
+            cmd = [sys.executable, '-c', _PIN_SCRIPT, ",".join(str(cpu) for cpu in slot)] + cmd
+        env = dict(os.environ, OMP_NUM_THREADS=str(len(slot)))
+        return subprocess.run(cmd, env=env, **kwargs)
+
+    def run_pre(self, task_path, weight_relation, slot):
+        pre = self._run([sys.executable, _PRE_PY, '-p', task_path, '-i', task_path / _JSON_NAME, '-w', *weight_relation,
+                         '--write_json_inputcard', *self.pre_args], slot, capture_output=True, text=True)
+        if pre.returncode != 0:
+            return TaskResult(task_path, None, 'pre', pre.returncode, False, pre.stderr.strip())
+        return TaskResult(task_path, pl.Path(pre.stdout.split('\n')[-2]), 'pre', 0, False, '')
+
+    def run_kkr(self, task_path, scf_path, slot):
+        if self.supervise:
+            kkr = self._run([sys.executable, _SUPER_PY, '-p', scf_path, '--kkr_output_name', self.kkr_out_file, '--', *self.kkr_cmd,
+                             _INPUTCARD_NAME], slot, capture_output=True, text=True)
+            message = kkr.stderr.strip()
+        else:
+            with open(scf_path / self.kkr_out_file, 'w') as out_file:
+                kkr = self._run([*self.kkr_cmd, _INPUTCARD_NAME], slot, cwd=scf_path, stdout=out_file, stderr=subprocess.STDOUT)
+            message = ''
+        return TaskResult(task_path, scf_path, 'kkr', kkr.returncode, False, message)
+
+    def run_post(self, task_path, scf_path, slot):
+        post = self._run([sys.executable, _POST_PY, '-p', scf_path, '-i', task_path / _JSON_NAME, '--kkr_output_name', self.kkr_out_file,
+                          *self.post_args], slot, capture_output=True, text=True)
+        if post.returncode != 0:
+            return TaskResult(task_path, scf_path, 'post', post.returncode, False, post.stderr.strip())
+        return TaskResult(task_path, scf_path, 'done', 0, (scf_path / 'CONVERGED').exists(), '')
+
+    def run_task(self, task_path, weight_relation, slot):
+        # the steps of one array task of slurm_conv_s1.job
+        pre = self.run_pre(task_path, weight_relation, slot)
+        if pre.exit_code != 0:
+            return pre
+
+        kkr = self.run_kkr(task_path, pre.scf_path, slot)
+        if kkr.exit_code != 0:
+            return kkr
+
+        post = self.run_post(task_path, pre.scf_path, slot)
+        return post._replace(message=kkr.message) if post.exit_code == 0 else post
+
+    def slot_queue(self):
+        # every running task holds one cpu slot
+        free_slots = queue.Queue()
+        for idx in range(self.max_workers):
+            free_slots.put(self.slots[idx % len(self.slots)])
+        return free_slots
+
+    def submit(self, path, weight_relation, en_points=None, num_tasks=None):
+        """
+        runs all point calculations below path and returns their TaskResult (in the order of the tasks)
+        --> en_points and num_tasks are only used by the SLURM executor
+        """
+        return self.run_tasks(sweep_tasks(path), weight_relation)
+
+    def run_tasks(self, tasks, weight_relation, free_slots=None):
+        # runs the point calculations tasks, callers running tasks concurrently share the cpu slots with free_slots
+        if free_slots is None:
+            free_slots = self.slot_queue()
+
+        def run_with_slot(task_path):
+            slot = free_slots.get()
+            try:
+                return self.run_task(task_path, weight_relation, slot)
+            finally:
+                free_slots.put(slot)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(run_with_slot, task_path): task_path for task_path in tasks}
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+
+                state = ('converged' if result.converged else 'not converged') if result.stage == 'done' else f'failed in {result.stage}'
+                print(f"[{len(results)}/{len(tasks)}] {result.task_path}: {state}", file=sys.stderr)
+                if result.stage != 'done' and result.message:
+                    print(result.message, file=sys.stderr)
+
+        return [results[task_path] for task_path in tasks]
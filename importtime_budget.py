@@ -0,0 +1,70 @@
+import pathlib as pl
+import argparse
+import subprocess
+import sys
+
+# cumulative import time (ms, python -X importtime) allowed for the modules started once per array task
+# --> 30-60 ms each without numpy/pandas/scipy/matplotlib, which alone take 100-600 ms
+IMPORT_BUDGET = {
+    'inputcard_converter': 40,
+    'scf_pre_old': 80,
+    'scf_post_old': 80,
+    'scf_supervisor': 80,
+    'scf_worker': 80,
+}
+
+# modules the entry points above must not import
+HEAVY_MODULES = ['numpy', 'pandas', 'scipy', 'matplotlib']
+
+
+def measure_import(module, repeat=5):
+    """
+    imports module in fresh interpreters and returns the best cumulative import time in ms and the modules imported
+    """
+    best = None
+    imported = set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=pl.Path(__file__).parent,
+                                capture_output=True, text=True, check=True)
+
+        for line in output.stderr.splitlines():
+            if not line.startswith('import time:') or line.endswith('| imported package'):
+                continue
+            _, cumulative, name = line.split('|')
+            name = name.strip()
+            imported.add(name.split('.')[0])
+            if name == module:
+                time = int(cumulative) / 1000
+                best = time if best is None else min(best, time)
+
+    return best, imported
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Checks the import time of the per task entry points against their budget")
+
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5,
+                        help='number of imports per module, the fastest one counts')
+    parser.add_argument('-m', '--modules', dest='modules', nargs='*', default=list(IMPORT_BUDGET),
+                        help='modules to check. Default is all entry points with a budget')
+
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        time, imported = measure_import(module, args.repeat)
+        heavy = sorted(imported.intersection(HEAVY_MODULES))
+        budget = IMPORT_BUDGET.get(module)
+
+        # modules without a budget are only reported
+        ok = budget is None or (not heavy and time <= budget)
+        failed |= not ok
+        print(f"{module:<22}{time:8.1f} ms  budget {budget if budget else '-':>4} ms  {'ok' if ok else 'FAILED'}"
+              f"{'  imports ' + ', '.join(heavy) if heavy else ''}", file=sys.stdout)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,221 @@
 import json
-import numpy as np
+import os
+import re
+import _thread
 import pathlib as pl
+from functools import lru_cache, wraps
 
 from hardcoded import interface, zperiodl, linpol, mmin, decimation, ewald, constant_block
 
-#default_path = '/home/agHeiliger/lauerm/bin/kkr_workflows/inputcard-converter/default_parameter.json'
-default_path = '/home/mlauer/Documents/pre_aiida_automization/default_parameter.json'
-# default values for Inputcard
-with open(default_path, 'r') as jfile:
-    default = json.load(jfile)
+# default values for Inputcard - default_parameter.json next to this file, can be replaced with KKR_DEFAULT_PARAMETERS
+DEFAULT_PARAMETER_ENV = 'KKR_DEFAULT_PARAMETERS'
+_DEFAULT_PARAMETER_PATH = pl.Path(__file__).resolve().parent / 'default_parameter.json'
+
+@lru_cache(maxsize=None)
+def load_defaults(default_path=None):
+    """
+    reads the default parameters once per process (on first use, not on import)
+    --> the returned dict is shared by all cards and must not be changed
+    """
+    if default_path is None:
+        default_path = os.environ.get(DEFAULT_PARAMETER_ENV, _DEFAULT_PARAMETER_PATH)
+
+    with open(default_path, 'r') as jfile:
+        return json.load(jfile)
+
+def __getattr__(name):
+    # inputcard_converter.default is still available, but only read when it is used
+    if name == 'default':
+        return load_defaults()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _format_mixing(value):
+    # mixing factors are written with one decimal, unless this would round them (e.g. reduced by the scf supervisor)
+    if round(value, 1) == value:
+        return f"{value:.1f}"
+    return f"{value:g}"
+
+## precompiled renderer
+# the layout of the inputcard is split into sections, each rendered by a cached function of the parameters it depends on
+# --> changing e.g. the lattice constant of a card only renders the lattice section again
+_SECTION_CACHE_SIZE = 1024
+_SEPARATOR = f"\n{"+-------" * 7}+\n"
+_LINE = f"{"+-------" * 7}+\n"
+_BASIS_KEYS = ['NEMB', 'NEMBZ', 'KAOEZ', 'CARTESIAN']
+
+# constant blocks from hardcoded.py
+_CONSTANT_SECTION = "".join([constant_block, _SEPARATOR, interface, _SEPARATOR, zperiodl, _SEPARATOR, linpol, _SEPARATOR, mmin, _SEPARATOR])
+_TRAILER_SECTION = "".join([f"\n{"*" * 57}\n", decimation, _SEPARATOR, ewald, _SEPARATOR])
+
+_OPTIONS_HEADER = (f"{"":<9}***** Input file for TB-KKR code *****\n***** Generated using the Aiida Inputcard-parser *****\n"
+                   f"{"":<15}***Running options***\nRUNOPT\n")
+_TESTOPT_HEADER = f"{"":<15}***test options*** (2 lines)\nTESTOPT\n"
+_ENERGY_CONTOUR_HEADER = f"{"EMIN":<5}{"":<3}{"EMAX":<5}{"":<3}{"TEMPR":<5}{"":<3}{"NPOL":<5}{"":<3}{"NPT1":<5}{"":<3}{"NPT2":<5}{"":<3}{"NPT3":<5}{"":<3}\n"
+_SCF_CYCLE_HEADER = f"{"NSTEPS":<6}{"":<2}{"IMIX":<6}{"":<2}{"STRMIX":<6}{"":<2}{"FCM":<5}{"":<2}{"QBOUND":<7}{"":<2}{"BRYMIX":<6}{"":<2}{"ITDBRY":<6}{"":<2}\n"
+
+
+# json keeps the order of the dicts and writes 1, 1.0 and True (or 0.0 and -0.0) differently, as the inputcard does
+_section_key = json.JSONEncoder(check_circular=False, default=lambda value: value.tolist()).encode
+
+def _cached_section(func):
+    # caches the rendered section on its arguments, the oldest entry is dropped once the cache is full
+    # --> the lock keeps threads (e.g. of scf_worker.py) from dropping the same entry twice
+    cache = {}
+    # (the lock of threading, without importing threading - this module has an import budget)
+    lock = _thread.allocate_lock()
+
+    @wraps(func)
+    def render(*args):
+        key = _section_key(args)
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+
+        section = func(*args)
+        with lock:
+            if len(cache) >= _SECTION_CACHE_SIZE:
+                del cache[next(iter(cache))]
+            cache[key] = section
+        return section
+
+    render.cache = cache
+    return render
+
+def _vectors(vectors, spacing, prec):
+    parts = []
+    for vector in vectors:
+        parts.append(f"\n{"":<5}")
+        first = True
+        for component in vector:
+            if not component < 0 and first:
+                parts.append(" ")
+                first = False
+            parts.append(f"{spacing}{component:<13.{prec}f}")
+    return parts
+
+@_cached_section
+def _render_options(runopts, testopts):
+    parts = [_OPTIONS_HEADER]
+    parts += [f"{option:<8} " for option in runopts]
+    parts += [_SEPARATOR, _TESTOPT_HEADER]
+    for counter, option in enumerate(testopts, 1):
+        parts.append(f"{option:<8} ")
+        if counter == 6:
+            parts.append("\n")
+    if len(testopts) < 4:
+        parts.append("\n")
+    parts.append(_SEPARATOR)
+    return "".join(parts)
+
+@_cached_section
+def _render_general(gen_parameters, natyp):
+    return f"{"":<7}LMAX={gen_parameters['LMAX']}{"":<5}NSPIN={gen_parameters['NSPIN']}{"":<5}NATYP={natyp}{"":<5}KMT={gen_parameters['KMT']}{_SEPARATOR}"
+
+@_cached_section
+def _render_voro_opts(use_voro_opts, voro_opts):
+    parts = [f"JELLPATH='{Inputcard._DEFAULT_JELLPATH}/'\n"]
+    # new voronoi options are only written if voroOpts is in the test options
+    if use_voro_opts:
+        parts += [f"\n{option}={value}" for option, value in voro_opts.items()]
+    parts.append(_SEPARATOR)
+    return "".join(parts)
+
+@_cached_section
+def _render_lattice(lattice_constant, lattice_scaling, bravais_lattice, alat_prec, lat_prec):
+    parts = [
+        f"{"":<12}** Description of lattice **\n",
+        f"ALATBASIS= {lattice_constant:<9.{alat_prec}f} {1.0:<9.{alat_prec}f} {1.0:<9.{alat_prec}f} lattice constant\n",
+        f"BASISCALE= {lattice_scaling[0]:<9.{alat_prec}f} {lattice_scaling[0]:<9.{alat_prec}f} {lattice_scaling[0]:<9.{alat_prec}f} scaling factor\n",
+        # idk what LATTICE does so it is hard coded for now
+        "LATTICE=1\nBRAVAIS"
+    ]
+    parts += _vectors(bravais_lattice, f"{"":<2}", lat_prec)
+    parts.append(_SEPARATOR)
+    return "".join(parts)
+
+@_cached_section
+def _render_basis(natyp, basis_parameters, atom_basis, basis_scaling, alat_prec, lat_prec):
+    parts = [f"{"":<3}{'NAEZ':>6}={natyp:<7}"]
+    parts += [f"{para:>6}={basis_parameters[para]:<7}" for para in ['NEMB', 'NEMBZ', 'KAOEZ']]
+    parts.append(f'\nCARTESIAN= {basis_parameters['CARTESIAN']}{"":<5}//T - Cartesian Basis | F - Direct Basis\nRBASIS')
+    parts += _vectors(atom_basis, f"{"":<4}", lat_prec)
+    parts.append(f"\nSCALING=  {basis_scaling[0]:<16.{alat_prec}f} {basis_scaling[1]:<16.{alat_prec}f} {basis_scaling[2]:<16.{alat_prec}f}")
+    parts.append(_SEPARATOR)
+    return "".join(parts)
+
+@_cached_section
+def _render_atominfo(atominfo):
+    atominfo_terms = [term for term in Inputcard.ATOMINFO_TERMS if term in atominfo[0].keys()]
+
+    parts = ["ATOMINFO\n"]
+    parts += [f"{term:<7}{"":<2}" for term in atominfo_terms]
+    parts.append("\n")
+    for atom in atominfo:
+        parts += [f"{atom[term]:<7}{"":<2}" for term in atominfo_terms]
+        parts.append("\n")
+    parts.append(_LINE)
+    return "".join(parts)
+
+@_cached_section
+def _render_energy_contour(energy_contour):
+    return "".join([
+        _ENERGY_CONTOUR_HEADER,
+        f"{energy_contour['EMIN']:<5.2f}{"":<3}{energy_contour['EMAX']:<5.2f}{"":<3}{int(energy_contour['TEMPR']):<5}{"":<3}{int(energy_contour['NPOL']):<5}{"":<3}",
+        f"{int(energy_contour['NPTS'][0]):<5}{"":<3}{int(energy_contour['NPTS'][1]):<5}{"":<3}{int(energy_contour['NPTS'][2]):<5}{"":<3}\n",
+        _LINE
+    ])
+
+@_cached_section
+def _render_scf_cycle(scf_cyc):
+    return "".join([
+        _SCF_CYCLE_HEADER,
+        f"{int(scf_cyc['NSTEPS']):<6}{"":<2}{int(scf_cyc['IMIX']):<6}{"":<2}{_format_mixing(scf_cyc['STRMIX']):<6}{"":<2}{scf_cyc['FCM']:<5.1f}{"":<2}",
+        f"{format(scf_cyc['QBOUND'], ".1E").replace("E", "d"):<7}{"":<2}{_format_mixing(scf_cyc['BRYMIX']):<6}{"":<2}{int(scf_cyc['ITDBRY']):<6}{"":<2}\n",
+        _LINE
+    ])
+
+@_cached_section
+def _render_cluster(cluster, cluster_prec):
+    parts = ["Parameters for the clusters (same: spherical else cylindical)\n"]
+    # need to find out how to convert the python format into something that fortran needs -- [TODO]
+    parts += [f"{clus}={value:.{cluster_prec}f}d0     " for clus, value in cluster.items()]
+    parts.append(_SEPARATOR)
+    return "".join(parts)
+
+@_cached_section
+def _render_k_points(k_points):
+    parts = [f"BZDIVIDE={"":<2}"]
+    parts += [f"{k_max:<5}" for k_max in k_points['KMAX']]
+    parts.append(f"{"":<2}")
+    parts += [f"{k_min:<5}" for k_min in k_points['KMIN']]
+    parts.append(f"\nMESHDECAY= {k_points['MESHDECAY']}")
+    parts.append(_SEPARATOR)
+    return "".join(parts)
+
+# the file names are formatted directly, building the key would take as long
+def _render_files(refpot, startpot, shapefun, scoef):
+    return f"FILES\n{refpot:<54}I12\n{startpot:<54}I13\n{"-----":<54}I40\n{shapefun:<54}I19\n{scoef:<54}I25{_SEPARATOR}"
+
+
+def clear_render_cache():
+    for func in _SECTION_RENDERERS:
+        func.cache.clear()
+
+_SECTION_RENDERERS = [_render_options, _render_general, _render_voro_opts, _render_lattice, _render_basis, _render_atominfo,
+                      _render_energy_contour, _render_scf_cycle, _render_cluster, _render_k_points]
 
-# this still lacks a way to read out an inputcard
 
 class Inputcard:
+    """
+    parameters of a TB-KKR inputcard
+    --> copy on write: changes never modify a parameter dict or list in place but replace it by a new one, so cards
+        made with copy or derive share all parameters that were not changed (and nothing is shared with the defaults)
+    --> the dicts returned by get_parameter may be shared with other cards, change them only with change_parameter
+    """
+
+    __slots__ = ['cluster_prec', 'alat_prec', 'lat_prec', 'refpot', 'startpot', 'shapefun', 'scoef', 'runopts', 'testopts',
+                 'gen_parameters', 'cluster', 'energy_contour', 'scf_cyc', 'k_points', 'lattice', 'atominfo', 'voro_opts']
 
     _DEFAULT_REFPOT = 'ref.pot'
     _DEFAULT_STARTPOT = 'start.pot'
@@ -35,6 +238,8 @@ class Inputcard:
         self.shapefun = ""
         self.scoef = ""
 
+        default = load_defaults()
+
         # default option parameters
         self.runopts = default['runopt']
         self.testopts = default['testopt']
@@ -58,8 +263,26 @@ class Inputcard:
         for key in dict.keys():
             self.change_parameter(key, dict[key])
 
+    def copy(self):
+        # cheap copy, the parameters are shared until one of the cards changes them
+        new_inputcard = Inputcard.__new__(Inputcard)
+        for attr in Inputcard.__slots__:
+            setattr(new_inputcard, attr, getattr(self, attr))
+        return new_inputcard
+
+    def __copy__(self):
+        return self.copy()
 
-        # until here
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def derive(self, key, value, mode = 'a'):
+        """
+        returns a copy of the card with change_parameter(key, value, mode) applied, the card itself is not changed
+        """
+        new_inputcard = self.copy()
+        new_inputcard.change_parameter(key, value, mode)
+        return new_inputcard
 
     def read_in_json(self, file_path): # can only be used to replace the current stuff .. 
         with open(file_path, 'r') as jfile:
@@ -95,154 +318,32 @@ class Inputcard:
 
     ## write to file
     def __str__(self):
-        output_string = f"{"":<9}***** Input file for TB-KKR code *****\n***** Generated using the Aiida Inputcard-parser *****\n"
-        
-        # write out run opts preamble
-        output_string += f"{"":<15}***Running options***\nRUNOPT\n"
-        # run options
-        for option in self.runopts:
-            output_string += f"{option:<8} "        
-        output_string += f"\n{"+-------" * 7}+\n"
-
-        # write test opts preamble
-        output_string += f"{"":<15}***test options*** (2 lines)\nTESTOPT\n"
-        counter = 0
-        for option in self.testopts:
-            output_string += f"{option:<8} "
-            counter += 1
-            if counter == 6:
-                output_string += "\n"
-        if counter < 4:
-            output_string += "\n"
-        output_string += f"\n{"+-------" * 7}+\n"
-
-        # write LMAX Line
-        output_string += f"{"":<7}LMAX={self.gen_parameters['LMAX']}{"":<5}NSPIN={self.gen_parameters['NSPIN']}{"":<5}NATYP={len(self.atominfo)}{"":<5}KMT={self.gen_parameters['KMT']}"
-        output_string += f"\n{"+-------" * 7}+\n"
-        # Write the jellpath
-        output_string += f"JELLPATH='{Inputcard._DEFAULT_JELLPATH}/'\n"
-        
-        # Write New Voronoi Options (If VoroOpts in the Testoptions)
-        if "voroOpts" in self.testopts:
-            if self.voro_opts == {}:
-                print(ValueError("No Options were supplied for the new Voronoi"))
-            for option, value in self.voro_opts.items():
-                output_string += f"\n{option}={value}"
-        
-        output_string += f"\n{"+-------" * 7}+\n"
-
-
-        # only temporary lattice as a dictionary object .. myb not as temporary
-        output_string += f"{"":<12}** Description of lattice **\n"
-        
-        #lattice constants
-        output_string += f"ALATBASIS= {self.lattice['lattice-constant']:<9.{self.alat_prec}f} {1.0:<9.{self.alat_prec}f} {1.0:<9.{self.alat_prec}f} lattice constant\n"
-        
-        #scaling factors
-        output_string += f"BASISCALE= {self.lattice['lattice-scaling'][0]:<9.{self.alat_prec}f} {self.lattice['lattice-scaling'][0]:<9.{self.alat_prec}f} {self.lattice['lattice-scaling'][0]:<9.{self.alat_prec}f} scaling factor\n"
-        
-        #Bravais lattice
-        # idk what LATTICE does so it is hard coded for now
-        output_string += "LATTICE=1\nBRAVAIS"
-        for vector in self.lattice['bravais-lattice']:
-            output_string += f"\n{"":<5}"
-            first = True
-            for component in vector:
-                if not component < 0 and first:
-                    output_string += " "
-                    first = False
-                output_string += f"{"":<2}{component:<13.{self.lat_prec}f}"
-        
-        output_string += f"\n{"+-------" * 7}+\n"
+        if "voroOpts" in self.testopts and self.voro_opts == {}:
+            print(ValueError("No Options were supplied for the new Voronoi"))
+
+        natyp = len(self.atominfo)
+        lattice = self.lattice
+
+        # every section is cached on the parameters it is made of
+        sections = [
+            _render_options(self.runopts, self.testopts),
+            _render_general(self.gen_parameters, natyp),
+            _render_voro_opts("voroOpts" in self.testopts, self.voro_opts),
+            _render_lattice(lattice['lattice-constant'], lattice['lattice-scaling'], lattice['bravais-lattice'],
+                            self.alat_prec, self.lat_prec),
+            _render_basis(natyp, {para: lattice[para] for para in _BASIS_KEYS}, lattice['atom-basis'],
+                          lattice['basis-scaling'], self.alat_prec, self.lat_prec),
+            _render_atominfo(self.atominfo),
+            _render_energy_contour(self.energy_contour),
+            _render_scf_cycle(self.scf_cyc),
+            _render_cluster(self.cluster, self.cluster_prec),
+            _render_k_points(self.k_points),
+            _CONSTANT_SECTION,
+            _render_files(self.refpot, self.startpot, self.shapefun, self.scoef),
+            _TRAILER_SECTION
+        ]
 
-        # write the basis
-        output_string += f"{"":<3}{'NAEZ':>6}={len(self.atominfo):<7}"
-        for para in ['NEMB', 'NEMBZ', 'KAOEZ']:
-            output_string += f"{para:>6}={self.lattice[para]:<7}"
-        output_string += f'\nCARTESIAN= {self.lattice['CARTESIAN']}{"":<5}//T - Cartesian Basis | F - Direct Basis\nRBASIS'
-        
-        for vector in self.lattice['atom-basis']:
-            output_string += f"\n{"":<5}"
-            first = True
-            for component in vector:
-                if not component < 0 and first:
-                    output_string += " "
-                    first = False
-                output_string += f"{"":<4}{component:<13.{self.lat_prec}f}"
-        output_string += f"\nSCALING=  {self.lattice["basis-scaling"][0]:<16.{self.alat_prec}f} {self.lattice["basis-scaling"][1]:<16.{self.alat_prec}f} {self.lattice["basis-scaling"][2]:<16.{self.alat_prec}f}"
-        output_string += f"\n{"+-------" * 7}+\n"
-        # until here
-
-        # atominfo
-        output_string += f"ATOMINFO\n"
-        atominfo_terms = [term for term in Inputcard.ATOMINFO_TERMS if term in self.atominfo[0].keys()] 
-
-
-        for term in atominfo_terms:
-            output_string += f"{term:<7}{"":<2}"
-        output_string += '\n'
-
-        for atom in self.atominfo:
-            for term in atominfo_terms:
-                output_string += f"{atom[term]:<7}{"":<2}"
-            output_string += "\n"
-        output_string += f"{"+-------" * 7}+\n"    
-        
-        # Energy contoure
-        output_string += f"{"EMIN":<5}{"":<3}{"EMAX":<5}{"":<3}{"TEMPR":<5}{"":<3}{"NPOL":<5}{"":<3}{"NPT1":<5}{"":<3}{"NPT2":<5}{"":<3}{"NPT3":<5}{"":<3}\n"
-        output_string += f"{self.energy_contour['EMIN']:<5.2f}{"":<3}{self.energy_contour['EMAX']:<5.2f}{"":<3}{int(self.energy_contour['TEMPR']):<5}{"":<3}{int(self.energy_contour['NPOL']):<5}{"":<3}{int(self.energy_contour['NPTS'][0]):<5}{"":<3}{int(self.energy_contour['NPTS'][1]):<5}{"":<3}{int(self.energy_contour['NPTS'][2]):<5}{"":<3}\n"
-        output_string += f"{"+-------" * 7}+\n"
-
-        # scf-cycle
-        output_string += f"{"NSTEPS":<6}{"":<2}{"IMIX":<6}{"":<2}{"STRMIX":<6}{"":<2}{"FCM":<5}{"":<2}{"QBOUND":<7}{"":<2}{"BRYMIX":<6}{"":<2}{"ITDBRY":<6}{"":<2}\n"
-        output_string += f"{int(self.scf_cyc['NSTEPS']):<6}{"":<2}{int(self.scf_cyc['IMIX']):<6}{"":<2}{self.scf_cyc['STRMIX']:<6.1f}{"":<2}{self.scf_cyc['FCM']:<5.1f}{"":<2}{format(self.scf_cyc['QBOUND'], ".1E").replace("E", "d"):<7}{"":<2}{self.scf_cyc['BRYMIX']:<6.1f}{"":<2}{int(self.scf_cyc['ITDBRY']):<6}{"":<2}\n"
-        output_string += f"{"+-------" * 7}+\n"
-
-        # print cluster information
-        output_string += f"Parameters for the clusters (same: spherical else cylindical)\n"
-        # need to find out how to convert the python format into something that fortran needs -- [TODO]
-        #output_string += f"RCLUSTZ={format(self.cluster['RCLUSTZ'], f".{self.cluster_prec}E").replace('E', 'd')}"
-        for clus in self.cluster.keys():
-            output_string += f"{clus}={self.cluster[clus]:.{self.cluster_prec}f}d0     "
-        output_string += f"\n{"+-------" * 7}+\n"
-
-        # print the k-point information
-        output_string += f"BZDIVIDE={"":<2}"
-        # append k_max
-        for k_max in self.k_points['KMAX']:
-            output_string += f"{k_max:<5}"
-        # append k_min
-        output_string += f"{"":<2}"
-        for k_min in self.k_points['KMIN']:
-            output_string += f"{k_min:<5}"
-        output_string += f"\nMESHDECAY= {self.k_points['MESHDECAY']}"
-        output_string += f"\n{"+-------" * 7}+\n"
-
-        ## This part is hardcoded for now
-        output_string += constant_block
-        output_string += f"\n{"+-------" * 7}+\n"
-        output_string += interface
-        output_string += f"\n{"+-------" * 7}+\n"
-        output_string += zperiodl
-        output_string += f"\n{"+-------" * 7}+\n"
-        output_string += linpol
-        output_string += f"\n{"+-------" * 7}+\n"
-        output_string += mmin
-        output_string += f"\n{"+-------" * 7}+\n"
-        # until here
-
-        # Files
-        output_string += f"FILES\n{self.refpot:<54}I12\n{self.startpot:<54}I13\n{"-----":<54}I40\n{self.shapefun:<54}I19\n{self.scoef:<54}I25"
-        output_string += f"\n{"+-------" * 7}+\n"
-
-        ## This part is hardcoded for now
-        output_string += f"\n{"*" * 57}\n"
-        output_string += decimation
-        output_string += f"\n{"+-------" * 7}+\n"
-        output_string += ewald
-        output_string += f"\n{"+-------" * 7}+\n"
-
-        return output_string
+        return "".join(sections)
 
 
     # setting meta settings (precision, files)
@@ -256,7 +357,7 @@ class Inputcard:
         return self.startpot
     
     def set_shapefunc(self, file_path):
-        self.shapefunc = file_path
+        self.shapefun = file_path
     def set_scoef(self, file_path):
         self.scoef = file_path
 
@@ -264,20 +365,20 @@ class Inputcard:
     def get_runopts(self):
         return self.runopts
     def add_runopt(self, option):       #maybe it would be better to do this with a dict containing all possible options? and a bool if they should be used?
-        self.runopts.append(option)
+        self.runopts = self.runopts + [option]
     def add_runopts(self, options):
-        self.runopts += options
+        self.runopts = self.runopts + list(options)
     def remove_runopt(self, option):
-        self.runopts.remove(option)
+        self.runopts = [opt for opt in self.runopts if opt != option]
 
     def get_testopts(self):
         return self.testopts
     def add_testopt(self, option):
-        self.testopts.append(option)
+        self.testopts = self.testopts + [option]
     def add_testopts(self, options):
-        self.testopts += options
+        self.testopts = self.testopts + list(options)
     def remove_testopt(self,option):
-        self.testopts.remove(option)
+        self.testopts = [opt for opt in self.testopts if opt != option]
 
     def get_atomnum(self):
         return len(self.atominfo)
@@ -292,31 +393,18 @@ class Inputcard:
                           if a list of dicts is used the keys in the dicts will be changed for the respective atom in atominfo
                           Attention: afterwards a check will be made that all atoms have the same paramters, otherwise an error will be raised 
         """
-        def append_atominfo(atominfo, new_atoms):
-            for atom in new_atoms:
-                atominfo.append(default['atominfo'].copy())
-                for key in atom.keys():
-                    atominfo[-1][key] = atom[key]
-            
-            return atominfo
+        # new atom dicts with the defaults for the keys not supplied
+        new_atoms = [{**load_defaults()['atominfo'], **atom} for atom in new_atominfo]
 
         if mode == 'r':
-            atominfo = []
-        else:
-            atominfo = self.atominfo
-
-
-        if mode != 'c':
-            self.atominfo = append_atominfo(atominfo, new_atominfo)
+            self.atominfo = new_atoms
+        elif mode != 'c':
+            self.atominfo = self.atominfo + new_atoms
         else:
             if len(new_atominfo) == 1:
-                for atom in self.atominfo:
-                    for key in new_atominfo[0].keys():
-                        atom[key] = new_atominfo[0][key]
+                self.atominfo = [{**atom, **new_atominfo[0]} for atom in self.atominfo]
             elif len(new_atominfo) == len(self.atominfo):
-                for atom, new_atom in zip(self.atominfo, new_atominfo):
-                    for key in new_atom:
-                        atom[key] = new_atom[key]
+                self.atominfo = [{**atom, **new_atom} for atom, new_atom in zip(self.atominfo, new_atominfo)]
             else:
                 raise ValueError("The supplied atominfo for change mode has to either be of lenght 1 or of the length of atominfo")
 
@@ -340,20 +428,20 @@ class Inputcard:
         --> if atominfo is supplied it will call change_atominfo instead
         """
         def change_dictionary(old_dir, new_dir, mode= 'a'):
-            output_dir = old_dir
-            
+            # always a new dict, old_dir may be shared with other cards
             if mode == 'a':
-                for key in new_dir.keys():
-                    output_dir[key] = new_dir[key]
-            
+                return {**old_dir, **new_dir}
+
             if mode == 'c':
-                output_dir = new_dir
-            
+                return dict(new_dir)
+
             if mode == 'r':
                 for key in new_dir.keys():
-                    del output_dir[key]
+                    if key not in old_dir:
+                        raise KeyError(key)
+                return {key: val for key, val in old_dir.items() if key not in new_dir}
 
-            return output_dir
+            return old_dir
 
         if key == 'general':
             self.gen_parameters = change_dictionary(self.gen_parameters, value, mode)
@@ -381,14 +469,14 @@ class Inputcard:
 
         elif key == 'testopt':
             if mode == 'a':
-                self.testopts += value
+                self.testopts = self.testopts + list(value)
             elif mode == 'r':
-                self.testopts = value
+                self.testopts = list(value)
         elif key == 'runopt':
             if mode == 'a':
-                self.testopts += value
+                self.runopts = self.runopts + list(value)
             elif mode == 'r':
-                self.runopts = value
+                self.runopts = list(value)
 
         else:
             raise KeyError(f'There is no Parameter associated with key: {key}')
@@ -400,11 +488,159 @@ class Inputcard:
          'cluster': self.cluster,
          'energy-contour': self.energy_contour,
          'scf-cycle':self.scf_cyc,
-         'voro-opts': self.voro_opts}
+         'voro-opts': self.voro_opts,
+         'k-points': self.k_points}
         
         return para_dict[key]
 
+
+## inputcard parser
+_SEPARATOR_PATTERN = re.compile(r'^\+(?:-------\+){7}\n?', re.MULTILINE)
+
+def _parse_value(value):
+    # the parameters are written with str(), so int and float come back as written
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+def _parse_float(value):
+    return float(value.replace('d', 'e').replace('D', 'E'))
+
+def _decimals(value):
+    return len(value.split('.')[1]) if '.' in value else 0
+
+def _split_fields(line, width, spacing):
+    # fields are written as f"{value:<width}" + spacing, values may contain single spaces (e.g. 'full inv', KFG)
+    fields = []
+    pos = 0
+    while pos < len(line):
+        end = line.find(spacing, pos + width)
+        if end < 0:
+            end = len(line)
+        field = line[pos:end].rstrip()
+        if field:
+            fields.append(field)
+        pos = end + len(spacing)
+    return fields
+
+def _parse_vectors(lines):
+    return [[float(component) for component in line.split()] for line in lines]
+
+
+def parse_inputcard(text):
+    """
+    reads an inputcard (as written by Inputcard.__str__) back into an Inputcard
+    --> the precisions of lattice constant, vectors and cluster radii are taken from the numbers in the text
+    --> parameters that are not written into the inputcard (e.g. voro-opts without voroOpts) keep their default
+    --> the hardcoded blocks are skipped
+    """
+    inputcard = Inputcard()
+    parameters = {key: {} for key in ['general', 'lattice', 'energy-contour', 'scf-cycle', 'cluster', 'k-points', 'voro-opts']}
+
+    for block in _SEPARATOR_PATTERN.split(text):
+        lines = block.rstrip('\n').split('\n')
+
+        if 'RUNOPT' in lines:
+            idx = lines.index('RUNOPT')
+            inputcard.change_parameter('runopt', _split_fields(lines[idx + 1], 8, ' '), 'r')
+
+        elif 'TESTOPT' in lines:
+            idx = lines.index('TESTOPT')
+            testopts = [option for line in lines[idx + 1:] for option in _split_fields(line, 8, ' ')]
+            inputcard.change_parameter('testopt', testopts, 'r')
+
+        elif lines[0].lstrip().startswith('LMAX='):
+            general = dict(para.split('=') for para in lines[0].split())
+            del general['NATYP']
+            parameters['general'].update((key, _parse_value(value)) for key, value in general.items())
+
+        elif lines[0].startswith('JELLPATH='):
+            voro_opts = (line.split('=', 1) for line in lines[1:] if line)
+            parameters['voro-opts'].update((key, _parse_value(value)) for key, value in voro_opts)
+
+        elif 'BRAVAIS' in lines:
+            alat_line = next(line for line in lines if line.startswith('ALATBASIS='))
+            scale_line = next(line for line in lines if line.startswith('BASISCALE='))
+            bravais_lines = lines[lines.index('BRAVAIS') + 1:]
+
+            inputcard.alat_prec = _decimals(alat_line.split()[1])
+            inputcard.lat_prec = _decimals(bravais_lines[0].split()[0])
+            scaling = float(scale_line.split()[1])
+            parameters['lattice'].update({
+                'lattice-constant': float(alat_line.split()[1]),
+                'lattice-scaling': [scaling] * 3,
+                'bravais-lattice': _parse_vectors(bravais_lines)
+            })
+
+        elif 'RBASIS' in lines:
+            basis = dict(para.split('=') for para in lines[0].split())
+            del basis['NAEZ']
+            basis = {key: _parse_value(value) for key, value in basis.items()}
+            basis['CARTESIAN'] = lines[1].split()[1]
+
+            idx = lines.index('RBASIS')
+            basis['atom-basis'] = _parse_vectors(lines[idx + 1:-1])
+            basis['basis-scaling'] = [float(value) for value in lines[-1].split()[1:]]
+            parameters['lattice'].update(basis)
+
+        elif lines[0] == 'ATOMINFO':
+            terms = _split_fields(lines[1], 7, '  ')
+            # set directly, change_atominfo would add the default values of terms not in the inputcard
+            inputcard.atominfo = [dict(zip(terms, (_parse_value(value) for value in _split_fields(line, 7, '  '))))
+                                  for line in lines[2:]]
+
+        elif lines[0].startswith('EMIN'):
+            values = lines[1].split()
+            parameters['energy-contour'].update({
+                'EMIN': float(values[0]), 'EMAX': float(values[1]), 'TEMPR': int(values[2]), 'NPOL': int(values[3]),
+                'NPTS': [int(value) for value in values[4:7]]
+            })
+
+        elif lines[0].startswith('NSTEPS'):
+            values = lines[1].split()
+            parameters['scf-cycle'].update({
+                'NSTEPS': int(values[0]), 'IMIX': int(values[1]), 'STRMIX': float(values[2]), 'FCM': float(values[3]),
+                'QBOUND': _parse_float(values[4]), 'BRYMIX': float(values[5]), 'ITDBRY': int(values[6])
+            })
+
+        elif lines[0].startswith('Parameters for the clusters'):
+            cluster = dict(para.split('=') for para in lines[1].split())
+            inputcard.cluster_prec = _decimals(next(iter(cluster.values())).removesuffix('d0'))
+            parameters['cluster'].update((key, _parse_float(value.removesuffix('d0'))) for key, value in cluster.items())
+
+        elif lines[0].startswith('BZDIVIDE='):
+            k_mesh = [int(value) for value in lines[0].split('=')[1].split()]
+            parameters['k-points'].update({
+                'KMAX': k_mesh[:len(k_mesh) // 2],
+                'KMIN': k_mesh[len(k_mesh) // 2:],
+                'MESHDECAY': _parse_value(lines[1].split('=')[1].strip())
+            })
+
+        elif lines[0] == 'FILES':
+            refpot, startpot, _, shapefun, scoef = (line[:-3].rstrip() for line in lines[1:6])
+            inputcard.set_refpot(refpot)
+            inputcard.set_startpot(startpot)
+            inputcard.shapefun = shapefun
+            inputcard.set_scoef(scoef)
+
+    # cluster and voro-opts are written completely (in order), the other sections keep defaults not in the inputcard
+    for key, value in parameters.items():
+        if value:
+            inputcard.change_parameter(key, value, 'c' if key in ['cluster', 'voro-opts'] else 'a')
+
+    return inputcard
+
+
+def read_inputcard(file_path):
+    with open(file_path, 'r') as in_file:
+        return parse_inputcard(in_file.read())
+
+
 if __name__ == '__main__':
+    import numpy as np
 
     dict = {
         'lattice': {
@@ -453,4 +689,4 @@ if __name__ == '__main__':
 
     # inp_2 = Inputcard()
     # inp_2.read_in_json('test_2.json')
-    # inp_2.write_to('test_2')
\ No newline at end of file
+    # inp_2.write_to('test_2')
@@ -0,0 +1,136 @@
+import re
+import pathlib as pl
+from collections import namedtuple
+
+# one record per scf iteration of the kkr code (energies in Ry, time in s)
+ScfIteration = namedtuple('ScfIteration', ['iteration', 'rms_error', 'cell_rms_errors', 'e_fermi', 'dos_fermi', 'time', 'e_tot'])
+
+_CHUNK_SIZE = 1 << 20
+
+# the lines of kkr.out we care about - every pattern starts with a literal, so the regex engine can skip
+# through the rest of the file at memchr speed (one alternation over all of them would be several times slower)
+_PATTERNS = (
+    re.compile(rb'ITERATION(?: FINISHED|\s+(?::\s+(\d+)|\d+ :\s+(\S+)))'),
+    re.compile(rb'rms-error( for cell)?[^=\n]*=\s+(\S+)'),
+    re.compile(rb'E FERMI\s+(\S+)\s+DEN OF ST\s+(\S+)'),
+    re.compile(rb'total energy in ryd\. :\s+(\S+)'),
+    re.compile(rb'convergence quality required :\s+(\S+)'),
+)
+
+
+def _to_float(value):
+    # fortran writes double precision exponents with a D
+    return float(value.replace(b'D', b'E'))
+
+
+class ScfOutputParser:
+    """
+    incremental parser for the output of the kkr code
+    --> feed it the raw bytes of kkr.out (in as many pieces as you like) and it returns
+        the iterations completed by the new data as ScfIteration records
+    --> only complete lines are parsed, the rest is kept until the next call of feed
+    """
+
+    def __init__(self):
+        self.qbound = None
+        self._remainder = b''
+        self._current = None
+
+    def feed(self, data):
+        data = self._remainder + data
+        end = data.rfind(b'\n') + 1
+        self._remainder = data[end:]
+
+        return self._parse(data, end)
+
+    def close(self):
+        # parse what is left and return the iteration that was still running (if any)
+        iterations = self._parse(self._remainder + b'\n', len(self._remainder) + 1)
+        self._remainder = b''
+
+        if self._current is not None:
+            iterations.append(self._finish())
+        return iterations
+
+    def _finish(self):
+        current = self._current
+        self._current = None
+        return ScfIteration(
+            iteration       = current['iteration'],
+            rms_error       = current['rms_error'],
+            cell_rms_errors = tuple(current['cell_rms_errors']),
+            e_fermi         = current['e_fermi'],
+            dos_fermi       = current['dos_fermi'],
+            time            = current['time'],
+            e_tot           = current['e_tot']
+        )
+
+    def _parse(self, data, end):
+        matches = []
+        for kind, pattern in enumerate(_PATTERNS):
+            matches += [(match.start(), kind, match) for match in pattern.finditer(data, 0, end)]
+        matches.sort(key=lambda entry: entry[0])
+
+        iterations = []
+        for _, kind, match in matches:
+            if kind == 0:
+                iteration, time = match.groups()
+                if iteration is not None:
+                    if self._current is not None:
+                        iterations.append(self._finish())
+                    self._current = {'iteration': int(iteration), 'rms_error': None, 'cell_rms_errors': [],
+                                     'e_fermi': None, 'dos_fermi': None, 'time': None, 'e_tot': None}
+                elif self._current is not None:
+                    # TIME IN ITERATION or ITERATION FINISHED close the current iteration
+                    if time is not None:
+                        self._current['time'] = _to_float(time)
+                    iterations.append(self._finish())
+
+            elif kind == 4:
+                self.qbound = _to_float(match.group(1))
+
+            elif self._current is None:
+                continue
+
+            elif kind == 1:
+                if match.group(1) is not None:
+                    self._current['cell_rms_errors'].append(_to_float(match.group(2)))
+                else:
+                    self._current['rms_error'] = _to_float(match.group(2))
+            elif kind == 2:
+                self._current['e_fermi'] = _to_float(match.group(1))
+                self._current['dos_fermi'] = _to_float(match.group(2))
+            elif kind == 3:
+                self._current['e_tot'] = _to_float(match.group(1))
+
+        return iterations
+
+
+def iter_scf_iterations(kkr_out_path, chunk_size=_CHUNK_SIZE):
+    """
+    reads kkr.out once in chunks of chunk_size bytes and yields one ScfIteration per iteration
+    """
+    parser = ScfOutputParser()
+    with open(kkr_out_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def read_scf_iterations(kkr_out_path):
+    return list(iter_scf_iterations(kkr_out_path))
+
+
+def read_last_iteration(kkr_out_path):
+    last = None
+    for last in iter_scf_iterations(kkr_out_path):
+        pass
+    return last
+
+
+if __name__ == '__main__':
+    import sys
+
+    for path in sys.argv[1:]:
+        for iteration in iter_scf_iterations(pl.Path(path)):
+            print(iteration)
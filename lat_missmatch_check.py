@@ -0,0 +1,300 @@
+import pathlib as pl
+import argparse
+import json
+import sys
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from inputcard_converter import Inputcard
+from lattice_missmatch_calc import prepare_lattice_missmatch_relaxation
+from results_db import ResultsDB
+from task_manifest import write_manifest
+
+_CSV_NAME = 'output.csv'
+_JSON_NAME = 'inputcard.json'
+# point with the c/a ratio of the template inputcard, the ratios of a group are relative to it
+_REF_NAME = 'ac_1.00'
+_SURFACE_NAME = 'missmatch_surface.csv'
+_GRID_NAME = 'refined_grid.csv'
+_PLOT_NAME = 'missmatch_surface.png'
+
+SurfaceFit = namedtuple('SurfaceFit', ['lat_const', 'ratio', 'e_min', 'hessian', 'lat_const_error', 'ratio_error', 'model', 'energy'])
+
+
+def _volume(inputcard_data):
+    # unit cell volume / lattice constant^3
+    lattice = inputcard_data['lattice']
+    return abs(np.linalg.det(np.array(lattice['bravais-lattice'], dtype=float))) * np.prod(lattice.get('lattice-scaling', [1, 1, 1]))
+
+
+def _read_point(point_path):
+    import pandas as pd
+
+    data = pd.read_csv(point_path / _CSV_NAME, index_col=0)
+    with open(point_path / _JSON_NAME) as f:
+        inputcard_data = json.load(f)
+    return [data.loc['lat_const', 'value'], data.loc['lat_const', 'unit'], data.loc['e_tot', 'value'], data.loc['e_tot', 'unit'], inputcard_data]
+
+
+def read_missmatch_group(group_path, results_db=None):
+    """
+    lattice constant, c/a ratio and energy of the finished points <group_path>/ac_<ratio> of one in-plane lattice constant
+    --> the ratio is the one of the inputcard (the volume relative to ac_1.00), the directory name only if ac_1.00 is missing
+    --> with results_db the points are queried from it (if recorded there)
+    """
+    points = results_db.group_points(group_path) if results_db is not None else []
+    rows = {pl.Path(point['path']).name: [point['lat_const'], point['lat_const_unit'], point['e_tot'], point['energy_unit'], point['parameters']]
+            for point in points}
+    if not rows:
+        rows = {point_path.name: _read_point(point_path) for point_path in sorted(group_path.glob('ac_*'))
+                if (point_path / _CSV_NAME).exists()}
+
+    ref_volume = _volume(rows[_REF_NAME][4]) if _REF_NAME in rows else None
+    data = []
+    for name, (lat_const, lat_unit, e_tot, e_unit, inputcard_data) in rows.items():
+        volume = _volume(inputcard_data)
+        ratio = volume / ref_volume if ref_volume else float(name.split('_', 1)[1])
+        data.append([group_path.name, name, lat_const, lat_unit, ratio, e_tot, e_unit, volume])
+    return data
+
+
+def read_missmatch_grid(path, results_db=None, max_workers=None):
+    """
+    all finished points <path>/<lat_const>/ac_<ratio> of a lattice missmatch calculation (perform_lat_missmatch_calc.py)
+    --> DataFrame with group, point, lat_const, lat_const_unit, ratio, e_tot, e_tot_unit and volume (unit cell volume / lat_const^3)
+    --> the groups are read in parallel
+    """
+    import pandas as pd
+
+    group_paths = sorted(group_path for group_path in path.iterdir() if group_path.is_dir())
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        groups = list(pool.map(lambda group_path: read_missmatch_group(group_path, results_db), group_paths))
+
+    return pd.DataFrame([row for group in groups for row in group],
+                        columns=['group', 'point', 'lat_const', 'lat_const_unit', 'ratio', 'e_tot', 'e_tot_unit', 'volume'])
+
+
+def _terms(degree):
+    # exponents (i, j) of the monomials x^i y^j of a 2-D polynomial of total degree
+    return np.array([(i, total - i) for total in range(degree + 1) for i in range(total, -1, -1)])
+
+
+def _monomials(x, y, terms, dx=0, dy=0):
+    # (points x terms) matrix of the monomials or their partial derivatives d^dx/dx^dx d^dy/dy^dy
+    x, y = np.atleast_1d(x)[:, None], np.atleast_1d(y)[:, None]
+    i, j = terms[:, 0], terms[:, 1]
+    factor = np.ones(len(terms))
+    for order in range(dx):
+        factor = factor * (i - order)
+    for order in range(dy):
+        factor = factor * (j - order)
+    return factor * x**np.maximum(i - dx, 0) * y**np.maximum(j - dy, 0)
+
+
+def _newton_minimum(grad, hess, start, iterations=50):
+    # local minimum of a surface from start, None if Newton doesn't converge to a point with positive definite hessian
+    point = np.array(start, dtype=float)
+    for _ in range(iterations):
+        step = np.linalg.solve(hess(*point), grad(*point))
+        # steps are limited to the scaled grid (size 2), keeps Newton from jumping off a cubic surface
+        step_size = np.linalg.norm(step)
+        point = point - step * min(1, 0.5 / step_size) if step_size > 0 else point
+        if step_size < 1e-12:
+            break
+    if not np.all(np.linalg.eigvalsh(hess(*point)) > 0) or np.linalg.norm(grad(*point)) > 1e-8 * max(1, np.abs(hess(*point)).max()):
+        return None
+    return point
+
+
+def fit_energy_surface(lat_consts, ratios, energies, degree=3, model='polynomial', en_noise=1e-5):
+    """
+    fits E(a, c/a) of a lattice missmatch grid and returns the equilibrium (a, c/a), the minimal energy and the hessian
+    --> polynomial: 2-D polynomial of total degree (one least squares solve), the errors of the minimum from the covariance of
+        the coefficients
+    --> spline: smoothing bicubic spline with weights 1 / en_noise (at least 16 points), no errors
+    --> the minimum is searched from the lowest point, NaN if the surface has none
+    """
+    lat_consts, ratios, energies = [np.asarray(values, dtype=float) for values in [lat_consts, ratios, energies]]
+
+    # centred and scaled to [-1, 1], energies relative to the lowest one
+    center = np.array([lat_consts.mean(), ratios.mean()])
+    scale = np.array([np.ptp(lat_consts) / 2 or 1, np.ptp(ratios) / 2 or 1])
+    x, y = (lat_consts - center[0]) / scale[0], (ratios - center[1]) / scale[1]
+    e_ref = energies.min()
+
+    covariance = None
+    if model == 'spline':
+        from scipy.interpolate import SmoothBivariateSpline
+
+        spline = SmoothBivariateSpline(x, y, energies - e_ref, w=np.full(len(x), 1 / en_noise), kx=3, ky=3)
+        value = lambda x, y: spline.ev(x, y)[()]
+        grad = lambda x, y: np.array([spline.ev(x, y, dx=1), spline.ev(x, y, dy=1)])
+        hess = lambda x, y: np.array([[spline.ev(x, y, dx=2), spline.ev(x, y, dx=1, dy=1)],
+                                      [spline.ev(x, y, dx=1, dy=1), spline.ev(x, y, dy=2)]])
+    else:
+        terms = _terms(degree)
+        design = _monomials(x, y, terms)
+        coeffs = np.linalg.lstsq(design, energies - e_ref, rcond=None)[0]
+
+        dof = len(x) - len(terms)
+        noise = max(np.sum((energies - e_ref - design @ coeffs)**2) / dof if dof > 0 else 0, en_noise**2)
+        covariance = noise * np.linalg.pinv(design.T @ design)
+
+        value = lambda x, y: (_monomials(np.ravel(x), np.ravel(y), terms) @ coeffs).reshape(np.shape(x))[()]
+        grad = lambda x, y: np.array([_monomials(x, y, terms, dx=1) @ coeffs, _monomials(x, y, terms, dy=1) @ coeffs])[:, 0]
+        hess = lambda x, y: np.array([[_monomials(x, y, terms, dx=2) @ coeffs, _monomials(x, y, terms, dx=1, dy=1) @ coeffs],
+                                      [_monomials(x, y, terms, dx=1, dy=1) @ coeffs, _monomials(x, y, terms, dy=2) @ coeffs]])[:, :, 0]
+
+    lowest = np.argmin(energies)
+    minimum = _newton_minimum(grad, hess, [x[lowest], y[lowest]])
+    energy = lambda lat_const, ratio: value((np.asarray(lat_const) - center[0]) / scale[0], (np.asarray(ratio) - center[1]) / scale[1]) + e_ref
+    if minimum is None:
+        return SurfaceFit(np.nan, np.nan, np.nan, np.full((2, 2), np.nan), np.nan, np.nan, model, energy)
+
+    # hessian in (a, c/a)
+    hessian = hess(*minimum) / np.outer(scale, scale)
+    errors = [np.nan, np.nan]
+    if covariance is not None:
+        # error of the minimum: d minimum / d coeffs = -hess^-1 d grad / d coeffs (implicit function theorem)
+        grad_coeffs = np.vstack([_monomials(*minimum, terms, dx=1), _monomials(*minimum, terms, dy=1)])
+        jacobian = -np.linalg.solve(hess(*minimum), grad_coeffs)
+        errors = np.sqrt(np.diag(jacobian @ covariance @ jacobian.T)) * scale
+
+    lat_const, ratio = center + scale * minimum
+    return SurfaceFit(lat_const, ratio, value(*minimum) + e_ref, hessian, errors[0], errors[1], model, energy)
+
+
+def elastic_estimates(fit, volume):
+    """
+    elastic constants from the hessian of E(a, c/a) at the minimum (energy unit / lattice constant unit^3)
+    --> the in-plane strain is da / a, the strain along z (scaled by c/a) da / a + d(c/a) / (c/a)
+    --> E / V = (C11 + C12) e_xy^2 + 2 C13 e_xy e_z + C33 e_z^2 / 2 for a hexagonal or tetragonal cell, volume is V / a^3 at the minimum
+    --> bulk_modulus is the one of the relaxed cell
+    """
+    a, r = fit.lat_const, fit.ratio
+    # second derivatives in the strains (e_xy, e_z): a = a0 (1 + e_xy), c/a = r0 (1 + e_z - e_xy)
+    transform = np.array([[a, -r], [0, r]])
+    strain_hessian = transform @ fit.hessian @ transform.T
+    eq_volume = volume * a**3
+
+    c11_c12 = strain_hessian[0, 0] / (2 * eq_volume)
+    c13 = strain_hessian[0, 1] / (2 * eq_volume)
+    c33 = strain_hessian[1, 1] / eq_volume
+    bulk_modulus = (c33 * c11_c12 - 2 * c13**2) / (c11_c12 + 2 * c33 - 4 * c13)
+    return {'C11+C12': c11_c12, 'C13': c13, 'C33': c33, 'bulk_modulus': bulk_modulus}
+
+
+def refine_grid(fit, lat_consts, ratios, points=5):
+    """
+    lattice constants and c/a ratios of a sub-grid around the minimum (or the grid's center without minimum),
+    one step of the calculated grid to each side with points values per direction
+    """
+    steps = []
+    for values in [lat_consts, ratios]:
+        unique = np.unique(np.round(values, 8))
+        steps.append(np.min(np.diff(unique)) if len(unique) > 1 else 0)
+
+    center = [fit.lat_const, fit.ratio] if np.isfinite(fit.lat_const) else [np.mean(lat_consts), np.mean(ratios)]
+    return [np.linspace(value - step, value + step, points) for value, step in zip(center, steps)]
+
+
+def plot_surface(grid, fit, out_path, size=None):
+    import matplotlib.pyplot as plt
+
+    if not size:
+        size = (8,6)
+
+    lat_fit, ratio_fit = np.meshgrid(np.linspace(grid.lat_const.min(), grid.lat_const.max(), 60),
+                                     np.linspace(grid.ratio.min(), grid.ratio.max(), 60))
+
+    fig, ax = plt.subplots(figsize=size)
+    contour = ax.contourf(lat_fit, ratio_fit, fit.energy(lat_fit, ratio_fit), levels=30)
+    fig.colorbar(contour, ax=ax, label='$E_{tot}$' + f' [{grid.e_tot_unit.iloc[0]}]')
+    ax.scatter(grid.lat_const, grid.ratio, color='white', s=8)
+    if np.isfinite(fit.lat_const):
+        ax.scatter([fit.lat_const], [fit.ratio], color='purple', marker='x')
+
+    ax.set_xlabel('Lattice constant $a$ /' + f' [{grid.lat_const_unit.iloc[0]}]')
+    ax.set_ylabel('c/a ratio')
+
+    fig.savefig(out_path)
+    plt.close()
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Fit the energy surface E(a, c/a) of a lattice missmatch calculation")
+
+    parser.add_argument('-p', '--path', dest='path',
+                        help='path of the lattice missmatch calculation (perform_lat_missmatch_calc.py) - writes <path>/missmatch_surface.csv')
+    parser.add_argument('-m', '--model', dest='model', default='polynomial', choices=['polynomial', 'spline'],
+                        help='fitted surface, 2-D polynomial or smoothing bicubic spline')
+    parser.add_argument('--degree', dest='degree', type=int, default=3,
+                        help='total degree of the polynomial surface')
+    parser.add_argument('--energy_noise', dest='en_noise', type=float, default=1e-5,
+                        help='accuracy of the total energies (Ry), the minimal noise of the fit')
+    parser.add_argument('--results_db', dest='results_db', default=None,
+                        help='results database the points are queried from (see results_db.py)')
+
+    parser.add_argument('--refine_points', dest='refine_points', type=int, default=5,
+                        help='lattice constants and c/a ratios of the refined sub-grid around the minimum - written to <path>/refined_grid.csv')
+    parser.add_argument('--prepare_refined', dest='refined_path', default=None,
+                        help='prepare the point calculations of the refined sub-grid in this path (as perform_lat_missmatch_calc.py)')
+    parser.add_argument('-i', '--json_input_path', dest='json_inp_path', default='inputcard_InN.json',
+                        help='template inputcard of the lattice missmatch calculation, needed for --prepare_refined')
+
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    path = pl.Path(args.path)
+    results_db = ResultsDB(args.results_db) if args.results_db else None
+
+    grid = read_missmatch_grid(path, results_db)
+    fit = fit_energy_surface(grid.lat_const, grid.ratio, grid.e_tot, args.degree, args.model, args.en_noise)
+    # V / a^3 at the minimum, the volume grows with the c/a ratio
+    volume = np.median(grid.volume / grid.ratio) * fit.ratio
+    elastic = elastic_estimates(fit, volume)
+
+    lat_unit, en_unit = grid.lat_const_unit.iloc[0], grid.e_tot_unit.iloc[0]
+    elastic_unit = f'{en_unit}/{lat_unit}^3'
+    surface_df = pd.DataFrame([[fit.lat_const, lat_unit], [fit.lat_const_error, lat_unit], [fit.ratio, ''], [fit.ratio_error, ''],
+                               [fit.e_min, en_unit], [fit.hessian[0, 0], f'{en_unit}/{lat_unit}^2'], [fit.hessian[0, 1], f'{en_unit}/{lat_unit}'],
+                               [fit.hessian[1, 1], en_unit]] + [[value, elastic_unit] for value in elastic.values()],
+                              index=['eq_lat_const', 'eq_lat_const_error', 'eq_ratio', 'eq_ratio_error', 'e_min', 'hessian_aa', 'hessian_ar',
+                                     'hessian_rr'] + list(elastic), columns=['value', 'unit'])
+    surface_df.to_csv(path / _SURFACE_NAME)
+    print(surface_df, file=sys.stdout)
+
+    plot_surface(grid, fit, path / _PLOT_NAME)
+
+    lat_consts, ratios = refine_grid(fit, grid.lat_const, grid.ratio, args.refine_points)
+    pd.DataFrame({'lat_const': lat_consts, 'ratio': ratios}).to_csv(path / _GRID_NAME, index=False)
+
+    if args.refined_path:
+        inputcard = Inputcard()
+        inputcard.read_in_json(args.json_inp_path)
+
+        # the directories are named after the values with two decimals, ratios rounding to 1.00 are replaced by the point of
+        # the template (ac_1.00, calculated in every group) - the volumes of a group are relative to it
+        ref_ratios = [ratio for ratio in ratios if f'ac_{ratio:.2f}' == _REF_NAME]
+        if ref_ratios:
+            print(f"c/a ratios {', '.join(f'{ratio:.4f}' for ratio in ref_ratios)} are calculated as {_REF_NAME}", file=sys.stderr)
+        other_ratios = [f'{ratio:.2f}' for ratio in ratios if ratio not in ref_ratios]
+        if len({f'{value:.2f}' for value in lat_consts}) < len(lat_consts) or len(set(other_ratios)) < len(other_ratios):
+            parser.error('the refined sub-grid is finer than the directory names (0.01), use less --refine_points')
+
+        refined_path = pl.Path(args.refined_path)
+        task_paths = []
+        for lat_const in lat_consts:
+            lat_path = refined_path / f"{lat_const:.2f}"
+            lat_path.mkdir(parents=True, exist_ok=True)
+            task_paths += prepare_lattice_missmatch_relaxation(lat_path, inputcard, ratios[0], ratios[-1], len(ratios), lattice_constant=lat_const)
+
+        # array task n runs the point calculation in record n of the manifest
+        print(write_manifest(refined_path, task_paths), f"{len(task_paths)} tasks", file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
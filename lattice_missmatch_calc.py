@@ -1,11 +1,6 @@
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import pathlib as pl
 
-from copy import deepcopy
-from scipy.optimize import curve_fit, minimize
-
 from inputcard_converter import Inputcard
 
 
@@ -21,7 +16,7 @@ def prepare_lattice_missmatch_relaxation(relax_path, inputcard, min_ratio, max_r
 
     if lattice_constant:
         in_plane_lat_const = lattice_constant # primitive lattice constant in a0
-        inputcard.change_parameter('lattice', {'lattice-constant': lattice_constant})
+        inputcard = inputcard.derive('lattice', {'lattice-constant': lattice_constant})
     else:
         in_plane_lat_const = float(inputcard.get_parameter('lattice')['lattice-constant'])
 
@@ -31,12 +26,13 @@ def prepare_lattice_missmatch_relaxation(relax_path, inputcard, min_ratio, max_r
     calc_path = relax_path / get_dirname(1)
     calc_path.mkdir(parents=True, exist_ok=True)
     inputcard.write_to_json(calc_path / 'inputcard.json')
-    
+    calc_paths = [calc_path]
 
     c_over_a_ratios = np.linspace(min_ratio, max_ratio, en_points)
     
     for ratio in c_over_a_ratios:
-        if ratio == 1:
+        # ratios rounding to 1.00 would overwrite the inputcard of the original c/a ratio
+        if get_dirname(ratio) == get_dirname(1):
             continue
         calc_path = relax_path / get_dirname(ratio)
         calc_path.mkdir(parents=True, exist_ok=True)
@@ -45,9 +41,14 @@ def prepare_lattice_missmatch_relaxation(relax_path, inputcard, min_ratio, max_r
         trans_mat[2,2] = ratio
         new_bravais = np.matmul(bravais_lat, trans_mat)
         
-        inputcard.change_parameter('lattice', {'bravais-lattice': new_bravais.T.tolist()})
-        inputcard.write_to_json(calc_path / 'inputcard.json')
+        new_inputcard = inputcard.derive('lattice', {'bravais-lattice': new_bravais.T.tolist()})
+        new_inputcard.write_to_json(calc_path / 'inputcard.json')
         #print(trans_mat)
+        if calc_path not in calc_paths:
+            calc_paths.append(calc_path)
+
+    # the point calculations, starting with the original c/a ratio
+    return calc_paths
 
 if __name__ == '__main__':
     inputcard = Inputcard()
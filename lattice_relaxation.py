@@ -1,23 +1,45 @@
 import numpy as np
-import pandas as pd
 import pathlib as pl
-import matplotlib.pyplot as plt
-
-from copy import deepcopy
-from scipy.optimize import curve_fit, minimize
-from matplotlib.ticker import StrMethodFormatter
+import argparse
+import json
+import sys
+from collections import namedtuple
 
 from inputcard_converter import Inputcard
+from sweep_common import PLOT_LOCK
+
+# pandas, scipy and matplotlib are imported in the functions using them,
+# prepare_lattice_relaxation (and everything importing it) doesn't need them
 
 _CSV_PATH = 'output.csv'
+_FITS_NAME = 'lattice_fits.csv'
+
+# E(a) is fitted as a cubic polynomial in t = forward(a): inverse(t) = a and d forward / da
+# --> birch_murnaghan: the 3rd order Birch-Murnaghan equation of state is a cubic in V^-2/3, i.e. in a^-2
+_FIT_MODELS = {
+    'cubic': (lambda a: a, lambda t: t, lambda a: np.ones_like(a)),
+    'birch_murnaghan': (lambda a: a**-2.0, lambda t: t**-0.5, lambda a: -2 * a**-3.0),
+}
+
+LatticeFit = namedtuple('LatticeFit', ['eq_lat_const', 'eq_lat_const_error', 'e_min', 'bulk_modulus', 'model', 'coeffs', 'center', 'scale',
+                                       'e_ref'])
 
 def polynom(x, a0, a1, a2, a3):
     return a0 + a1 * x + a2 * x**2 + a3 * x**3
 
 def plot_fit(data, params, out_path, func=polynom, eq_lat_const = None):
+    # relaxations running in threads (adaptive or convergence search) plot one at a time
+    with PLOT_LOCK:
+        _plot_fit(data, params, out_path, func, eq_lat_const)
+
+
+def _plot_fit(data, params, out_path, func, eq_lat_const):
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import StrMethodFormatter
+
     fig, ax = plt.subplots(figsize=(7,5))
 
-    lat_unit = data.lat_const_unit[0]
+    lat_unit = data.lat_const_unit.iloc[0]
     data.plot.scatter(x='lat_const', y='e_tot', ax=ax)
     
     x_fit = np.linspace(data.lat_const.min(), data.lat_const.max(), 100)
@@ -30,7 +52,7 @@ def plot_fit(data, params, out_path, func=polynom, eq_lat_const = None):
     ax.yaxis.set_major_formatter(StrMethodFormatter('{x:.3f}'))
     
     ax.set_xlabel('Lattice constant $a$ /' + f' [{lat_unit}]')
-    ax.set_ylabel('$E_{tot}$' + f' [{data.e_tot_unit[0]}]')
+    ax.set_ylabel('$E_{tot}$' + f' [{data.e_tot_unit.iloc[0]}]')
     ax.legend()
 
     if out_path.exists():
@@ -43,6 +65,8 @@ def fit_rel_data(data, func=polynom):
     """
     takes output data as DataFrame with two columns 'lat_const', 'e_tot', then fits it with a callable function
     """
+    from scipy.optimize import curve_fit, minimize
+
     x0_guess = data.loc[int(data.lat_const.size/2), 'lat_const']
     
     params, conv = curve_fit(func, data.lat_const, data.e_tot)
@@ -50,63 +74,369 @@ def fit_rel_data(data, func=polynom):
     return [eq_lat_const.x[0], data.lat_const_unit.iloc[0]], params
 
 
-def lattice_relax_postprocessing(calc_path):
+def fit_lattice_batch(lat_consts, energies, model='cubic', volume_factors=None):
+    """
+    fits E(a) of many groups at once - lat_consts and energies are (groups x points) arrays, missing points NaN
+    --> cubic: polynomial in a (as fit_rel_data), birch_murnaghan: 3rd order Birch-Murnaghan equation of state
+    --> all least squares problems are solved together, the minima analytically (the root of E' with E'' > 0)
+    --> eq_lat_const_error is the standard error of the minimum from the covariance of the coefficients (NaN with 4 points)
+    --> bulk_modulus is V E''(V) at the minimum (energy unit / lattice constant unit^3), it needs the volume factors V / a^3
+    --> groups with less than 4 points or without minimum are NaN
+    """
+    forward, inverse, derivative = _FIT_MODELS[model]
+    lat_consts = np.atleast_2d(np.asarray(lat_consts, dtype=float))
+    energies = np.atleast_2d(np.asarray(energies, dtype=float))
+    mask = np.isfinite(lat_consts) & np.isfinite(energies)
+    num_points = mask.sum(axis=1)
+
+    # centred and scaled to [-1, 1] per group, energies relative to the lowest one - keeps the normal equations well conditioned
+    t = np.where(mask, forward(np.where(mask, lat_consts, 1)), 0)
+    center = t.sum(axis=1) / np.maximum(num_points, 1)
+    scale = np.max(np.where(mask, np.abs(t - center[:, None]), 0), axis=1)
+    scale = np.where(scale > 0, scale, 1)
+    x = np.where(mask, (t - center[:, None]) / scale[:, None], 0)
+    e_ref = np.min(np.where(mask, energies, np.inf), axis=1)
+    e_ref = np.where(np.isfinite(e_ref), e_ref, 0)
+    y = np.where(mask, energies - e_ref[:, None], 0)
+
+    design = x[..., None]**np.arange(4) * mask[..., None]
+    fitted = num_points >= 4
+    normal_matrix = np.where(fitted[:, None, None], np.einsum('gpi,gpj->gij', design, design), np.eye(4))
+    normal_inv = np.linalg.pinv(normal_matrix)
+    coeffs = np.einsum('gij,gpj,gp->gi', normal_inv, design, y)
+
+    dof = num_points - 4
+    residuals = np.sum((y - np.einsum('gpi,gi->gp', design, coeffs))**2, axis=1)
+    noise = np.where(dof > 0, residuals / np.maximum(dof, 1), np.nan)
+
+    c0, c1, c2, c3 = coeffs.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # root of c1 + 2 c2 x + 3 c3 x^2 with E'' = 2 root_disc > 0, in the form without cancellation
+        root_disc = np.sqrt(np.where(c2**2 - 3 * c1 * c3 >= 0, c2**2 - 3 * c1 * c3, np.nan))
+        x_min = np.where(c2 >= 0, -c1 / (c2 + root_disc), (root_disc - c2) / (3 * c3))
+        curvature = 2 * c2 + 6 * c3 * x_min
+        x_min = np.where(fitted & np.isfinite(x_min) & (curvature > 0), x_min, np.nan)
+
+        # error of the minimum: dx_min / dc_k = -k x_min^(k-1) / E''
+        grad = -np.stack([np.zeros_like(x_min), np.ones_like(x_min), 2 * x_min, 3 * x_min**2], axis=1) / curvature[:, None]
+        x_min_variance = noise * np.einsum('gi,gij,gj->g', grad, normal_inv, grad)
+
+        eq_lat_const = inverse(center + scale * x_min)
+        slope = np.abs(derivative(eq_lat_const))
+        eq_lat_const_error = scale * np.sqrt(x_min_variance) / slope
+        e_min = c0 + c1 * x_min + c2 * x_min**2 + c3 * x_min**3 + e_ref
+
+        # V E''(V) with V = f a^3 and E'(a) = 0: E''(a) / (9 f a)
+        second_deriv = curvature / scale**2 * slope**2
+        bulk_modulus = second_deriv / (9 * np.asarray(volume_factors, dtype=float) * eq_lat_const) if volume_factors is not None \
+            else np.full_like(eq_lat_const, np.nan)
+
+    return LatticeFit(eq_lat_const, eq_lat_const_error, e_min, bulk_modulus, model, coeffs, center, scale, e_ref)
+
+
+def fit_energy(fit, lat_consts):
+    # energies of the fitted groups at lat_consts (groups x values)
+    forward = _FIT_MODELS[fit.model][0]
+    x = (forward(np.atleast_2d(np.asarray(lat_consts, dtype=float))) - fit.center[:, None]) / fit.scale[:, None]
+    return np.einsum('gpi,gi->gp', x[..., None]**np.arange(4), fit.coeffs) + fit.e_ref[:, None]
+
+
+def volume_factor(inputcard_data):
+    # unit cell volume / lattice constant^3 of an inputcard (json dict)
+    lattice = inputcard_data['lattice']
+    return abs(np.linalg.det(np.array(lattice['bravais-lattice'], dtype=float))) * np.prod(lattice.get('lattice-scaling', [1, 1, 1]))
+
+
+def read_lattice_points(calc_path, results_db=None):
+    """
+    lattice constants and energies of the point calculations of a group (DataFrame as lat_rel.csv) and its volume factor
+    --> with results_db the points are queried from it (if recorded there)
+    --> the DataFrame is indexed by the names of the point directories
+    """
+    import pandas as pd
+
     lat_rel = []
+    names = []
+    inputcard_data = None
+    points = results_db.group_points(calc_path) if results_db is not None else []
+    for point in points:
+        lat_rel.append([point['lat_const'], point['lat_const_unit'], point['e_tot'], point['energy_unit']])
+        names.append(pl.Path(point['path']).name)
+        inputcard_data = inputcard_data or point['parameters']
 
     # read out the data and save it in calc_path
-    for path in calc_path.iterdir():
+    for path in (sorted(calc_path.iterdir()) if not points else []):
         if not path.is_dir():
             continue
         data_path = path / _CSV_PATH
         data_df = pd.read_csv(data_path, index_col= 0)
         data = data_df.loc['lat_const'].to_list() + data_df.loc['e_tot'].to_list()
 
-        lat_rel.append(data)        
-    lat_rel_df = pd.DataFrame(lat_rel, columns=['lat_const', 'lat_const_unit', 'e_tot', 'e_tot_unit'])
+        lat_rel.append(data)
+        names.append(path.name)
+        if inputcard_data is None and (path / 'inputcard.json').exists():
+            with open(path / 'inputcard.json') as f:
+                inputcard_data = json.load(f)
+
+    # indexed by the point directories
+    lat_rel_df = pd.DataFrame(lat_rel, index=names, columns=['lat_const', 'lat_const_unit', 'e_tot', 'e_tot_unit'])
+    try:
+        factor = volume_factor(inputcard_data)
+    except (TypeError, KeyError, ValueError):
+        factor = np.nan
+    return lat_rel_df, factor
+
+
+def lattice_relax_postprocessing(calc_path, results_db=None, model='cubic'):
+    # with results_db the points are queried from it (if recorded there) and the fit is recorded
+    # model is the fit of fit_lattice_batch, lat_const_out.csv also holds the error of the minimum and the bulk modulus
+    import pandas as pd
+
+    lat_rel_df, factor = read_lattice_points(calc_path, results_db)
     # save in calc_path/lat_rel.csv
     lat_rel_df.to_csv(calc_path/'lat_rel.csv', index=False)
 
-    # fit the data to the polynomial function
-    eq_lat_data, params = fit_rel_data(lat_rel_df)
+    # fit the data
+    fit = fit_lattice_batch([lat_rel_df.lat_const], [lat_rel_df.e_tot], model, [factor])
+    lat_unit, en_unit = lat_rel_df.lat_const_unit.iloc[0], lat_rel_df.e_tot_unit.iloc[0]
+    eq_lat_data = [fit.eq_lat_const[0], lat_unit]
 
     # plot the data
-    plot_fit(lat_rel_df, params, calc_path/'lat_plot.png', eq_lat_const=eq_lat_data[0])
+    plot_fit(lat_rel_df, [], calc_path/'lat_plot.png', func=lambda x: fit_energy(fit, [x])[0], eq_lat_const=eq_lat_data[0])
 
     # wrtie the equilibrium data
-    eq_lat_df = pd.DataFrame([eq_lat_data], index=['eq_lat_const'], columns = ['value', 'unit'])
+    eq_lat_df = pd.DataFrame([eq_lat_data, [fit.eq_lat_const_error[0], lat_unit], [fit.bulk_modulus[0], f'{en_unit}/{lat_unit}^3']],
+                             index=['eq_lat_const', 'eq_lat_const_error', 'bulk_modulus'], columns = ['value', 'unit'])
     eq_lat_df.to_csv(calc_path/'lat_const_out.csv')
+    if results_db is not None:
+        results_db.record_group(calc_path, *eq_lat_data)
     
     return eq_lat_df.loc['eq_lat_const']
 
 
     
-def prepare_lattice_relaxation(relax_path, inputcard, max_dev, en_points, precision=3):
-    def get_dirname(dev):
-        name = ''
-        if dev == 0:
-            name = 'n'
-        elif dev < 0:
-            name = f'm_{np.abs(dev * 100):.2f}'
-        elif dev > 0:
-            name = f'p_{dev * 100:.2f}'
-        
-        return name
-    
-    inital_lat_const = float(inputcard.get_parameter('lattice')['lattice-constant'])
+def get_dirname(dev):
+    name = ''
+    if dev == 0:
+        name = 'n'
+    elif dev < 0:
+        name = f'm_{np.abs(dev * 100):.2f}'
+    elif dev > 0:
+        name = f'p_{dev * 100:.2f}'
+
+    return name
+
+
+def prepare_point(relax_path, inputcard, dev):
+    # directory and inputcard of the point calculation with the lattice constant of inputcard changed by dev
+    calc_path = relax_path / get_dirname(dev)
+    calc_path.mkdir(parents=True, exist_ok=True)
 
-    new_inputcard = deepcopy(inputcard)
+    new_lat_const = float(inputcard.get_parameter('lattice')['lattice-constant']) * (1 + dev)
 
+    new_inputcard = inputcard.derive('lattice', {'lattice-constant': new_lat_const})
+    new_inputcard.write_to_json(calc_path / 'inputcard.json')
+    return calc_path
+
+
+def prepare_lattice_relaxation(relax_path, inputcard, max_dev, en_points, precision=3):
     if max_dev > 1:
         max_dev = max_dev / 100
 
         deviations = np.linspace(-max_dev, max_dev, en_points)
 
-    for dev in deviations:
-        
-        calc_path = relax_path / get_dirname(dev)
-        calc_path.mkdir(parents=True, exist_ok=True)
+    # the point calculations, in the order of the deviations
+    return [prepare_point(relax_path, inputcard, dev) for dev in deviations]
+
+
+def _fit_polynomial(devs, energies, degree, en_noise):
+    # least squares polynomial in the deviation, its normal matrix and the energy noise
+    design = np.vander(devs, degree + 1)
+    coeffs = np.linalg.lstsq(design, energies, rcond=None)[0]
+
+    # noise from the residuals, at least en_noise (the scf cycles only converge the energy that far)
+    dof = len(devs) - degree - 1
+    noise = np.sum((energies - design @ coeffs)**2) / dof if dof > 0 else 0
+    return coeffs, design.T @ design, max(noise, en_noise**2)
+
+
+def _poly_minimum(coeffs, center=0):
+    # local minimum of the polynomial closest to center, None if there is none
+    deriv = np.polyder(coeffs)
+    second = np.polyder(deriv)
+    minima = [root.real for root in np.roots(deriv) if abs(root.imag) < 1e-12 and np.polyval(second, root.real) > 0]
+    return min(minima, key=lambda root: abs(root - center)) if minima else None
+
+
+def _minimum_variance(coeffs, normal_matrix, noise, dev_min):
+    # variance of the minimum position from the covariance of the coefficients (implicit function theorem, p'(dev_min) = 0)
+    degree = len(coeffs) - 1
+    powers = np.arange(degree, -1, -1)
+    grad = -powers * np.where(powers > 0, dev_min**np.maximum(powers - 1, 0), 0) / np.polyval(np.polyder(coeffs, 2), dev_min)
+    return noise * grad @ np.linalg.pinv(normal_matrix) @ grad
+
+
+def relax_adaptive(relax_path, inputcard, max_dev, run_points, tolerance=1e-3, min_points=4, max_points=9, en_noise=1e-5, resolution=1e-4,
+                   results_db=None):
+    """
+    lattice relaxation placing the point calculations one by one where they reduce the error of the
+    equilibrium lattice constant most, starting from -max_dev, 0 and +max_dev
+    --> run_points(calc_paths) runs the point calculations (each leaves an output.csv in its directory)
+    --> only the points within 1.5 max_dev of the minimum are fitted, the error combines the error of the fit and the
+        shift of the minimum with one polynomial degree more
+    --> if the fitted minimum lies outside the sampled range, the range is extended by max_dev towards it
+    --> stops once the standard error of the equilibrium lattice constant is below tolerance (lattice constant units)
+        and min_points are calculated, or after max_points points - already finished points in relax_path are reused
+    --> returns the equilibrium lattice constant, its error and the number of points (also recorded in results_db)
+    """
+    import pandas as pd
+
+    if max_dev > 1:
+        max_dev = max_dev / 100
+    lat_const = float(inputcard.get_parameter('lattice')['lattice-constant'])
+
+    def add_points(new_devs):
+        calc_paths = [prepare_point(relax_path, inputcard, dev) for dev in new_devs]
+        run_points([calc_path for calc_path in calc_paths if not (calc_path / _CSV_PATH).exists()])
+        for dev, calc_path in zip(new_devs, calc_paths):
+            if not (calc_path / _CSV_PATH).exists():
+                raise RuntimeError(f"point calculation {calc_path} failed, no {_CSV_PATH}")
+            devs.append(dev)
+            energies.append(pd.read_csv(calc_path / _CSV_PATH, index_col=0).loc['e_tot', 'value'])
+
+    devs = []
+    energies = []
+    add_points([-max_dev, 0, max_dev])
+
+    eq_dev, error = None, np.inf
+    while True:
+        all_x, all_y = np.array(devs), np.array(energies, dtype=float)
+        # only points within 1.5 max_dev of the minimum are fitted (at least 3), far away points spoil the polynomial
+        eq_dev = all_x[np.argmin(all_y)]
+        for _ in range(3):
+            distance = np.abs(all_x - eq_dev)
+            close = np.argsort(distance)[:max(3, np.sum(distance <= 1.5 * max_dev))]
+            x, y = all_x[close], all_y[close]
+
+            # quadratic below 5 points, cubic as fit_rel_data from 5 points on
+            degree = 2 if len(x) < 5 else 3
+            coeffs, normal_matrix, noise = _fit_polynomial(x, y, degree, en_noise)
+            eq_dev = _poly_minimum(coeffs, x[np.argmin(y)])
+            if eq_dev is None:
+                break
+
+        if eq_dev is None or not all_x.min() <= eq_dev <= all_x.max():
+            # re-centre: extend the range towards the minimum (or the lowest energy)
+            toward_low = eq_dev < all_x.min() if eq_dev is not None else all_y[np.argmin(all_x)] < all_y[np.argmax(all_x)]
+            new_dev = all_x.min() - max_dev if toward_low else all_x.max() + max_dev
+            error = np.inf
+        else:
+            variance = _minimum_variance(coeffs, normal_matrix, noise, eq_dev)
+            # model error: shift of the minimum with one degree more, the error only counts once it can be fitted
+            checked = len(x) > degree + 1
+            if checked:
+                higher_dev = _poly_minimum(_fit_polynomial(x, y, degree + 1, en_noise)[0], eq_dev)
+                variance += (higher_dev - eq_dev)**2 if higher_dev is not None else np.inf
+
+            error = lat_const * np.sqrt(variance)
+            if checked and error < tolerance and len(devs) >= min_points:
+                break
+
+            # candidate point within max_dev of the minimum with the smallest expected error of the minimum after adding it
+            candidates = np.linspace(max(all_x.min(), eq_dev - max_dev), min(all_x.max(), eq_dev + max_dev), 41)
+            candidates = np.round(candidates / resolution) * resolution
+            candidates = [dev for dev in candidates if np.min(np.abs(all_x - dev)) > max_dev / 8]
+            if not candidates:
+                break
+
+            def expected_variance(dev):
+                row = np.vander([dev], len(coeffs))[0]
+                return _minimum_variance(coeffs, normal_matrix + np.outer(row, row), noise, eq_dev)
+
+            new_dev = min(candidates, key=expected_variance)
+
+        new_dev = round(new_dev / resolution) * resolution
+        if len(devs) >= max_points or np.min(np.abs(np.array(devs) - new_dev)) < resolution / 2:
+            break
+        add_points([new_dev])
+
+    if len(devs) >= 4:
+        # lat_rel.csv and lat_plot.png as for the fixed grid
+        lattice_relax_postprocessing(relax_path, results_db)
+
+    eq_lat_const = lat_const * (1 + eq_dev) if eq_dev is not None else None
+    if eq_lat_const is not None:
+        # the windowed fit instead of the fit over all points (which may lie far from the minimum)
+        unit = pd.read_csv(relax_path / get_dirname(devs[0]) / _CSV_PATH, index_col=0).loc['lat_const', 'unit']
+        eq_lat_df = pd.DataFrame([[eq_lat_const, unit], [error, unit]], index=['eq_lat_const', 'eq_lat_const_error'], columns=['value', 'unit'])
+        eq_lat_df.to_csv(relax_path / 'lat_const_out.csv')
+        if results_db is not None:
+            results_db.record_group(relax_path, eq_lat_const, unit)
+
+    return eq_lat_const, error, len(devs)
+
+
+def fit_groups(group_paths, model='cubic', variable='lat_const', results_db=None, max_workers=None):
+    """
+    fits the relaxations of many groups in one batch (fit_lattice_batch) and returns the results as DataFrame indexed by group
+    --> variable lat_const: E(a) of lattice relaxations (conv_* directories of a convergence sweep)
+    --> variable c_over_a: E(c/a) of lattice missmatch calculations, the ratio is taken from the point directories ac_<ratio>
+        (no bulk modulus)
+    --> the points of the groups are read in parallel
+    """
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        groups = list(pool.map(lambda group_path: read_lattice_points(group_path, results_db), group_paths))
+
+    num_points = max([len(lat_rel_df) for lat_rel_df, _ in groups] + [1])
+    x = np.full((len(groups), num_points), np.nan)
+    energies = np.full((len(groups), num_points), np.nan)
+    for idx, (lat_rel_df, _) in enumerate(groups):
+        if variable == 'c_over_a':
+            x[idx, :len(lat_rel_df)] = [float(name.split('_', 1)[1]) for name in lat_rel_df.index]
+        else:
+            x[idx, :len(lat_rel_df)] = lat_rel_df.lat_const
+        energies[idx, :len(lat_rel_df)] = lat_rel_df.e_tot
+
+    volume_factors = [factor for _, factor in groups] if variable == 'lat_const' else None
+    fit = fit_lattice_batch(x, energies, model, volume_factors)
+
+    return pd.DataFrame({'eq_' + variable: fit.eq_lat_const, 'eq_' + variable + '_error': fit.eq_lat_const_error, 'e_min': fit.e_min,
+                         'bulk_modulus': fit.bulk_modulus,
+                         'lat_const_unit': [lat_rel_df.lat_const_unit.iloc[0] if len(lat_rel_df) else None for lat_rel_df, _ in groups],
+                         'e_tot_unit': [lat_rel_df.e_tot_unit.iloc[0] if len(lat_rel_df) else None for lat_rel_df, _ in groups]},
+                        index=pd.Index([group_path.name for group_path in group_paths], name='group'))
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Fit the lattice relaxations of all groups of a sweep in one batch")
+
+    parser.add_argument('-p', '--path', dest='path',
+                        help='path of the sweep, every directory containing point calculations is a group - writes <path>/lattice_fits.csv')
+    parser.add_argument('-m', '--model', dest='model', default='cubic', choices=list(_FIT_MODELS),
+                        help='fitted function of the lattice constant, cubic polynomial or Birch-Murnaghan equation of state')
+    parser.add_argument('--variable', dest='variable', default='lat_const', choices=['lat_const', 'c_over_a'],
+                        help='fitted variable, lat_const for a convergence sweep and c_over_a for a lattice missmatch calculation')
+    parser.add_argument('--results_db', dest='results_db', default=None,
+                        help='results database the points are queried from (see results_db.py)')
+
+    args = parser.parse_args()
+
+    path = pl.Path(args.path)
+    results_db = None
+    if args.results_db:
+        from results_db import ResultsDB
+        results_db = ResultsDB(args.results_db)
+
+    group_paths = sorted(group_path for group_path in path.iterdir()
+                         if group_path.is_dir() and any(point_path.is_dir() for point_path in group_path.iterdir()))
+    fits = fit_groups(group_paths, args.model, args.variable, results_db)
+    fits.to_csv(path / _FITS_NAME)
+    print(fits, file=sys.stdout)
 
-        new_lat_const = inital_lat_const * (1 + dev)
 
-        new_inputcard.change_parameter('lattice', {'lattice-constant': new_lat_const})
-        new_inputcard.write_to_json(calc_path / 'inputcard.json')
+if __name__ == '__main__':
+    main()
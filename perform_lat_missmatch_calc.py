@@ -5,6 +5,7 @@ from subprocess import run
 
 from inputcard_converter import Inputcard
 from lattice_missmatch_calc import prepare_lattice_missmatch_relaxation
+from task_manifest import write_manifest
 
 
 def main():
@@ -44,6 +45,7 @@ def main():
     init_lat_const = inputcard.get_parameter('lattice')['lattice-constant']
     deviations = np.linspace(-max_dev, max_dev, args.lat_points)
 
+    task_paths = []
     for dev in deviations:
         
         lat_const = init_lat_const * (1 + dev)
@@ -51,7 +53,7 @@ def main():
 
         lat_path.mkdir(parents=True, exist_ok=True)
 
-        prepare_lattice_missmatch_relaxation(
+        task_paths += prepare_lattice_missmatch_relaxation(
             relax_path      = lat_path, 
             inputcard       = inputcard, 
             min_ratio       = args.min_missmatch_ratio,
@@ -60,5 +62,8 @@ def main():
             lattice_constant= lat_const
             )
 
+    # array task n runs the point calculation in record n of the manifest
+    write_manifest(base_path, task_paths)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
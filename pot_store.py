@@ -0,0 +1,164 @@
+import pathlib as pl
+import argparse
+import hashlib
+import os
+import shutil
+import stat
+import sys
+import tempfile
+
+_OBJECTS_DIR = 'objects'
+_HASH_BLOCK_SIZE = 1 << 20
+
+# files of finished calculations that are stored as blobs by dedup
+DEDUP_PATTERNS = ['voro/*.pot', 'scf-calc/*.pot', 'scf-calc/potio', 'scf-calc/broy']
+_FINISHED_MARKERS = ['CONVERGED', 'NOT_CONVERGED']
+
+
+def file_hash(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(_HASH_BLOCK_SIZE):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _replace_with_link(blob_path, dest_path):
+    # link next to dest and rename over it, so dest is never missing or half written
+    tmp_path = dest_path.parent / f'.{dest_path.name}.{os.getpid()}.lnk'
+    try:
+        os.link(blob_path, tmp_path)
+    except OSError:
+        # different file system (or no hardlinks) - fall back to a plain copy
+        shutil.copyfile(blob_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+
+class PotentialStore:
+    """
+    content addressed blob store for potential files - every distinct file content is kept once as
+    <store>/objects/<sha[:2]>/<sha> and hardlinked into the calculation directories
+    --> blobs are read only: a program writing into a linked file fails instead of changing every copy
+    --> gc removes blobs that are no longer linked anywhere
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = pl.Path(store_dir)
+        (self.store_dir / _OBJECTS_DIR).mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, digest):
+        return self.store_dir / _OBJECTS_DIR / digest[:2] / digest
+
+    def add(self, file_path):
+        """
+        puts the content of file_path into the store (file_path is not changed) and returns the blob path
+        """
+        file_path = pl.Path(file_path)
+        blob_path = self.blob_path(file_hash(file_path))
+        if blob_path.exists():
+            return blob_path
+
+        blob_path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.', dir=blob_path.parent)
+        os.close(fd)
+        tmp_path = pl.Path(tmp_path)
+        shutil.copyfile(file_path, tmp_path)
+        tmp_path.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        # if another process added the same content in the meantime this just replaces identical data
+        os.replace(tmp_path, blob_path)
+
+        return blob_path
+
+    def link(self, src_path, dest_path):
+        # dest_path becomes a hardlink to the blob holding the content of src_path
+        blob_path = self.add(src_path)
+        if pl.Path(dest_path).exists() and os.path.samefile(blob_path, dest_path):
+            return blob_path
+
+        try:
+            _replace_with_link(blob_path, pl.Path(dest_path))
+        except FileNotFoundError:
+            # a concurrent gc removed the blob before it was linked
+            blob_path = self.add(src_path)
+            _replace_with_link(blob_path, pl.Path(dest_path))
+        return blob_path
+
+    def absorb(self, file_path):
+        # replaces file_path by a link into the store, returns the number of bytes saved
+        file_path = pl.Path(file_path)
+        blob_path = self.blob_path(file_hash(file_path))
+        saved = file_path.stat().st_size if blob_path.exists() else 0
+
+        self.link(file_path, file_path)
+        return saved
+
+    def dedup(self, root, patterns=DEDUP_PATTERNS):
+        """
+        absorbs the potential files of all finished point calculations below root
+        --> returns the number of files and the bytes saved
+        """
+        num_files = 0
+        saved = 0
+        for scf_path in pl.Path(root).glob('**/scf-calc'):
+            if not any((scf_path / marker).exists() for marker in _FINISHED_MARKERS):
+                continue
+
+            for pattern in patterns:
+                for file_path in scf_path.parent.glob(pattern):
+                    if file_path.is_file() and not file_path.is_symlink():
+                        saved += self.absorb(file_path)
+                        num_files += 1
+
+        return num_files, saved
+
+    def gc(self):
+        # removes all blobs that are only referenced by the store itself, returns number and size of the removed blobs
+        removed = 0
+        freed = 0
+        for blob_path in (self.store_dir / _OBJECTS_DIR).glob('*/*'):
+            # .* are the temporary files of a running add
+            if blob_path.name.startswith('.'):
+                continue
+            try:
+                blob_stat = blob_path.stat()
+                if blob_stat.st_nlink == 1:
+                    blob_path.unlink()
+                    removed += 1
+                    freed += blob_stat.st_size
+            except FileNotFoundError:
+                # replaced or removed concurrently
+                pass
+
+        return removed, freed
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Deduplicating store for the potential files of Giessen-KKR calculations")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    dedup_parser = subparsers.add_parser('dedup', help='replace the potential files of finished calculations below <path> with hardlinks into the store')
+    dedup_parser.add_argument('-s', '--store', dest='store', required=True,
+                              help='directory of the store (has to be on the same file system as the calculations)')
+    dedup_parser.add_argument('-p', '--path', dest='paths', nargs='+',
+                              help='paths below which the calculations are searched')
+
+    gc_parser = subparsers.add_parser('gc', help='remove blobs that are not linked into any calculation anymore')
+    gc_parser.add_argument('-s', '--store', dest='store', required=True,
+                           help='directory of the store')
+
+    args = parser.parse_args()
+
+    store = PotentialStore(args.store)
+    if args.mode == 'dedup':
+        for path in args.paths:
+            num_files, saved = store.dedup(pl.Path(path))
+            print(f"{path}: {num_files} files, {saved / 1024**2:.1f} MB saved", file=sys.stdout)
+
+    elif args.mode == 'gc':
+        removed, freed = store.gc()
+        print(f"{removed} blobs removed, {freed / 1024**2:.1f} MB freed", file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+import pathlib as pl
+import argparse
+import os
+import sys
+import threading
+import numpy as np
+from collections import namedtuple
+
+# one block of a (spherical, ASA) potential file as written by the kkr code (potio), old_voronoi (start.pot) or Const
+# (Constant.pot, ref.pot) - the blocks of Const have no core flag and list mesh and drdi next to the potential
+AtomPotential = namedtuple('AtomPotential', ['title', 'rmt', 'alat', 'rmtnew', 'z', 'rws', 'efermi', 'vbc', 'irws', 'a', 'b',
+                                             'core_states', 'core_flag', 'values', 'mesh', 'drdi'], defaults=(None, None))
+
+_VALUES_PER_LINE = 4
+_HEADER_LINES = 7
+
+# header values of the binary sidecar, in the order of its header array
+_HEADER_FIELDS = ['rmt', 'alat', 'rmtnew', 'z', 'rws', 'efermi', 'vbc', 'irws', 'a', 'b']
+_SIDECAR_SUFFIX = '.npy'
+
+
+def _fortran_float(value):
+    return float(value.replace('D', 'E').replace('d', 'e'))
+
+def _fortran_floats(lines):
+    # all numbers of lines in one pass (fortran writes double precision exponents with a D)
+    return np.array(b' '.join(lines).replace(b'D', b'E').replace(b'd', b'e').split(), dtype=float)
+
+def _d_format(value, width, precision):
+    # fortran 1PDw.d - one digit before the decimal point
+    return f"{value:{width}.{precision}E}".replace('E', 'D')
+
+def _d_format_0(value, width, precision):
+    # fortran Dw.d - mantissa between 0.1 and 1
+    if value == 0:
+        return f"{0:.{precision}f}D+00".rjust(width)
+
+    exponent = int(np.floor(np.log10(abs(value)))) + 1
+    mantissa = round(value / 10**exponent, precision)
+    if abs(mantissa) >= 1:
+        mantissa /= 10
+        exponent += 1
+    return f"{mantissa:.{precision}f}D{exponent:+03d}".rjust(width)
+
+
+def read_potential(pot_path):
+    """
+    reads a potential file into a list of AtomPotential (one per atom and spin)
+    --> core_states is a list of (l, core energy), values holds the potential on the radial mesh
+    --> only the headers are read line by line, the numbers on the mesh of all atoms are converted at once
+    """
+    with open(pot_path, 'rb') as f:
+        lines = f.read().splitlines()
+
+    headers = []
+    value_lines = []
+    idx = 0
+    while idx < len(lines):
+        title = lines[idx].decode()
+        rmt, alat, rmtnew = (float(value) for value in lines[idx + 1].split())
+        z = float(lines[idx + 2])
+        rws, efermi, vbc = (float(value) for value in lines[idx + 3].split())
+        irws = int(lines[idx + 4])
+        a, b = (_fortran_float(value.decode()) for value in lines[idx + 5].split())
+        core_line = [int(value) for value in lines[idx + 6].split()]
+        ncore = core_line[0]
+        # Const writes the number of core states only, followed by one line (r, drdi, V) per mesh point
+        core_flag = core_line[1] if len(core_line) > 1 else None
+        idx += _HEADER_LINES
+
+        core_states = []
+        for line in lines[idx:idx + ncore]:
+            l, energy = line.split()
+            core_states.append((int(l), _fortran_float(energy.decode())))
+        idx += ncore
+
+        num_lines = -(-irws // _VALUES_PER_LINE) if core_flag is not None else irws
+        value_lines += lines[idx:idx + num_lines]
+        idx += num_lines
+
+        headers.append((title, rmt, alat, rmtnew, z, rws, efermi, vbc, irws, a, b, core_states, core_flag))
+
+    numbers = _fortran_floats(value_lines)
+
+    atoms = []
+    start = 0
+    for header in headers:
+        irws, core_flag = header[8], header[12]
+        if core_flag is not None:
+            atoms.append(AtomPotential(*header, numbers[start:start + irws]))
+            start += irws
+        else:
+            table = numbers[start:start + 3 * irws].reshape(irws, 3)
+            atoms.append(AtomPotential(*header, table[:, 2], table[:, 0], table[:, 1]))
+            start += 3 * irws
+
+    if start != len(numbers):
+        raise ValueError(f"{pot_path}: {len(numbers)} numbers on the radial meshes, expected {start}")
+
+    return atoms
+
+
+def format_potential(atoms):
+    lines = []
+    for atom in atoms:
+        lines.append(atom.title)
+        lines.append(f"{atom.rmt:12.8f}{atom.alat:12.8f}{atom.rmtnew:12.8f}")
+        lines.append(f"{atom.z:10.5f}")
+        lines.append(f"{atom.rws:10.5f}{atom.efermi:15.10f}{atom.vbc:15.10f}")
+        lines.append(f"{atom.irws:3d}")
+        lines.append(f"{_d_format_0(atom.a, 15, 8)}{_d_format_0(atom.b, 15, 8)}")
+        if atom.core_flag is None:
+            lines.append(f"{len(atom.core_states):2d}")
+        else:
+            lines.append(f"{len(atom.core_states):2d}{atom.core_flag:2d}")
+        for l, energy in atom.core_states:
+            lines.append(f"{l:5d}{_d_format(energy, 20, 11)}")
+
+        if atom.core_flag is None:
+            for r, drdi, value in zip(atom.mesh, atom.drdi, atom.values):
+                lines.append(f"{_d_format(r, 15, 6)}{_d_format(drdi, 15, 6)}{_d_format(value, 15, 8)}")
+        else:
+            for start in range(0, len(atom.values), _VALUES_PER_LINE):
+                lines.append("".join(_d_format(value, 20, 12) for value in atom.values[start:start + _VALUES_PER_LINE]))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_potential(atoms, pot_path):
+    with open(pot_path, 'w') as f:
+        f.write(format_potential(atoms))
+
+
+def sidecar_path(pot_path):
+    # <pot_path>.npy - doesn't match the *.pot patterns of the preprocessing and the potential store
+    pot_path = pl.Path(pot_path)
+    return pot_path.with_name(pot_path.name + _SIDECAR_SUFFIX)
+
+
+def write_sidecar(atoms, pot_path, out_path=None):
+    """
+    saves atoms (read from pot_path) as binary sidecar (default <pot_path>.npy), marked with size and mtime of pot_path
+    --> one structured record holding every quantity of all atoms as an array (values, mesh and drdi concatenated,
+        offsets per atom), so the sidecar is one memory mappable .npy file without pickled objects
+    """
+    pot_path = pl.Path(pot_path)
+    out_path = pl.Path(out_path) if out_path is not None else sidecar_path(pot_path)
+    pot_stat = pot_path.stat()
+
+    core_states = [state for atom in atoms for state in atom.core_states]
+    num_values = sum(len(atom.values) for atom in atoms)
+    fields = {
+        'source': np.array([pot_stat.st_size, pot_stat.st_mtime_ns], dtype=np.int64),
+        'titles': np.array([atom.title.encode() for atom in atoms], dtype=bytes),
+        'header': np.array([[getattr(atom, field) for field in _HEADER_FIELDS] for atom in atoms], dtype=float).reshape(-1, len(_HEADER_FIELDS)),
+        # -1 marks the blocks of Const (no core flag, mesh and drdi given)
+        'core_flags': np.array([-1 if atom.core_flag is None else atom.core_flag for atom in atoms], dtype=np.int64),
+        'core_offsets': np.cumsum([0] + [len(atom.core_states) for atom in atoms], dtype=np.int64),
+        'core_l': np.array([l for l, _ in core_states], dtype=np.int64),
+        'core_energies': np.array([energy for _, energy in core_states], dtype=float),
+        'value_offsets': np.cumsum([0] + [len(atom.values) for atom in atoms], dtype=np.int64),
+        'values': np.concatenate([atom.values for atom in atoms] + [np.empty(0)]),
+        'mesh': np.concatenate([atom.mesh if atom.mesh is not None else np.full(len(atom.values), np.nan) for atom in atoms] + [np.empty(0)]),
+        'drdi': np.concatenate([atom.drdi if atom.drdi is not None else np.full(len(atom.values), np.nan) for atom in atoms] + [np.empty(0)]),
+    }
+    # titles of at least one character, numpy has no zero width strings
+    fields['titles'] = fields['titles'].astype(f'S{max(fields["titles"].dtype.itemsize, 1)}')
+
+    record = np.zeros((), dtype=[(name, array.dtype, array.shape) for name, array in fields.items()])
+    for name, array in fields.items():
+        record[name] = array
+
+    # written next to the sidecar and renamed, readers never see half written files
+    tmp_path = out_path.with_name(f'.{out_path.name}.{os.getpid()}.{threading.get_ident()}')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, record)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def read_sidecar(sidecar, mmap_mode='r'):
+    """
+    reads the atoms of a binary sidecar, values, mesh and drdi of the atoms are (memory mapped, with mmap_mode) views
+    into the file
+    """
+    return _sidecar_atoms(np.load(sidecar, mmap_mode=mmap_mode))
+
+
+def _sidecar_atoms(record):
+    # every field once, indexing a memory mapped record is slow
+    record = {name: record[name] for name in record.dtype.names}
+
+    atoms = []
+    for idx, title in enumerate(record['titles']):
+        header = dict(zip(_HEADER_FIELDS, record['header'][idx].tolist()))
+        header['irws'] = int(header['irws'])
+        core = slice(record['core_offsets'][idx], record['core_offsets'][idx + 1])
+        core_states = list(zip(record['core_l'][core].tolist(), record['core_energies'][core].tolist()))
+        mesh = slice(record['value_offsets'][idx], record['value_offsets'][idx + 1])
+
+        core_flag = int(record['core_flags'][idx])
+        if core_flag < 0:
+            atoms.append(AtomPotential(title.decode(), **header, core_states=core_states, core_flag=None, values=record['values'][mesh],
+                                       mesh=record['mesh'][mesh], drdi=record['drdi'][mesh]))
+        else:
+            atoms.append(AtomPotential(title.decode(), **header, core_states=core_states, core_flag=core_flag, values=record['values'][mesh]))
+
+    return atoms
+
+
+def load_potential(pot_path, sidecar=True):
+    """
+    reads a potential file through its binary sidecar <pot_path>.npy - the sidecar is (re)written if it is missing or
+    pot_path changed since (size or mtime), unless the directory is read only
+    --> use this for repeated access (e.g. interpolating, mixing or comparing the potentials of many runs)
+    """
+    pot_path = pl.Path(pot_path)
+    if not sidecar:
+        return read_potential(pot_path)
+
+    pot_stat = pot_path.stat()
+    try:
+        record = np.load(sidecar_path(pot_path), mmap_mode='r')
+        # written from the current pot_path
+        if tuple(record['source'].tolist()) == (pot_stat.st_size, pot_stat.st_mtime_ns):
+            return _sidecar_atoms(record)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    atoms = read_potential(pot_path)
+    try:
+        write_sidecar(atoms, pot_path)
+    except OSError:
+        pass
+    return atoms
+
+
+def radial_mesh(atom):
+    # exponential mesh r_i = b (exp(a (i-1)) - 1) with r_irws = rws
+    return atom.b * (np.exp(atom.a * np.arange(atom.irws)) - 1)
+
+
+def transfer_potential(source, target):
+    """
+    puts the potential of source onto the radial mesh of target (same atom), both radii scaled to their wigner seitz
+    radius, so a converged potential can be reused for a slightly different lattice constant
+    --> geometry (radii, mesh) is taken from target, fermi energy, core states and potential from source
+    """
+    if source.z != target.z:
+        raise ValueError(f"Can't transfer the potential of Z={source.z} onto Z={target.z}")
+
+    values = np.interp(radial_mesh(target) / target.rws, radial_mesh(source) / source.rws, source.values)
+
+    return target._replace(efermi=source.efermi, vbc=source.vbc, core_states=source.core_states,
+                           core_flag=source.core_flag, values=values)
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Read potential files (potio, start.pot, ref.pot), convert them to binary sidecars and compare them")
+
+    parser.add_argument('-p', '--path', dest='paths', nargs='+', required=True,
+                        help='potential files')
+    parser.add_argument('--sidecar', dest='sidecar', action='store_true',
+                        help='write (or refresh) the binary sidecar <file>.npy of every file')
+    parser.add_argument('--check', dest='check', action='store_true',
+                        help='check that every file is written back byte-identically, from the text and from the sidecar')
+    parser.add_argument('--diff', dest='diff', action='store_true',
+                        help='print the largest difference of the potential of every atom to the first file')
+
+    args = parser.parse_args()
+
+    failed = 0
+    reference = None
+    for path in args.paths:
+        path = pl.Path(path)
+        atoms = load_potential(path) if args.sidecar else read_potential(path)
+
+        if args.check:
+            with open(path, 'r') as f:
+                text = f.read()
+            identical = format_potential(read_potential(path)) == text
+            if args.sidecar:
+                identical &= format_potential(read_sidecar(sidecar_path(path))) == text
+            failed += not identical
+            print(f"{path}: {'identical' if identical else 'DIFFERENT'}", file=sys.stdout)
+
+        elif args.diff:
+            if reference is None:
+                reference = atoms
+            if len(atoms) != len(reference) or any(len(atom.values) != len(ref.values) for atom, ref in zip(atoms, reference)):
+                print(f"{path}: not comparable (number of atoms or mesh points)", file=sys.stdout)
+                continue
+            print(f"{path}: " + " ".join(f"{np.max(np.abs(atom.values - ref.values)):.6e}" for atom, ref in zip(atoms, reference)),
+                  file=sys.stdout)
+
+        elif not args.sidecar:
+            for atom in atoms:
+                print(atom.title.split()[0], atom.z, atom.rws, atom.efermi, len(atom.core_states), atom.values[[0, -1]], file=sys.stdout)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
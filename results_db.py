@@ -0,0 +1,154 @@
+import pathlib as pl
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# default location, can be changed with KKR_RESULTS_DB
+RESULTS_DB_ENV = 'KKR_RESULTS_DB'
+RESULTS_DB_NAME = 'results.sqlite'
+
+# seconds a writer waits for another one (e.g. the postprocessing of many array tasks finishing at once)
+_BUSY_TIMEOUT = 120
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    path            TEXT PRIMARY KEY,
+    group_path      TEXT NOT NULL,
+    sweep_path      TEXT NOT NULL,
+    parameters      TEXT NOT NULL,
+    lat_const       REAL,
+    lat_const_unit  TEXT,
+    e_fermi         REAL,
+    e_tot           REAL,
+    energy_unit     TEXT,
+    converged       INTEGER,
+    rms_error       REAL,
+    iterations      INTEGER,
+    scf_time        REAL,
+    started         REAL,
+    finished        REAL,
+    recorded        REAL
+);
+CREATE INDEX IF NOT EXISTS points_group ON points (group_path);
+CREATE INDEX IF NOT EXISTS points_sweep ON points (sweep_path);
+
+CREATE TABLE IF NOT EXISTS groups (
+    path            TEXT PRIMARY KEY,
+    sweep_path      TEXT NOT NULL,
+    eq_lat_const    REAL,
+    lat_const_unit  TEXT,
+    recorded        REAL
+);
+CREATE INDEX IF NOT EXISTS groups_sweep ON groups (sweep_path);
+"""
+
+
+def _key(path):
+    # points are identified by their resolved directory, the same for every task, worker and symlinked project path
+    return str(pl.Path(path).resolve())
+
+
+class ResultsDB:
+    """
+    results of the point calculations of a project in one SQLite file (<project>/results.sqlite)
+    --> points: parameters (inputcard.json), lattice constant, energies, convergence, iterations and timing of every point
+    --> groups: fitted equilibrium lattice constant of every conv_* directory
+    --> every record is one transaction, concurrent writers wait for each other
+    """
+
+    def __init__(self, db_path):
+        self.db_path = pl.Path(db_path)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=_BUSY_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _query(self, query, args):
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(query, args)]
+        finally:
+            conn.close()
+
+    def _write(self, query, args):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(query, args)
+        finally:
+            conn.close()
+
+    def record_point(self, point_path, parameters, lat_const, e_fermi, e_tot, converged, rms_error, iterations, scf_time=None,
+                     started=None, finished=None, lat_const_unit='a0', energy_unit='Ry'):
+        point_path = pl.Path(_key(point_path))
+        self._write('INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (str(point_path), str(point_path.parent), str(point_path.parent.parent), json.dumps(parameters), lat_const,
+                     lat_const_unit, e_fermi, e_tot, energy_unit, int(converged), rms_error, iterations, scf_time, started, finished,
+                     time.time()))
+
+    def record_group(self, group_path, eq_lat_const, lat_const_unit='a0'):
+        group_path = pl.Path(_key(group_path))
+        self._write('INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?, ?)',
+                    (str(group_path), str(group_path.parent), eq_lat_const, lat_const_unit, time.time()))
+
+    def group_points(self, group_path):
+        # points of a conv_* directory, ordered by their directory names (as the directories are sorted)
+        points = self._query('SELECT * FROM points WHERE group_path = ? ORDER BY path', (_key(group_path),))
+        for point in points:
+            point['parameters'] = json.loads(point['parameters'])
+        return points
+
+    def group(self, group_path):
+        groups = self._query('SELECT * FROM groups WHERE path = ?', (_key(group_path),))
+        return groups[0] if groups else None
+
+    def sweep_groups(self, sweep_path):
+        # conv_* directories with recorded points
+        return [pl.Path(row['group_path']) for row in
+                self._query('SELECT DISTINCT group_path FROM points WHERE sweep_path = ? ORDER BY group_path', (_key(sweep_path),))]
+
+
+    def sweeps(self):
+        # sweep directories with recorded points
+        return [pl.Path(row['sweep_path']) for row in self._query('SELECT DISTINCT sweep_path FROM points ORDER BY sweep_path', ())]
+
+
+def default_db_path(calc_path):
+    # <project>/results.sqlite for a point calculation <project>/<sweep>/<group>/<point>, unless KKR_RESULTS_DB is set
+    return pl.Path(os.environ.get(RESULTS_DB_ENV, pl.Path(calc_path).resolve().parents[2] / RESULTS_DB_NAME))
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Query the results database of the point calculations of a project")
+
+    parser.add_argument('-d', '--db', dest='db', required=True,
+                        help='path of the results database')
+    parser.add_argument('-p', '--path', dest='path',
+                        help='sweep (or conv_* group) whose points are printed. Default are all points of the database')
+
+    args = parser.parse_args()
+
+    results_db = ResultsDB(args.db)
+    if args.path is None:
+        groups = [group_path for sweep_path in results_db.sweeps() for group_path in results_db.sweep_groups(sweep_path)]
+    else:
+        path = pl.Path(args.path)
+        groups = results_db.sweep_groups(path) or [path]
+
+    columns = ['lat_const', 'e_fermi', 'e_tot', 'converged', 'rms_error', 'iterations', 'scf_time']
+    print('path,' + ','.join(columns), file=sys.stdout)
+    for group_path in groups:
+        for point in results_db.group_points(group_path):
+            print(point['path'] + ',' + ','.join(str(point[column]) for column in columns), file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
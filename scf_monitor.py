@@ -0,0 +1,196 @@
+import pathlib as pl
+import argparse
+import math
+import sys
+import time
+
+from kkr_output import ScfOutputParser
+
+_KKR_OUT_NAME = 'kkr.out'
+
+# number of iterations used to fit the convergence rate
+_RATE_WINDOW = 10
+
+
+def fit_convergence_rate(iterations, window=_RATE_WINDOW):
+    """
+    least squares slope of log10(rms-error) over the last <window> iterations in decades per iteration
+    (negative if the calculation converges) - returns None if there are less than 3 usable iterations
+    """
+    points = [(it.iteration, math.log10(it.rms_error)) for it in iterations[-window:] if it.rms_error]
+    if len(points) < 3:
+        return None
+
+    x_mean = sum(x for x, _ in points) / len(points)
+    y_mean = sum(y for _, y in points) / len(points)
+    sxx = sum((x - x_mean)**2 for x, _ in points)
+    sxy = sum((x - x_mean) * (y - y_mean) for x, y in points)
+
+    return sxy / sxx
+
+
+def projected_iterations(iterations, bound, window=_RATE_WINDOW):
+    # iterations still needed to get the rms-error below bound (inf if the rms-error does not decrease)
+    if iterations[-1].rms_error < bound:
+        return 0
+
+    rate = fit_convergence_rate(iterations, window)
+    if rate is None or rate >= 0:
+        return math.inf
+
+    return (math.log10(bound) - math.log10(iterations[-1].rms_error)) / rate
+
+
+class KKROutputFollower:
+    """
+    follows a (growing) kkr.out - remembers the file offset and parses only the bytes appended since the last poll
+    """
+
+    def __init__(self, kkr_out_path):
+        self.path = pl.Path(kkr_out_path)
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self.parser = ScfOutputParser()
+        self.iterations = []
+
+    def poll(self):
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return []
+
+        if size < self.offset:
+            # the file was truncated - the calculation was restarted
+            self._reset()
+
+        if size == self.offset:
+            return []
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+
+        self.offset += len(data)
+        new_iterations = self.parser.feed(data)
+        self.iterations += new_iterations
+
+        return new_iterations
+
+    def status(self, window=_RATE_WINDOW):
+        """
+        snapshot of the calculation as a dict: iteration, rms-error, status, projected time to QBOUND (s) and
+        Fermi energy drift (Ry per iteration)
+        """
+        status = {'path': self.path, 'iteration': None, 'rms_error': None, 'status': 'waiting',
+                  'time_to_qbound': None, 'fermi_drift': None}
+        if not self.iterations:
+            return status
+
+        last = self.iterations[-1]
+        bound = self.parser.qbound
+        status['iteration'] = last.iteration
+        status['rms_error'] = last.rms_error
+
+        if len(self.iterations) > 1 and last.e_fermi is not None and self.iterations[-2].e_fermi is not None:
+            status['fermi_drift'] = last.e_fermi - self.iterations[-2].e_fermi
+
+        if bound is None or last.rms_error is None:
+            status['status'] = 'running'
+            return status
+
+        remaining = projected_iterations(self.iterations, bound, window)
+        if remaining == 0:
+            status['status'] = 'converged'
+            status['time_to_qbound'] = 0
+        elif math.isinf(remaining):
+            status['status'] = 'stalled' if len(self.iterations) >= window else 'running'
+            status['time_to_qbound'] = math.inf
+        else:
+            status['status'] = 'running'
+            times = [it.time for it in self.iterations[-window:] if it.time is not None]
+            if times:
+                status['time_to_qbound'] = remaining * sum(times) / len(times)
+
+        return status
+
+
+def find_kkr_outputs(paths, kkr_out_file=_KKR_OUT_NAME):
+    kkr_outs = []
+    for path in paths:
+        kkr_outs += sorted(pl.Path(path).glob(f'**/scf-calc/{kkr_out_file}'))
+    return kkr_outs
+
+
+def format_status_table(statuses):
+    def fmt_time(seconds):
+        if seconds is None:
+            return '-'
+        if math.isinf(seconds):
+            return 'never'
+        return f"{seconds / 3600:.1f} h"
+
+    lines = [f"{'directory':<40}{'iter':>6}{'rms-error':>12}{'to QBOUND':>12}{'dE_F/iter':>12}  status"]
+    for status in statuses:
+        rms = f"{status['rms_error']:.2e}" if status['rms_error'] is not None else '-'
+        drift = f"{status['fermi_drift']:+.2e}" if status['fermi_drift'] is not None else '-'
+        iteration = status['iteration'] if status['iteration'] is not None else '-'
+        directory = str(status['path'].parent.parent)
+
+        lines.append(f"{directory:<40}{iteration:>6}{rms:>12}{fmt_time(status['time_to_qbound']):>12}{drift:>12}  {status['status']}")
+
+    return '\n'.join(lines)
+
+
+def watch(paths, interval=60, kkr_out_file=_KKR_OUT_NAME, window=_RATE_WINDOW, once=False, out=sys.stdout):
+    followers = {}
+
+    while True:
+        # new calculations may appear while we are watching
+        for kkr_out_path in find_kkr_outputs(paths, kkr_out_file):
+            if kkr_out_path not in followers:
+                followers[kkr_out_path] = KKROutputFollower(kkr_out_path)
+
+        for follower in followers.values():
+            follower.poll()
+
+        table = format_status_table([follower.status(window) for follower in followers.values()])
+        if out.isatty() and not once:
+            # redraw in place
+            out.write('\033[2J\033[H')
+        print(table, file=out, flush=True)
+
+        if once:
+            return followers
+        time.sleep(interval)
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Monitoring of running scf calculations of the Giessen-KKR code")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    watch_parser = subparsers.add_parser('watch', help='follow all <path>/**/scf-calc/kkr.out files and show a live status table')
+    watch_parser.add_argument('-p', '--path', dest='paths', nargs='+',
+                              help='paths below which the scf-calc directories are searched')
+    watch_parser.add_argument('--interval', dest='interval', type=float, default=60,
+                              help='seconds between two polls of the output files')
+    watch_parser.add_argument('--window', dest='window', type=int, default=_RATE_WINDOW,
+                              help='number of iterations used to fit the convergence rate')
+    watch_parser.add_argument('--kkr_output_name', dest='kkr_out_file', default=_KKR_OUT_NAME,
+                              help='name of the files created by the kkr code. Default is <kkr.out>')
+    watch_parser.add_argument('--once', dest='once', action='store_true',
+                              help='print the table once and exit')
+
+    args = parser.parse_args()
+
+    if args.mode == 'watch':
+        try:
+            watch(args.paths, args.interval, args.kkr_out_file, args.window, args.once)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,38 @@
 import pathlib as pl
-import numpy as np
 import shutil
 import sys
 import json
+import csv
 
-import pandas as pd
 import argparse
 
 from inputcard_converter import Inputcard
-import voronoi as voro
+from kkr_output import iter_scf_iterations
+from results_db import ResultsDB, default_db_path
 
 
-def extract_scf_data(inputcard, calc_path, output_file):
+def extract_scf_data(inputcard, calc_path, output_file, results_db=None, parameters=None):
     # extracts energy (in e.v and the lattice constant and writes them, as well as the version of the code into a file)
+    # with results_db the point is also recorded there (parameters is the content of its inputcard.json)
     out_file_path = calc_path / output_file
 
-    with open(out_file_path, 'r') as out_file:
-        lines = out_file.readlines()
-    
     lattice_constant = inputcard.get_parameter('lattice')['lattice-constant']
 
     fermi_energy = None
     last_threshold = 1
     total_energy = None
-    for line in lines:
-        content = line.strip('\n').split()
-        if 'FERMI' in content:
-            fermi_energy = content[3]
-
-        if len(content) > 1 and content[0:3] == ['total', 'energy', 'in']:
-            total_energy = float(content[-1])
-        
-        if 'rms-error' in content and "no.:" in content:
-            last_threshold = float(content[-1].replace('D', 'e'))
+    iterations = 0
+    scf_time = None
+    for iteration in iter_scf_iterations(out_file_path):
+        iterations += 1
+        if iteration.e_fermi is not None:
+            fermi_energy = iteration.e_fermi
+        if iteration.e_tot is not None:
+            total_energy = iteration.e_tot
+        if iteration.rms_error is not None:
+            last_threshold = iteration.rms_error
+        if iteration.time is not None:
+            scf_time = (scf_time or 0) + iteration.time
 
     bound = inputcard.get_parameter('scf-cycle')['QBOUND']
     if last_threshold < bound:
@@ -46,11 +46,19 @@ def extract_scf_data(inputcard, calc_path, output_file):
         
         print(1, file=sys.stdout)
     
-    out_df = pd.DataFrame([[lattice_constant, 'a0'], [fermi_energy, 'Ry'], [total_energy, 'Ry']], index=['lat_const', 'e_fermi', 'e_tot'], columns = ['value', 'unit'])
-    out_df.to_csv(calc_path.parent / 'output.csv')
+    # same layout as DataFrame.to_csv, without importing pandas in every task
+    with open(calc_path.parent / 'output.csv', 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerows([['', 'value', 'unit'], ['lat_const', lattice_constant, 'a0'], ['e_fermi', fermi_energy, 'Ry'], ['e_tot', total_energy, 'Ry']])
+
+    if results_db is not None:
+        # the inputcard is written by the preprocessing, the output by the last iteration
+        started = (calc_path / 'inputcard.scf').stat().st_mtime if (calc_path / 'inputcard.scf').exists() else None
+        results_db.record_point(calc_path.parent, parameters, lattice_constant, fermi_energy, total_energy, last_threshold < bound,
+                                last_threshold, iterations, scf_time, started, out_file_path.stat().st_mtime)
 
 
-def main():
+def main(argv=None):
 
     parser = argparse.ArgumentParser("Postprocessing of a single point calculation using the Giessen-KKR code")
 
@@ -65,16 +73,27 @@ def main():
     parser.add_argument('--kkr_output_name', dest='kkr_out_file', default='kkr.out',
                         help='name of the files created by the kkr code. Default is <kkr.out>')    
 
+    parser.add_argument('--results_db', dest='results_db', nargs='?', const='', default=None,
+                        help='also record the point in this results database (default if given without path: <project>/results.sqlite or KKR_RESULTS_DB)')
+
     parser.add_argument('--parallel', dest='para_bool', action='store_true', 
                         help='flag, enabeling the use of parallel kkr')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     inputcard = Inputcard()
     inputcard.read_in_json(args.json_inp_path)
 
     calc_path = pl.Path(args.path)
-    extract_scf_data(inputcard, calc_path, args.kkr_out_file)
+
+    results_db = None
+    parameters = None
+    if args.results_db is not None:
+        results_db = ResultsDB(args.results_db or default_db_path(calc_path.parent))
+        with open(args.json_inp_path, 'r') as f:
+            parameters = json.load(f)
+
+    extract_scf_data(inputcard, calc_path, args.kkr_out_file, results_db, parameters)
 
     print(0, file=sys.stdout)
 
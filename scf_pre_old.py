@@ -1,28 +1,29 @@
 import pathlib as pl
-import numpy as np
 import shutil
 import sys
 import json
 
-import pandas as pd
 import argparse
 
 from inputcard_converter import Inputcard
+from voro_cache import VoronoiCache, geometry_key, DEFAULT_CACHE_DIR
+from pot_store import PotentialStore
 import voronoi as voro
 
 
-def preprocess_scf_calc(inputcard, calc_path, weight_relation=[], write_json=False):
-    # since the voronoi program can't handle empty sphere weights yet it has to be supplied how the empty sphere weights are to be handled
-    # weight relation is supposed to be a list of length num_vac
-    # e.g weight_relation = [0,0,1, -1] - specifies 3 empty spheres (in the order of atominfo - they have to be at the end) where the first 
-    # two empty spheres will get the same weight calculated for atom with index 0, the third with the weight
-    # of atom 2 and the fourth will default to 1.0
-    # if weight relation is not supplied all of them will default to 1.0
+def place_potential(src_path, dest_path, pot_store=None):
+    if pot_store is not None:
+        pot_store.link(src_path, dest_path)
+    else:
+        # dest might still be a (read only) link into a potential store, never write through it
+        dest_path.unlink(missing_ok=True)
+        shutil.copyfile(src_path, dest_path)
 
-    scf_path = calc_path / 'scf-calc'
-    scf_path.mkdir(parents=True, exist_ok=True)
 
-    atom_weights, _ = voro.perform_voroni(inputcard, calc_path)
+def run_voronoi_stage(inputcard, calc_path, weight_relation=[], runner=None):
+    # runs voronoi, old_voronoi and Const in <calc_path>/voro (with the ToolRunner runner, default is the one of the process)
+    # returns the meta data of the stage: names of start and ref potential (in voro/), weights, radii and the atominfo change
+    atom_weights, mt_radii = voro.perform_voroni(inputcard, calc_path, runner=runner)
     
     weights = [float(w) for w in atom_weights]
     if weight_relation == []:
@@ -40,33 +41,88 @@ def preprocess_scf_calc(inputcard, calc_path, weight_relation=[], write_json=Fal
         raise ValueError("The length of weight relation is wrong")
 
 
-    start_pot_path, atom_radii = voro.perform_old_voronoi(inputcard, calc_path, weights)
+    start_pot_path, atom_radii = voro.perform_old_voronoi(inputcard, calc_path, weights, runner=runner)
     
-    ref_pot_path, atominfo_change= voro.perform_const(atom_radii, calc_path)
+    ref_pot_path, atominfo_change= voro.perform_const(atom_radii, calc_path, runner=runner)
     
     # set weight here as well .. idk probably not important anymore after voro .. but good for doc
     for idx, weight in enumerate(weights):
         atominfo_change[idx]['WEIGHT'] = weight
 
+    return {
+        'start_pot': start_pot_path.name,
+        'ref_pot': ref_pot_path.name,
+        'weights': weights,
+        'mt_radii': mt_radii,
+        'atom_radii': atom_radii,
+        'atominfo_change': atominfo_change
+    }
+
+
+def preprocess_scf_calc(inputcard, calc_path, weight_relation=[], write_json=False, warm_start=False, voro_cache=None, pot_store=None,
+                        runner=None):
+    # since the voronoi program can't handle empty sphere weights yet it has to be supplied how the empty sphere weights are to be handled
+    # weight relation is supposed to be a list of length num_vac
+    # e.g weight_relation = [0,0,1, -1] - specifies 3 empty spheres (in the order of atominfo - they have to be at the end) where the first 
+    # two empty spheres will get the same weight calculated for atom with index 0, the third with the weight
+    # of atom 2 and the fourth will default to 1.0
+    # if weight relation is not supplied all of them will default to 1.0
+    # with warm_start the converged potential of the closest point of the same sweep is used as start.pot (if there is one)
+    # if a VoronoiCache is supplied as voro_cache, the voronoi stage is only run for geometries not in the cache
+    # with a PotentialStore as pot_store the potential files are hardlinked to shared blobs instead of copied
+    # runner is the ToolRunner of the voronoi tools (tool_runner.py), many calls may run concurrently in threads sharing it
+
+    scf_path = calc_path / 'scf-calc'
+    scf_path.mkdir(parents=True, exist_ok=True)
+    voro_path = calc_path / 'voro'
+
+    voro_meta = None
+    if voro_cache is not None:
+        key = geometry_key(inputcard, weight_relation)
+        voro_meta = voro_cache.get(key, voro_path)
+
+    if voro_meta is None:
+        voro_meta = run_voronoi_stage(inputcard, calc_path, weight_relation, runner)
+        if voro_cache is not None:
+            voro_cache.put(key, voro_path, voro_meta)
+
+    start_pot_path = voro_path / voro_meta['start_pot']
+    ref_pot_path = voro_path / voro_meta['ref_pot']
+    atominfo_change = voro_meta['atominfo_change']
+
     inputcard.change_parameter('atominfo', atominfo_change, 'c')
 
     inputcard.set_startpot(start_pot_path.name)
     inputcard.set_refpot(ref_pot_path.name)
     
-    # copy the start and refpot to the scf_path
-    shutil.copyfile(start_pot_path, scf_path / inputcard.get_startpot())
-    shutil.copyfile(ref_pot_path, scf_path / inputcard.get_refpot())
+    # copy (or link, with a potential store) the start and refpot to the scf_path
+    if pot_store is not None:
+        for pot_path in voro_path.glob('*.pot'):
+            pot_store.absorb(pot_path)
+
+    neighbour = None
+    if warm_start:
+        # numpy is only needed for the warm start
+        from warm_start import warm_start_potential
+
+        (scf_path / inputcard.get_startpot()).unlink(missing_ok=True)
+        neighbour = warm_start_potential(calc_path, inputcard, start_pot_path, scf_path / inputcard.get_startpot())
+    if neighbour is None:
+        place_potential(start_pot_path, scf_path / inputcard.get_startpot(), pot_store)
+    else:
+        print(f"warm start from the converged potential of {neighbour}", file=sys.stderr)
+    place_potential(ref_pot_path, scf_path / inputcard.get_refpot(), pot_store)
 
     inputcard.write_to(scf_path / 'inputcard.scf')
     
     if write_json == True:
-        inputcard.write_to_json(scf_path / inputcard.json)
+        inputcard.write_to_json(scf_path / 'inputcard.json')
     
     return scf_path
     
 
 
-def main():
+def main(argv=None):
 
     parser = argparse.ArgumentParser("Preprocessing of a single point calculation using the Giessen-KKR code")
 
@@ -82,8 +138,16 @@ def main():
                         help='flag to determine whether a json representation of the inputcard should be stored in the calculation dir or not (default is false)')
     parser.add_argument('--kkr_output_name', dest='kkr_out_file', default='kkr.out',
                         help='name of the files created by the kkr code. Default is <kkr.out>')    
+    parser.add_argument('--warm_start', dest='warm_start', action='store_true',
+                        help='flag to start from the converged potential of the closest already converged point of the same sweep (default is the start.pot of old_voronoi)')
+    parser.add_argument('--voro_cache', dest='voro_cache', nargs='?', const=DEFAULT_CACHE_DIR, default=None,
+                        help=f'reuse the voronoi results of identical geometries from this cache directory (default if given without path: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--voro_cache_size', dest='voro_cache_size', type=float, default=512,
+                        help='maximal size of the voronoi cache in MB, least recently used entries are removed beyond it')
+    parser.add_argument('--pot_store', dest='pot_store', default=None,
+                        help='directory of a potential store (same file system as path), potential files are hardlinked from there instead of copied')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     global kkr_file
     kkr_file = args.kkr_out_file
@@ -91,8 +155,16 @@ def main():
     inputcard = Inputcard()
     inputcard.read_in_json(args.json_inp_path)
 
+    voro_cache = None
+    if args.voro_cache is not None:
+        voro_cache = VoronoiCache(args.voro_cache, int(args.voro_cache_size * 1024**2))
+
+    pot_store = None
+    if args.pot_store is not None:
+        pot_store = PotentialStore(args.pot_store)
+
     calc_path = pl.Path(args.path)
-    scf_path = preprocess_scf_calc(inputcard, calc_path, args.weight_rel, args.write_json)
+    scf_path = preprocess_scf_calc(inputcard, calc_path, args.weight_rel, args.write_json, args.warm_start, voro_cache, pot_store)
 
     print(scf_path, file=sys.stdout)
 
@@ -0,0 +1,158 @@
+import pathlib as pl
+import argparse
+import math
+import subprocess
+import sys
+import time
+
+from inputcard_converter import Inputcard
+from scf_monitor import KKROutputFollower, fit_convergence_rate, projected_iterations
+
+_KKR_OUT_NAME = 'kkr.out'
+_INPUTCARD_NAME = 'inputcard.scf'
+_JSON_NAME = 'inputcard.json'
+_BROYDEN_NAME = 'broy'
+
+# the rms-error stays on a plateau for the first ~20 iterations even for runs that converge fine,
+# so no decision is taken before MIN_ITERATIONS and the rate is fitted on the last RATE_WINDOW iterations
+MIN_ITERATIONS = 50
+RATE_WINDOW = 20
+
+# factors applied to the mixing parameters on every restart
+MIXING_ADJUSTMENT = {'STRMIX': 0.5, 'BRYMIX': 0.5, 'ITDBRY': 0.5}
+_MIN_ITDBRY = 10
+
+
+def abort_reason(iterations, bound, nsteps, min_iterations=MIN_ITERATIONS, window=RATE_WINDOW):
+    """
+    returns why the calculation will not reach bound within nsteps iterations or None if it still can
+    """
+    if len(iterations) < min_iterations or iterations[-1].rms_error is None:
+        return None
+
+    if iterations[-1].rms_error < bound:
+        return None
+
+    rate = fit_convergence_rate(iterations, window)
+    if rate is None:
+        return None
+    if rate >= 0:
+        return f"rms-error does not decrease ({rate:+.3f} decades/iteration over the last {window} iterations)"
+
+    remaining = nsteps - iterations[-1].iteration
+    needed = projected_iterations(iterations, bound, window)
+    if needed > remaining:
+        return f"{math.ceil(needed)} more iterations needed to reach {bound}, only {remaining} left"
+
+    return None
+
+
+def adjust_mixing(inputcard, adjustment=MIXING_ADJUSTMENT):
+    # damp the mixing for the next attempt
+    scf_cyc = inputcard.get_parameter('scf-cycle')
+    new_para = {}
+    for key, factor in adjustment.items():
+        new_para[key] = scf_cyc[key] * factor
+    if 'ITDBRY' in new_para:
+        new_para['ITDBRY'] = max(int(new_para['ITDBRY']), _MIN_ITDBRY)
+
+    inputcard.change_parameter('scf-cycle', new_para)
+    return new_para
+
+
+def run_supervised(kkr_cmd, inputcard, scf_path, kkr_out_file=_KKR_OUT_NAME, max_restarts=2, interval=60,
+                   min_iterations=MIN_ITERATIONS, window=RATE_WINDOW):
+    """
+    runs kkr_cmd (list) in scf_path and watches the rms-error in kkr_out_file, a run that can't reach QBOUND in its
+    remaining NSTEPS is killed and started again from start.pot with damped mixing (at most max_restarts times)
+    --> returns the exit code of the last run
+    """
+    kkr_out_path = scf_path / kkr_out_file
+
+    for attempt in range(max_restarts + 1):
+        scf_cyc = inputcard.get_parameter('scf-cycle')
+        bound = scf_cyc['QBOUND']
+        nsteps = int(scf_cyc['NSTEPS'])
+
+        follower = KKROutputFollower(kkr_out_path)
+        start = time.time()
+        with open(kkr_out_path, 'w') as out_file:
+            process = subprocess.Popen(kkr_cmd, cwd=scf_path, stdout=out_file, stderr=subprocess.STDOUT)
+
+        reason = None
+        while process.poll() is None:
+            time.sleep(interval)
+            if not follower.poll():
+                continue
+
+            reason = abort_reason(follower.iterations, bound, nsteps, min_iterations, window)
+            if reason is not None:
+                process.terminate()
+                try:
+                    process.wait(timeout=60)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                break
+
+        if reason is None:
+            return process.returncode
+
+        print(f"attempt {attempt + 1} aborted after {follower.iterations[-1].iteration} iterations "
+              f"({(time.time() - start) / 3600:.1f} h): {reason}", file=sys.stderr)
+
+        if attempt == max_restarts:
+            # the last output stays in place, so the postprocessing marks the point as NOT_CONVERGED
+            break
+
+        # keep the output of the aborted run, the broyden history belongs to the old mixing and has to go
+        kkr_out_path.rename(scf_path / f'{kkr_out_file}.abort_{attempt + 1}')
+        (scf_path / _BROYDEN_NAME).unlink(missing_ok=True)
+
+        new_para = adjust_mixing(inputcard)
+        print(f"restarting with {new_para}", file=sys.stderr)
+        inputcard.write_to(scf_path / _INPUTCARD_NAME)
+        inputcard.write_to_json(scf_path / _JSON_NAME)
+
+    return 1
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Supervised scf calculation of the Giessen-KKR code, aborting and restarting runs that won't converge")
+
+    parser.add_argument('-p', '--path', dest='path',
+                        help='path of the scf-calc directory (as printed by scf_pre_old.py)')
+    parser.add_argument('-i', '--json_input_path', dest='json_inp_path', default=None,
+                        help='json representation of the preprocessed inputcard. Default is <path>/inputcard.json (scf_pre_old.py --write_json_inputcard)')
+    parser.add_argument('--kkr_output_name', dest='kkr_out_file', default=_KKR_OUT_NAME,
+                        help='name of the files created by the kkr code. Default is <kkr.out>')
+    parser.add_argument('--max_restarts', dest='max_restarts', type=int, default=2,
+                        help='how often a run is restarted with damped mixing before giving up')
+    parser.add_argument('--interval', dest='interval', type=float, default=60,
+                        help='seconds between two checks of the kkr output')
+    parser.add_argument('--min_iterations', dest='min_iterations', type=int, default=MIN_ITERATIONS,
+                        help='number of iterations before a run may be aborted')
+    parser.add_argument('--window', dest='window', type=int, default=RATE_WINDOW,
+                        help='number of iterations used to fit the convergence rate')
+    parser.add_argument('kkr_cmd', nargs=argparse.REMAINDER,
+                        help='command running the kkr code, e.g. -- srun kkr.x inputcard.scf')
+
+    args = parser.parse_args()
+
+    kkr_cmd = args.kkr_cmd
+    if kkr_cmd and kkr_cmd[0] == '--':
+        kkr_cmd = kkr_cmd[1:]
+
+    scf_path = pl.Path(args.path)
+    json_inp_path = pl.Path(args.json_inp_path) if args.json_inp_path else scf_path / _JSON_NAME
+
+    inputcard = Inputcard()
+    inputcard.read_in_json(json_inp_path)
+
+    sys.exit(run_supervised(kkr_cmd, inputcard, scf_path, args.kkr_out_file, args.max_restarts, args.interval,
+                            args.min_iterations, args.window))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+import pathlib as pl
+import argparse
+import fcntl
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# commands of the worker and the scripts they run (their main(argv))
+TASK_MODULES = {'pre': 'scf_pre_old', 'post': 'scf_post_old'}
+# imported when the worker starts, so no request pays for them
+_WARM_MODULES = ['scf_pre_old', 'scf_post_old', 'warm_start']
+
+# node local socket, one per SLURM job - the worker runs in the cgroup (cpus) of the job that spawned it and ends with it
+# --> meant for one job handling many task directories (batch), array tasks have a job id each and run the scripts directly
+_JOB_SUFFIX = f"_{os.environ['SLURM_JOB_ID']}" if 'SLURM_JOB_ID' in os.environ else ''
+DEFAULT_SOCKET = pl.Path(os.environ.get('KKR_WORKER_SOCKET', f'/tmp/kkr_worker_{os.getuid()}{_JOB_SUFFIX}.sock'))
+# the settings of the scripts (KKR_DEFAULT_PARAMETERS, KKR_VORO_CACHE, KKR_RESULTS_DB, KKR_TOOL_*, ...) are read once per
+# process, a worker only runs requests of clients with the same ones
+_ENV_PREFIX = 'KKR_'
+_SPAWN_TIMEOUT = 60
+
+
+class _ThreadOutput:
+    """
+    replacement for sys.stdout/sys.stderr, writes go into a buffer of the current thread while it handles a request
+    (so the scripts can print as usual) and to the original stream otherwise
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.buffer = io.StringIO()
+        return self._local.buffer
+
+    def release(self):
+        self._local.buffer = None
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        return (buffer if buffer is not None else self._stream).write(text)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _settings():
+    return {name: value for name, value in os.environ.items() if name.startswith(_ENV_PREFIX)}
+
+
+def run_task(cmd, argv):
+    """
+    runs main(argv) of the script belonging to cmd, returns exit code, stdout and stderr
+    --> in the worker stdout and stderr are captured per thread, otherwise they are printed and returned empty
+    """
+    stdout, stderr = sys.stdout, sys.stderr
+    captured = isinstance(stdout, _ThreadOutput)
+    out_buffer = stdout.capture() if captured else None
+    err_buffer = stderr.capture() if captured else None
+
+    exit_code = 0
+    try:
+        importlib.import_module(TASK_MODULES[cmd]).main(argv)
+    except SystemExit as exc:
+        # argparse errors and sys.exit of the scripts
+        if isinstance(exc.code, str):
+            print(exc.code, file=sys.stderr)
+            exit_code = 1
+        else:
+            exit_code = exc.code or 0
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+        exit_code = 1
+    finally:
+        if captured:
+            stdout.release()
+            stderr.release()
+
+    if not captured:
+        return exit_code, '', ''
+    return exit_code, out_buffer.getvalue(), err_buffer.getvalue()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    # one json request per connection: {"cwd": ..., "env": {KKR_* variables}, "tasks": [{"cmd": "pre", "argv": [...]}, ...]},
+    # or {"cmd": "ping" | "shutdown"}
+    def handle(self):
+        server = self.server
+        server.touch(+1)
+        try:
+            request = json.loads(self.rfile.readline())
+
+            if request.get('cmd') == 'ping':
+                reply = {'pid': os.getpid(), 'active': server.active - 1}
+            elif request.get('cmd') == 'shutdown':
+                reply = {'pid': os.getpid()}
+                threading.Thread(target=server.shutdown).start()
+            elif request['cwd'] != os.getcwd():
+                # relative paths in the arguments are relative to the client, the working directory can't change per thread
+                reply = {'error': f"worker runs in {os.getcwd()}, not in {request['cwd']}"}
+            elif request.get('env') != _settings():
+                differing = sorted(set(request.get('env', {}).items()) ^ set(_settings().items()))
+                reply = {'error': f"worker runs with other settings ({', '.join(sorted({name for name, _ in differing}))})"}
+            else:
+                # the tasks of one request (e.g. many task directories) run concurrently in the worker pool
+                futures = [server.pool.submit(run_task, task['cmd'], task['argv']) for task in request['tasks']]
+                reply = {'results': [dict(zip(['exit_code', 'stdout', 'stderr'], future.result())) for future in futures]}
+
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+        finally:
+            server.touch(-1)
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers, idle_timeout):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.idle_timeout = idle_timeout
+        self.active = 0
+        self.last_request = time.time()
+        self._lock = threading.Lock()
+        super().__init__(str(socket_path), _RequestHandler)
+
+    def touch(self, change):
+        with self._lock:
+            self.active += change
+            self.last_request = time.time()
+
+    def watch_idle(self):
+        # the worker ends itself once it had nothing to do for idle_timeout seconds
+        while True:
+            time.sleep(min(self.idle_timeout, 10))
+            with self._lock:
+                if self.active == 0 and time.time() - self.last_request > self.idle_timeout:
+                    break
+        self.shutdown()
+
+
+def _connect(socket_path, timeout=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def serve(socket_path=DEFAULT_SOCKET, workers=None, idle_timeout=600):
+    """
+    runs the worker on socket_path until it is shut down or idle for idle_timeout seconds
+    --> returns False without starting if another worker already serves socket_path
+    """
+    socket_path = pl.Path(socket_path)
+
+    # the lock is held as long as the worker runs, so concurrently spawned workers don't remove each others sockets
+    lock_file = open(socket_path.with_name(socket_path.name + '.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+
+    try:
+        sock = _connect(socket_path, timeout=5)
+        if sock is not None:
+            sock.close()
+            return False
+        # left over from a worker that was killed
+        socket_path.unlink(missing_ok=True)
+
+        for module in _WARM_MODULES:
+            importlib.import_module(module)
+        sys.stdout = _ThreadOutput(sys.stdout)
+        sys.stderr = _ThreadOutput(sys.stderr)
+
+        with WorkerServer(socket_path, workers or os.cpu_count(), idle_timeout) as server:
+            threading.Thread(target=server.watch_idle, daemon=True).start()
+            print(f"worker {os.getpid()} serving on {socket_path}", file=sys.stderr, flush=True)
+            server.serve_forever()
+            server.pool.shutdown()
+    finally:
+        socket_path.unlink(missing_ok=True)
+        lock_file.close()
+
+    return True
+
+
+def _request(socket_path, request, timeout=None):
+    # sends one request, returns the reply or None if there is no worker (or it died while handling the request)
+    sock = _connect(socket_path, timeout)
+    if sock is None:
+        return None
+
+    with sock, sock.makefile('rwb') as stream:
+        try:
+            stream.write((json.dumps(request) + '\n').encode())
+            stream.flush()
+            reply = stream.readline()
+        except OSError:
+            return None
+
+    return json.loads(reply) if reply else None
+
+
+def spawn_worker(socket_path=DEFAULT_SOCKET, idle_timeout=600):
+    # starts a detached worker and waits until it answers
+    log_path = socket_path.with_name(socket_path.name + '.log')
+    with open(log_path, 'a') as log_file:
+        subprocess.Popen([sys.executable, pl.Path(__file__).resolve(), 'serve', '-s', socket_path, '--idle_timeout', str(idle_timeout)],
+                         stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file, start_new_session=True)
+
+    start = time.time()
+    while time.time() - start < _SPAWN_TIMEOUT:
+        if _request(socket_path, {'cmd': 'ping'}, timeout=5) is not None:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def submit(tasks, socket_path=DEFAULT_SOCKET, spawn=False, idle_timeout=600):
+    """
+    runs the tasks [(cmd, argv), ...] in the worker on socket_path (started first with spawn)
+    --> without a worker (or one started in another directory or with other KKR_* variables) the tasks run in this process,
+        one after the other
+    --> returns a list of (exit code, stdout, stderr)
+    """
+    socket_path = pl.Path(socket_path)
+    request = {'cwd': os.getcwd(), 'env': _settings(), 'tasks': [{'cmd': cmd, 'argv': list(argv)} for cmd, argv in tasks]}
+
+    reply = _request(socket_path, request)
+    if reply is None and spawn and spawn_worker(socket_path, idle_timeout):
+        reply = _request(socket_path, request)
+
+    if reply is None or 'error' in reply:
+        reason = reply['error'] if reply else f"no worker on {socket_path}"
+        print(f"{reason}, running in this process", file=sys.stderr)
+        return [run_task(cmd, argv) for cmd, argv in tasks]
+
+    return [(result['exit_code'], result['stdout'], result['stderr']) for result in reply['results']]
+
+
+def _read_batch(batch_path):
+    # one task per line: <pre|post> <arguments of the script>
+    with open(batch_path, 'r') as f:
+        return [(line.split()[0], line.split()[1:]) for line in f if line.strip()]
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Node local worker running the pre- and postprocessing of many point calculations in one warm python process")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='run the worker')
+    serve_parser.add_argument('--workers', dest='workers', type=int, default=None,
+                              help='number of tasks handled at the same time. Default is the number of cpus')
+
+    for name, help_text in [('pre', 'run scf_pre_old.py with the arguments after --'), ('post', 'run scf_post_old.py with the arguments after --'),
+                       ('batch', 'run the tasks in <file> (one per line: pre|post <arguments>) concurrently'),
+                       ('ping', 'check if a worker is running'), ('shutdown', 'stop the worker')]:
+        sub_parser = subparsers.add_parser(name, help=help_text)
+        if name == 'batch':
+            sub_parser.add_argument('file', help='file with one task per line')
+        if name in ['pre', 'post', 'batch']:
+            sub_parser.add_argument('--spawn', dest='spawn', action='store_true',
+                                    help='start a worker if none is running (otherwise the task runs in this process)')
+        if name in ['pre', 'post']:
+            sub_parser.add_argument('argv', nargs=argparse.REMAINDER,
+                                    help='arguments of the script, e.g. -- -p <path> -i <json>')
+
+    for name, sub_parser in subparsers.choices.items():
+        sub_parser.add_argument('-s', '--socket', dest='socket', default=DEFAULT_SOCKET,
+                                help=f'socket of the worker. Default is {DEFAULT_SOCKET} (or KKR_WORKER_SOCKET)')
+        if name not in ['ping', 'shutdown']:
+            sub_parser.add_argument('--idle_timeout', dest='idle_timeout', type=float, default=600,
+                                    help='seconds without requests after which a (spawned) worker stops')
+
+    args = parser.parse_args()
+    socket_path = pl.Path(args.socket)
+
+    if args.mode == 'serve':
+        if not serve(socket_path, args.workers, args.idle_timeout):
+            print(f"a worker is already running on {socket_path}", file=sys.stderr)
+
+    elif args.mode in ['ping', 'shutdown']:
+        reply = _request(socket_path, {'cmd': args.mode}, timeout=10)
+        if reply is None:
+            print(f"no worker on {socket_path}", file=sys.stderr)
+            sys.exit(1)
+        print(reply, file=sys.stdout)
+
+    else:
+        if args.mode == 'batch':
+            tasks = _read_batch(args.file)
+        else:
+            argv = args.argv[1:] if args.argv and args.argv[0] == '--' else args.argv
+            tasks = [(args.mode, argv)]
+
+        exit_code = 0
+        for code, stdout, stderr in submit(tasks, socket_path, args.spawn, args.idle_timeout):
+            sys.stdout.write(stdout)
+            sys.stderr.write(stderr)
+            exit_code = max(exit_code, code)
+        sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
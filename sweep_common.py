@@ -0,0 +1,16 @@
+import threading
+
+# helpers shared by the workflow scheduler and the analysis scripts, without importing either
+
+# pyplot keeps global state: everything plotting while other threads may plot too (relaxations running in threads,
+# the fit and check stages of the workflow) holds this lock - reentrant, as the stages call functions taking it themselves
+PLOT_LOCK = threading.RLock()
+
+
+def file_signature(file_path):
+    # size and mtime of a file, None if it doesn't exist
+    try:
+        file_stat = file_path.stat()
+    except FileNotFoundError:
+        return None
+    return [file_stat.st_size, file_stat.st_mtime_ns]
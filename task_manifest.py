@@ -0,0 +1,97 @@
+import pathlib as pl
+import argparse
+import os
+import sys
+
+# written next to the point calculations of a sweep, maps the array task id to the task directory
+MANIFEST_NAME = 'tasks.manifest'
+
+_MAGIC = 'kkr-task-manifest'
+_MIN_RECORD_SIZE = 48
+
+
+def write_manifest(path, task_paths, manifest_path=None):
+    """
+    writes the task directories (relative to path) into <path>/tasks.manifest and returns its path
+    --> fixed size records padded with spaces, record 0 is the header '<magic> <record size> <number of tasks>'
+    --> task n is record n + 1, so a job script finds it with one seek (dd bs=<record size> skip=<n + 1> count=1)
+    """
+    path = pl.Path(path)
+    manifest_path = pl.Path(manifest_path) if manifest_path else path / MANIFEST_NAME
+
+    records = [str(pl.Path(task_path).relative_to(path)).encode() for task_path in task_paths]
+    record_size = max([len(record) + 1 for record in records] + [_MIN_RECORD_SIZE])
+    header = f'{_MAGIC} {record_size} {len(records)}'.encode()
+
+    # written next to the manifest and renamed, running array tasks never read a half written manifest
+    tmp_path = manifest_path.with_name(f'.{manifest_path.name}.{os.getpid()}')
+    with open(tmp_path, 'wb') as f:
+        for record in [header] + records:
+            f.write(record.ljust(record_size - 1) + b'\n')
+    os.replace(tmp_path, manifest_path)
+
+    return manifest_path
+
+
+def _read_header(f):
+    header = f.readline().split()
+    if len(header) != 3 or header[0].decode() != _MAGIC:
+        raise ValueError(f"{f.name} is not a task manifest")
+    return int(header[1]), int(header[2])
+
+
+def read_task(manifest_path, task_id):
+    # task directory of array task task_id, without reading the other records
+    manifest_path = pl.Path(manifest_path)
+    with open(manifest_path, 'rb') as f:
+        record_size, num_tasks = _read_header(f)
+        if not 0 <= task_id < num_tasks:
+            raise IndexError(f"task {task_id} is not in {manifest_path} ({num_tasks} tasks)")
+        f.seek((task_id + 1) * record_size)
+        return manifest_path.parent / f.read(record_size).decode().rstrip()
+
+
+def read_manifest(manifest_path):
+    # all task directories, in the order of the task ids
+    manifest_path = pl.Path(manifest_path)
+    with open(manifest_path, 'rb') as f:
+        record_size, num_tasks = _read_header(f)
+        f.seek(record_size)
+        data = f.read(num_tasks * record_size)
+
+    return [manifest_path.parent / data[idx:idx + record_size].decode().rstrip() for idx in range(0, len(data), record_size)]
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Task manifest mapping the array task ids of a sweep to the task directories")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    write_parser = subparsers.add_parser('write', help='write the manifest of an existing sweep <path>/<group>/<task> (sorted)')
+    lookup_parser = subparsers.add_parser('lookup', help='print the task directory of a task id')
+    list_parser = subparsers.add_parser('list', help='print all task directories with their task id')
+
+    for sub_parser in [write_parser, lookup_parser, list_parser]:
+        sub_parser.add_argument('-p', '--path', dest='path',
+                                help='path of the sweep, the manifest is <path>/tasks.manifest')
+    lookup_parser.add_argument('-t', '--task_id', dest='task_id', type=int,
+                               help='task id (SLURM_ARRAY_TASK_ID)')
+
+    args = parser.parse_args()
+    path = pl.Path(args.path)
+
+    if args.mode == 'write':
+        groups = sorted(group for group in path.iterdir() if group.is_dir())
+        task_paths = [task for group in groups for task in sorted(task for task in group.iterdir() if task.is_dir())]
+        print(write_manifest(path, task_paths), f"{len(task_paths)} tasks", file=sys.stdout)
+
+    elif args.mode == 'lookup':
+        print(read_task(path / MANIFEST_NAME, args.task_id), file=sys.stdout)
+
+    elif args.mode == 'list':
+        for task_id, task_path in enumerate(read_manifest(path / MANIFEST_NAME)):
+            print(task_id, task_path, file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import pathlib as pl
+import argparse
+import asyncio
+import os
+import shlex
+import signal
+import sys
+import threading
+import time
+from collections import namedtuple
+
+ToolResult = namedtuple('ToolResult', ['tool', 'cmd', 'cwd', 'exit_code', 'stdout', 'stderr', 'timed_out', 'success', 'duration'])
+
+
+def _voronoi_finished(exit_code, stdout, cwd):
+    # voronoi doesn't set its exit code, it prints this line as the last step
+    return 'Voronoi utility finished.' in [line.strip() for line in stdout.splitlines()]
+
+
+def _wrote(file_name):
+    def success(exit_code, stdout, cwd):
+        return exit_code == 0 and (pl.Path(cwd) / file_name).exists()
+    return success
+
+
+def _exit_code_zero(exit_code, stdout, cwd):
+    return exit_code == 0
+
+
+# the external tools of the toolchain: environment variable overriding the command and how success is detected
+TOOLS = {
+    'voronoi': ('KKR_VORONOI', 'voronoi', _voronoi_finished),
+    'old_voronoi': ('KKR_OLD_VORONOI', 'old_voronoi', _wrote('output.pot')),
+    'Const': ('KKR_CONST', 'Const', _wrote('Constant.pot')),
+    'kkr': ('KKR_CODE', 'kkr.x', _exit_code_zero),
+}
+
+
+class ToolRunner:
+    """
+    runs the external tools (voronoi, old_voronoi, Const and the kkr code) as asyncio subprocesses
+    --> at most max_concurrent tools at a time (semaphore), each killed (with its children) after timeout seconds
+    --> executables {tool: command} overrides the commands (string, split like a shell, or list), default are the
+        environment variables of TOOLS and then the plain tool names - e.g. stub executables for testing
+    --> all calls run in one event loop in a background thread, so threads (run_sync) and coroutines of other loops (run)
+        share the semaphore - run_sync must not be called from a coroutine of that loop
+    """
+
+    def __init__(self, max_concurrent=None, timeout=None, executables={}):
+        self.max_concurrent = max_concurrent or os.cpu_count()
+        self.timeout = timeout
+        self.executables = {}
+        for tool, (env_name, default, _) in TOOLS.items():
+            cmd = executables.get(tool) or os.environ.get(env_name) or default
+            self.executables[tool] = shlex.split(cmd) if isinstance(cmd, str) else [str(arg) for arg in cmd]
+
+        self._loop = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+
+    def _runner_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='tool-runner', daemon=True).start()
+                # created in the loop it is used in
+                self._semaphore = asyncio.run_coroutine_threadsafe(self._make_semaphore(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrent)
+
+    async def _run(self, tool, args, cwd, timeout, stdout_path, env):
+        cmd = self.executables[tool] + [str(arg) for arg in args]
+        stdout_file = open(stdout_path, 'w') if stdout_path else None
+        try:
+            async with self._semaphore:
+                start = time.time()
+                try:
+                    # own session, a timeout kills the whole process group (e.g. mpirun and its ranks)
+                    process = await asyncio.create_subprocess_exec(*cmd, cwd=cwd, env=env, start_new_session=True,
+                                                                   stdout=stdout_file or asyncio.subprocess.PIPE,
+                                                                   stderr=asyncio.subprocess.PIPE)
+                except FileNotFoundError as error:
+                    return ToolResult(tool, cmd, cwd, 127, '', str(error), False, False, 0.0)
+
+                timed_out = False
+                try:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    stdout, stderr = await process.communicate()
+                duration = time.time() - start
+        finally:
+            if stdout_file is not None:
+                stdout_file.close()
+
+        stdout = stdout.decode(errors='replace') if stdout is not None else ''
+        stderr = stderr.decode(errors='replace')
+        success = not timed_out and TOOLS[tool][2](process.returncode, stdout, cwd)
+        return ToolResult(tool, cmd, cwd, process.returncode, stdout, stderr, timed_out, success, duration)
+
+    def _submit(self, tool, args, cwd, timeout, stdout_path, env):
+        return asyncio.run_coroutine_threadsafe(self._run(tool, args, str(cwd), timeout or self.timeout, stdout_path, env),
+                                                self._runner_loop())
+
+    async def run(self, tool, args=[], cwd='.', timeout=None, stdout_path=None, env=None):
+        """
+        runs tool with args in cwd and returns its ToolResult
+        --> stdout_path writes the standard output into this file instead of capturing it (e.g. kkr.out)
+        """
+        return await asyncio.wrap_future(self._submit(tool, args, cwd, timeout, stdout_path, env))
+
+    def run_sync(self, tool, args=[], cwd='.', timeout=None, stdout_path=None, env=None):
+        # run for callers without event loop, e.g. the preprocessing in a thread pool
+        return self._submit(tool, args, cwd, timeout, stdout_path, env).result()
+
+
+_DEFAULT_RUNNER = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_runner():
+    # runner of the process, configured by the environment (KKR_TOOL_CONCURRENCY, KKR_TOOL_TIMEOUT and the variables of TOOLS)
+    global _DEFAULT_RUNNER
+    with _DEFAULT_LOCK:
+        if _DEFAULT_RUNNER is None:
+            timeout = os.environ.get('KKR_TOOL_TIMEOUT')
+            _DEFAULT_RUNNER = ToolRunner(int(os.environ.get('KKR_TOOL_CONCURRENCY', 0)) or None, float(timeout) if timeout else None)
+    return _DEFAULT_RUNNER
+
+
+async def preprocess_sweep(task_paths, weight_relation=[], runner=None, run_kkr=False, kkr_out_file='kkr.out'):
+    """
+    preprocesses the point calculations task_paths (<task>/inputcard.json) of a sweep concurrently in this process
+    --> the tools of all points share the concurrency limit of runner, the python parts run in threads
+    --> with run_kkr the kkr code is started in every preprocessed scf-calc directory
+    --> returns {task_path: exception or ToolResult of the kkr code (None without run_kkr)}
+    """
+    from inputcard_converter import Inputcard
+    from scf_pre_old import preprocess_scf_calc
+
+    runner = runner or default_runner()
+
+    async def process(task_path):
+        inputcard = Inputcard()
+        inputcard.read_in_json(task_path / 'inputcard.json')
+        scf_path = await asyncio.to_thread(preprocess_scf_calc, inputcard, task_path, weight_relation, True, runner=runner)
+        if not run_kkr:
+            return None
+        return await runner.run('kkr', ['inputcard.scf'], cwd=scf_path, stdout_path=scf_path / kkr_out_file)
+
+    results = await asyncio.gather(*(process(task_path) for task_path in task_paths), return_exceptions=True)
+    return dict(zip(task_paths, results))
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Preprocess (and run) the point calculations of a sweep concurrently in one process")
+
+    parser.add_argument('-p', '--path', dest='path',
+                        help='path of the sweep <path>/<group>/<task> (in the order of its task manifest if written)')
+    parser.add_argument('-w', '--weight_relation', dest='weight_rel', nargs='*', default=[],
+                        help='The indices of the atoms, from which the empty spheres should take the weights (see scf_pre_old.py)')
+    parser.add_argument('--max_concurrent', dest='max_concurrent', type=int, default=None,
+                        help='number of tools running at the same time. Default is one per cpu')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=None,
+                        help='seconds after which a tool is killed. Default is no limit')
+    parser.add_argument('--run_kkr', dest='run_kkr', action='store_true',
+                        help='also run the kkr code in every preprocessed point')
+    for tool, (env_name, default, _) in TOOLS.items():
+        parser.add_argument(f'--{tool.lower()}_cmd', dest=f'{tool}_cmd', default=None,
+                            help=f'command of {tool}. Default is ${env_name} or {default}')
+
+    args = parser.parse_args()
+
+    from executor import sweep_tasks
+
+    runner = ToolRunner(args.max_concurrent, args.timeout, {tool: getattr(args, f'{tool}_cmd') for tool in TOOLS if getattr(args, f'{tool}_cmd')})
+    task_paths = sweep_tasks(pl.Path(args.path))
+    results = asyncio.run(preprocess_sweep(task_paths, args.weight_rel, runner, args.run_kkr))
+
+    failed = 0
+    for task_path, result in results.items():
+        if isinstance(result, Exception):
+            state = f'failed: {result}'
+        elif result is not None and not result.success:
+            state = f'kkr failed (exit code {result.exit_code}{", timed out" if result.timed_out else ""})'
+        else:
+            state = 'done'
+        failed += state != 'done'
+        print(f"{task_path}: {state}", file=sys.stdout)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
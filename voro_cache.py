@@ -0,0 +1,158 @@
+import pathlib as pl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+_META_NAME = 'meta.json'
+
+# default location, can be changed with KKR_VORO_CACHE
+DEFAULT_CACHE_DIR = pl.Path(os.environ.get('KKR_VORO_CACHE', pl.Path.home() / '.cache' / 'kkr_workflows' / 'voronoi'))
+DEFAULT_MAX_SIZE = 512 * 1024**2
+
+# parts of the inputcard the voronoi, old_voronoi and Const results depend on
+# (LMXC/KFG select the jellium start potentials, NSPIN/LMAX the layout of start.pot)
+_GEOMETRY_KEYS = ['lattice', 'cluster', 'voro-opts', 'general']
+_ATOMINFO_KEYS = ['Z', 'LMXC', 'KFG']
+
+
+def _canonical(value):
+    # rounds floats, so 6.175 and 6.1750000000000001 give the same key
+    if isinstance(value, float):
+        return round(value, 10)
+    if isinstance(value, dict):
+        return {key: _canonical(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(val) for val in value]
+    return value
+
+
+def geometry_key(inputcard, weight_relation=[]):
+    """
+    sha256 of the geometry relevant inputcard parameters (lattice, atoms, cluster, voro-opts) and the weight relation
+    """
+    key_dict = {key: inputcard.get_parameter(key) for key in _GEOMETRY_KEYS}
+    key_dict['atominfo'] = [{key: atom[key] for key in _ATOMINFO_KEYS if key in atom} for atom in inputcard.get_parameter('atominfo')]
+    key_dict['weight-relation'] = [int(idx) for idx in weight_relation]
+
+    key_string = json.dumps(_canonical(key_dict), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(key_string.encode()).hexdigest()
+
+
+def _link_or_copy(src_path, dst_path):
+    # hardlink, a copy where the file system has none
+    try:
+        os.link(src_path, dst_path)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+
+
+class VoronoiCache:
+    """
+    content addressed store of voro/ directories - every entry holds the files of one voro/ directory and the weights
+    and radii as meta.json, the least recently used entries are removed once the cache grows beyond max_size bytes
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = pl.Path(cache_dir)
+        self.max_size = max_size
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key, voro_path):
+        """
+        copies the files of entry key into voro_path and returns its meta data, or None if the entry doesn't exist
+        --> the files are read from a private snapshot (hardlinks) of the entry, an entry evicted by another task in the
+            meantime is a miss
+        """
+        entry_path = self.cache_dir / key
+        if not (entry_path / _META_NAME).exists():
+            return None
+
+        snapshot_path = pl.Path(tempfile.mkdtemp(prefix=f'.{key}.', dir=self.cache_dir))
+        try:
+            try:
+                for file_path in entry_path.iterdir():
+                    _link_or_copy(file_path, snapshot_path / file_path.name)
+                with open(snapshot_path / _META_NAME, 'r') as f:
+                    meta = json.load(f)
+            except FileNotFoundError:
+                return None
+            if not all((snapshot_path / name).exists() for name in [meta['start_pot'], meta['ref_pot'], 'voro.out', 'voro_old.out']):
+                # evicted by another task while taking the snapshot
+                return None
+
+            if not self.valid(snapshot_path, meta):
+                # e.g. written by an older version or truncated, run the tools again
+                shutil.rmtree(entry_path, ignore_errors=True)
+                return None
+
+            voro_path.mkdir(parents=True, exist_ok=True)
+            for file_path in snapshot_path.iterdir():
+                if file_path.name != _META_NAME:
+                    # the old file might be a read only link into a potential store
+                    (voro_path / file_path.name).unlink(missing_ok=True)
+                    shutil.copyfile(file_path, voro_path / file_path.name)
+        finally:
+            shutil.rmtree(snapshot_path, ignore_errors=True)
+
+        # the mtime of the entry directory is the time of last use
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        return meta
+
+    def valid(self, entry_path, meta):
+        # the voronoi outputs of the entry are consistent and match the weights of its meta data
+        from voro_output import check_voro_path, read_voro_old_out
+
+        if check_voro_path(entry_path):
+            return False
+        if (entry_path / 'voro_old.out').exists():
+            return len(read_voro_old_out(entry_path / 'voro_old.out').rmt) == len(meta['weights'])
+        return True
+
+    def put(self, key, voro_path, meta):
+        entry_path = self.cache_dir / key
+        if entry_path.exists():
+            return
+
+        # write into a scratch dir and move it into place, so concurrent tasks never see half written entries
+        scratch_path = pl.Path(tempfile.mkdtemp(prefix=f'.{key}.', dir=self.cache_dir))
+        for file_path in voro_path.iterdir():
+            if file_path.is_file():
+                shutil.copyfile(file_path, scratch_path / file_path.name)
+        with open(scratch_path / _META_NAME, 'w') as f:
+            json.dump(meta, f)
+
+        try:
+            scratch_path.rename(entry_path)
+        except OSError:
+            # somebody else stored the same entry in the meantime
+            shutil.rmtree(scratch_path)
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry_path in self.cache_dir.iterdir():
+            if entry_path.name.startswith('.') or not entry_path.is_dir():
+                continue
+            try:
+                size = sum(file_path.stat().st_size for file_path in entry_path.iterdir())
+                entries.append((entry_path.stat().st_mtime, size, entry_path))
+            except FileNotFoundError:
+                # evicted by another task in the meantime
+                continue
+            total_size += size
+
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
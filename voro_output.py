@@ -0,0 +1,227 @@
+import re
+import pathlib as pl
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+# voro.out of the voronoi program (empty spheres removed, lengths in units of alat)
+# --> bravais (3, 3) are the true basis vectors in a.u., the atom table has one row per atom
+VoroOutput = namedtuple('VoroOutput', ['z', 'positions', 'weights', 'mt_radii', 'bravais', 'sum_volumes', 'ws_volume'])
+
+# voro_old.out of old_voronoi (all atoms, volumes in alat^3, radii in a.u.)
+# --> shapes is the index (from 0) of the shape of every atom into shape_volumes
+OldVoroOutput = namedtuple('OldVoroOutput', ['volumes', 'rmt', 'rmax', 'shapes', 'shape_volumes', 'total_volume', 'bravais_volume'])
+
+# one voronoi cell of GraphicalOutput.txt: the vertices (n, 3) of every face and the enclosed volume (units of alat)
+VoronoiCell = namedtuple('VoronoiCell', ['faces', 'volume'])
+
+_FLOAT = rb'[-+]?(?:\d+\.?\d*|\.\d+)(?:[EeDd][-+]?\d+)?'
+
+_TABLE_HEADER = re.compile(rb'^\s*Z\s+X\s+Y\s+Z\s+Weight\s+MT-radius\s*$', re.M)
+_TABLE_ROW = re.compile(rb'^\s*(' + _FLOAT + rb')\s+(' + _FLOAT + rb')\s+(' + _FLOAT + rb')\s+(' + _FLOAT + rb')\s+(' + _FLOAT + rb')\s+('
+                        + _FLOAT + rb')\s*$')
+_BRAVAIS = re.compile(rb'True basis vectors.*\n' + 3 * (rb'\s*(' + _FLOAT + rb')\s+(' + _FLOAT + rb')\s+(' + _FLOAT + rb')\s*\n'))
+_SUM_VOLUMES = re.compile(rb'Sum of Volumes:\s+(' + _FLOAT + rb')')
+_WS_VOLUME = re.compile(rb'Size of WS-cell:\s+(' + _FLOAT + rb')')
+
+_ATOM_RADII = re.compile(rb'^\s*Atom \.\.\s+(\d+) Volume\(alat\^3\)\s*:\s+(' + _FLOAT + rb')\s+RMT :\s+(' + _FLOAT + rb')\s+RMAX :\s+('
+                         + _FLOAT + rb')', re.M)
+_SHAPE_VOLUME = re.compile(rb'The Volume is :\s+(' + _FLOAT + rb')')
+_ATOM_SHAPE = re.compile(rb'Shape\.\.\.\s+(\d+) has cluster\.\.\s+\d+ extra shift\.\..*for atom\.\.\s+(\d+)')
+_TOTAL_VOLUME = re.compile(rb'Total volume \(alat\^3\)\s+\.+\s+(' + _FLOAT + rb')')
+_BRAVAIS_VOLUME = re.compile(rb'Bravais cross prod\.\(alat\^3\):\s+(' + _FLOAT + rb')')
+
+_GRAPHICAL_NAME = 'GraphicalOutput.txt'
+_POLYGON = re.compile(rb'Polygon\[\{(.*?)\}\]')
+
+# relative deviations tolerated by check_geometry - GraphicalOutput.txt only has 4 decimals
+_VOLUME_RTOL = 1e-6
+_CELL_RTOL = 5e-3
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _floats(text):
+    return np.array(re.findall(_FLOAT, text), dtype=float) if text else np.empty(0)
+
+
+def _search(pattern, data, path):
+    match = pattern.search(data)
+    if match is None:
+        raise ValueError(f"{path}: '{pattern.pattern.decode()}' not found")
+    return match
+
+
+def read_voro_out(path):
+    """
+    reads the atom table (the last one, after the weights are determined) and the cell volumes of voro.out
+    """
+    data = _read(path)
+
+    headers = list(_TABLE_HEADER.finditer(data))
+    if not headers:
+        raise ValueError(f"{path}: no atom table (Z X Y Z Weight MT-radius) found")
+
+    rows = []
+    for line in data[headers[-1].end():].lstrip(b'\r\n').splitlines():
+        row = _TABLE_ROW.match(line)
+        if row is None:
+            break
+        rows.append(row.groups())
+    if not rows:
+        raise ValueError(f"{path}: the atom table is empty")
+    table = np.array(rows, dtype=float)
+
+    bravais = _BRAVAIS.search(data)
+    return VoroOutput(
+        z           = table[:, 0].astype(int),
+        positions   = table[:, 1:4],
+        weights     = table[:, 4],
+        mt_radii    = table[:, 5],
+        bravais     = np.array(bravais.groups(), dtype=float).reshape(3, 3) if bravais else None,
+        sum_volumes = float(_search(_SUM_VOLUMES, data, path).group(1)),
+        ws_volume   = float(_search(_WS_VOLUME, data, path).group(1))
+    )
+
+
+def read_voro_old_out(path):
+    """
+    reads the volume and radii of every atom, the shapes and the total volumes of voro_old.out
+    """
+    data = _read(path)
+
+    atoms = _ATOM_RADII.findall(data)
+    if not atoms:
+        raise ValueError(f"{path}: no 'Atom .. Volume(alat^3) RMT RMAX' lines found")
+    table = np.array(atoms, dtype=float)
+
+    # the shape of every atom is printed twice (while and after analyzing the lattice), the last one counts
+    shapes = np.zeros(len(atoms), dtype=int)
+    for shape, atom in _ATOM_SHAPE.findall(data):
+        shapes[int(atom) - 1] = int(shape) - 1
+
+    return OldVoroOutput(
+        volumes        = table[:, 1],
+        rmt            = table[:, 2],
+        rmax           = table[:, 3],
+        shapes         = shapes,
+        shape_volumes  = np.array(_SHAPE_VOLUME.findall(data), dtype=float),
+        total_volume   = float(_search(_TOTAL_VOLUME, data, path).group(1)),
+        bravais_volume = float(_search(_BRAVAIS_VOLUME, data, path).group(1))
+    )
+
+
+def cell_volume(faces):
+    # volume of a convex polyhedron, every face fanned into triangles around its first vertex and each triangle forming
+    # a tetrahedron with the centre of the vertices (the faces aren't oriented consistently)
+    centre = np.concatenate(faces).mean(axis=0)
+    volume = 0.0
+    for face in faces:
+        face = face - centre
+        volume += np.abs(np.cross(face[1:-1], face[2:]) @ face[0]).sum()
+    return volume / 6
+
+
+def read_graphical_output(path):
+    """
+    reads the voronoi cells of GraphicalOutput.txt (one Graphics3D line per atom of voro.out, centred at the atom) as VoronoiCell
+    --> voronoi appends to the file, directories written before the tools ran in scratch directories hold several runs -
+        the last cells are the ones of voro.out
+    """
+    cells = []
+    for line in _read(path).splitlines():
+        if not line.strip():
+            continue
+        faces = [_floats(polygon).reshape(-1, 3) for polygon in _POLYGON.findall(line)]
+        if not faces:
+            raise ValueError(f"{path}: line without polygons")
+        cells.append(VoronoiCell(faces, cell_volume(faces)))
+    return cells
+
+
+def check_geometry(voro=None, voro_old=None, cells=None, num_atoms=None):
+    """
+    consistency checks of the voronoi results (any of them can be None), returns the list of problems found
+    --> voro: num_atoms rows, positive weights and radii, the volumes of the cells add up to the unit cell
+    --> voro_old: num_atoms rows, RMT <= RMAX, the atom volumes add up to the unit cell
+    --> cells: the last cell per atom of voro, their volumes add up to the unit cell of voro
+    """
+    problems = []
+
+    if voro is not None:
+        if num_atoms is not None and len(voro.weights) != num_atoms:
+            problems.append(f"voro.out has {len(voro.weights)} atoms instead of {num_atoms}")
+        if np.any(voro.weights <= 0) or np.any(voro.mt_radii <= 0):
+            problems.append("voro.out has weights or MT radii <= 0")
+        if not np.isclose(voro.sum_volumes, voro.ws_volume, rtol=_VOLUME_RTOL):
+            problems.append(f"voro.out: sum of volumes {voro.sum_volumes} differs from the WS cell {voro.ws_volume}")
+
+    if voro_old is not None:
+        if num_atoms is not None and len(voro_old.rmt) != num_atoms:
+            problems.append(f"voro_old.out has {len(voro_old.rmt)} atoms instead of {num_atoms}")
+        if np.any(voro_old.rmt <= 0) or np.any(voro_old.rmt > voro_old.rmax):
+            problems.append("voro_old.out has RMT <= 0 or RMT > RMAX")
+        # printed with 8 decimals
+        if not np.isclose(voro_old.volumes.sum(), voro_old.bravais_volume, rtol=0, atol=len(voro_old.volumes) * 1e-8):
+            problems.append(f"voro_old.out: sum of volumes {voro_old.volumes.sum()} differs from the unit cell {voro_old.bravais_volume}")
+
+    if cells is not None:
+        num_cells = len(voro.weights) if voro is not None else len(cells)
+        volume = sum(cell.volume for cell in cells[-num_cells:])
+        if len(cells) < num_cells:
+            problems.append(f"GraphicalOutput.txt has {len(cells)} cells for {num_cells} atoms")
+        elif voro is not None and not np.isclose(volume, voro.ws_volume, rtol=_CELL_RTOL):
+            problems.append(f"GraphicalOutput.txt: sum of cell volumes {volume} differs from the WS cell {voro.ws_volume}")
+
+    return problems
+
+
+def check_voro_path(voro_path):
+    # parses and checks whatever outputs exist in a voro/ directory, returns the list of problems found
+    voro_path = pl.Path(voro_path)
+    outputs = {}
+    problems = []
+    for name, key, reader in [('voro.out', 'voro', read_voro_out), ('voro_old.out', 'voro_old', read_voro_old_out),
+                              (_GRAPHICAL_NAME, 'cells', read_graphical_output)]:
+        if not (voro_path / name).exists():
+            continue
+        try:
+            outputs[key] = reader(voro_path / name)
+        except ValueError as error:
+            problems.append(str(error))
+
+    return problems + check_geometry(**outputs)
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Check the voronoi outputs (voro.out, voro_old.out, GraphicalOutput.txt) of voro/ directories")
+
+    parser.add_argument('-p', '--path', dest='paths', nargs='+', required=True,
+                        help='voro/ directories, or directories searched for them')
+
+    args = parser.parse_args()
+
+    voro_paths = []
+    for path in args.paths:
+        path = pl.Path(path)
+        voro_paths += [path] if path.name == 'voro' else sorted(voro_path for voro_path in path.rglob('voro') if voro_path.is_dir())
+
+    failed = 0
+    for voro_path in voro_paths:
+        problems = check_voro_path(voro_path)
+        failed += bool(problems)
+        for problem in problems:
+            print(f"{voro_path}: {problem}", file=sys.stdout)
+
+    print(f"{len(voro_paths) - failed}/{len(voro_paths)} voro directories OK", file=sys.stdout)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
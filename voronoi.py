@@ -1,17 +1,43 @@
-import subprocess
-from subprocess import run
 import pathlib as pl
-import numpy as np
-from copy import deepcopy
+import os
+import shutil
+import tempfile
 from inputcard_converter import Inputcard
 
 _REFOPT_NAME = 'ref.pot'
 _STARTPOT_NAME = 'start.pot'
+_GRAPHICAL_NAME = 'GraphicalOutput.txt'
+
+
+def _runner(runner):
+    # asyncio is only imported once a tool runs
+    if runner is None:
+        from tool_runner import default_runner
+        runner = default_runner()
+    return runner
+
+
+def _run_in_scratch(tool, args, out_path, input_files=[], results={}, runner=None):
+    # runs tool (see tool_runner.py) in its own temporary directory in out_path (the tools write fixed file names into their
+    # working directory), input_files are copied there before, results {scratch name: name in out_path} are moved into
+    # out_path afterwards - returns the ToolResult
+    # --> the scratch directory is on the file system of out_path, so every result appears at once (os.replace)
+    with tempfile.TemporaryDirectory(dir=out_path, prefix='.scratch_') as scratch_path:
+        scratch_path = pl.Path(scratch_path)
+        for input_file in input_files:
+            shutil.copyfile(input_file, scratch_path / input_file.name)
+
+        output = _runner(runner).run_sync(tool, args, cwd=scratch_path)
+
+        for scratch_name, out_name in results.items():
+            if (scratch_path / scratch_name).exists():
+                os.replace(scratch_path / scratch_name, out_path / out_name)
+    return output
 
 
 def prepare_voronoi_inputcard(in_inputcard, voro_opts = {'DetermineWeights': 1}, weights = [], keep_empty_spheres = False):
     
-    inputcard = deepcopy(in_inputcard)
+    inputcard = in_inputcard.copy()
     # give voroOpts as Testopt
     if voro_opts != {}:
         inputcard.add_testopt('voroOpts')
@@ -39,8 +65,8 @@ def prepare_voronoi_inputcard(in_inputcard, voro_opts = {'DetermineWeights': 1},
     elif len(weights) > len(new_atominfo):
         raise ValueError('Too many weights supplied, the latter ones were ignored')
     
-    for idx in range(len(new_atominfo)):
-        new_atominfo[idx]['WEIGHT'] = weights[idx]
+    # new dicts, the atoms are shared with in_inputcard
+    new_atominfo = [{**atom, 'WEIGHT': weight} for atom, weight in zip(new_atominfo, weights)]
 
     inputcard.change_parameter('atominfo', new_atominfo, 'r')
     inputcard.change_parameter('lattice', {'atom-basis': new_atom_basis}, 'a')
@@ -52,106 +78,113 @@ def prepare_voronoi_inputcard(in_inputcard, voro_opts = {'DetermineWeights': 1},
     return inputcard
 
 
-def perform_voroni(inputcard, out_path):
+def _geometry_check(problems, path):
+    # problems found by voro_output.check_geometry (imported in the functions, numpy is only loaded once the tools ran)
+    if problems:
+        raise RuntimeError(f"inconsistent voronoi results in {path}:\n" + "\n".join(problems))
+
+
+def _tool_error(output):
+    message = f"{output.tool} did not finish successfully in {output.cwd} (exit code {output.exit_code}{', timed out' if output.timed_out else ''})"
+    return RuntimeError(message + (f"\n{output.stderr.strip()}" if output.stderr.strip() else ''))
+
+
+def perform_voroni(inputcard, out_path, runner=None):
 
     out_path = out_path / 'voro'
-    if not out_path.exists():
-        out_path.mkdir(parents = True)
+    out_path.mkdir(parents = True, exist_ok = True)
 
     inputcard_path = out_path / 'inputcard.voro'
     documentation_path = out_path / 'voro.out'
 
-    voro_cmd = f"voronoi {inputcard_path} {documentation_path}"
-    voro_cmd += f" && mv GraphicalOutput.txt {out_path / 'GraphicalOutput.txt'}"
-
     voro_inputcard = prepare_voronoi_inputcard(inputcard)
     voro_inputcard.write_to(inputcard_path)
 
-    output = run(voro_cmd, shell=True, capture_output=True, text=True)
+    output = _run_in_scratch('voronoi', [inputcard_path.name, documentation_path.name], out_path, [inputcard_path],
+                             {documentation_path.name: documentation_path.name, _GRAPHICAL_NAME: _GRAPHICAL_NAME}, runner)
     
     # test that voronoi finished successfully
-    if output.stdout.split('\n')[-2] != ' Voronoi utility finished.':
-        raise RuntimeError("Voronoi Utility did not finish successfully")
+    if not output.success:
+        raise _tool_error(output)
     
-    num_atoms = len(voro_inputcard.get_parameter('atominfo'))
-    # read out the voro
-    with open(documentation_path, 'r') as f:
-        voro_lines = f.readlines()[-(num_atoms):]
-
-    weights = []
-    mt_radii = []
-    for atom in voro_lines:
-        content = atom.strip('\n').split()
-        
-        weights.append(content[-2])
-        mt_radii.append(content[-1])
-
-    return weights, mt_radii
-
-def perform_old_voronoi(inputcard, out_path, weights = []):
+    from voro_output import read_voro_out, read_graphical_output, check_geometry
+
+    voro = read_voro_out(documentation_path)
+    cells = read_graphical_output(out_path / _GRAPHICAL_NAME) if (out_path / _GRAPHICAL_NAME).exists() else None
+    _geometry_check(check_geometry(voro, cells=cells, num_atoms=len(voro_inputcard.get_parameter('atominfo'))), out_path)
+
+    return voro.weights.tolist(), voro.mt_radii.tolist()
+
+def perform_old_voronoi(inputcard, out_path, weights = [], runner=None):
     
     out_path = out_path / 'voro'
-    if not out_path.exists():
-        out_path.mkdir(parents = True)
+    out_path.mkdir(parents = True, exist_ok = True)
 
     inputcard_path = out_path / 'inputcard.voro_old'
     documentation_path = out_path / 'voro_old.out'
 
-    voro_old_cmd = f"cd {out_path} &&"
-    voro_old_cmd += f"old_voronoi {inputcard_path.name} {documentation_path.name}"
-    voro_old_cmd += f"&& mv output.pot {_STARTPOT_NAME} && cd - /dev/null"
-
     voro_old_inputcard = prepare_voronoi_inputcard(inputcard, voro_opts={}, weights=weights, keep_empty_spheres=True)
     voro_old_inputcard.change_parameter('cluster', {"RCLUSTZ": 1.5, "RCLUSTXY": 1.5})
     voro_old_inputcard.write_to(inputcard_path)
 
-    output = run(voro_old_cmd, shell=True, capture_output=True, text=True)
+    output = _run_in_scratch('old_voronoi', [inputcard_path.name, documentation_path.name], out_path, [inputcard_path],
+                             {documentation_path.name: documentation_path.name, 'output.pot': _STARTPOT_NAME}, runner)
+    if not output.success:
+        raise _tool_error(output)
     
-    with open(documentation_path, 'r') as f:
-        lines = f.readlines()
+    from voro_output import read_voro_old_out, check_geometry
 
-    alat = voro_old_inputcard.get_parameter('lattice')['lattice-constant']
+    voro_old = read_voro_old_out(documentation_path)
+    _geometry_check(check_geometry(voro_old=voro_old, num_atoms=len(voro_old_inputcard.get_parameter('atominfo'))), out_path)
 
-    radii = []
-    for line in lines:
-        content = line.split()
-        if len(content) != 0 and content[0:2] == ['Atom', '..']:
-            radii.append({'alat': alat, 'rmt': content[8], 'rmax': content[11]})
+    alat = voro_old_inputcard.get_parameter('lattice')['lattice-constant']
+    radii = [{'alat': alat, 'rmt': rmt, 'rmax': rmax} for rmt, rmax in zip(voro_old.rmt.tolist(), voro_old.rmax.tolist())]
     
     return out_path / _STARTPOT_NAME, radii
 
 
-def perform_const(atom_radii, out_path, verbosity = 0):
-    const_cmd = "Const RMT "
+def perform_const(atom_radii, out_path, verbosity = 0, max_workers=None, runner=None):
+    # atoms with the same radii share one reference potential, Const only runs once for every distinct (alat, rmt, rmax)
+    # the runs are concurrent (as far as the runner allows), each in its own scratch directory (Const always writes Constant.pot)
+    from concurrent.futures import ThreadPoolExecutor
 
     out_path = out_path / 'voro'
-    if not out_path.exists():
-        out_path.mkdir(parents = True)
+    out_path.mkdir(parents = True, exist_ok = True)
+
+    # radii with the 8 decimals of voro_old.out
+    radii_keys = [(str(radii['alat']), f"{float(radii['rmt']):.8f}", f"{float(radii['rmax']):.8f}") for radii in atom_radii]
+    ref_indices = {}
+    for radii in radii_keys:
+        ref_indices.setdefault(radii, len(ref_indices))
 
-    constant_pot = ""
-    for idx, radii in enumerate(atom_radii):
-        atom_const_cmd = f"cd {out_path} && "
-        atom_const_cmd += f"{const_cmd} {radii['alat']} {radii['rmt']} {radii['rmax']}"
-        
-        # move the created constant.pot file into out_path
-        atom_const_cmd += f" && mv Constant.pot Constant_{idx + 1}.pot && cd - > /dev/null"
-        
-        if verbosity == 0:
-            run(atom_const_cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    runner = _runner(runner)
 
-        with open(out_path / f'Constant_{idx + 1}.pot', 'r') as f:
-            constant_pot += "".join(f.readlines())
+    def run_const(radii):
+        with tempfile.TemporaryDirectory(dir=out_path, prefix='.scratch_') as scratch_path:
+            output = runner.run_sync('Const', ['RMT', *radii], cwd=scratch_path)
+            if verbosity != 0:
+                print(output.stdout + output.stderr, end='')
+            if not output.success:
+                raise _tool_error(output)
+            with open(pl.Path(scratch_path) / 'Constant.pot', 'r') as f:
+                return f.read()
 
-    with open(out_path / _REFOPT_NAME, 'w') as out_f:
-        out_f.write(constant_pot)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        constant_pots = list(pool.map(run_const, ref_indices))
 
-    return out_path / _REFOPT_NAME, [{'REFPOT':idx+1} for idx in range(len(atom_radii))]
+    # written next to ref.pot and renamed - ref.pot might be a read only link into a potential store
+    tmp_path = out_path / f'.{_REFOPT_NAME}.{os.getpid()}'
+    with open(tmp_path, 'w') as out_f:
+        out_f.write("".join(constant_pots))
+    os.replace(tmp_path, out_path / _REFOPT_NAME)
 
+    return out_path / _REFOPT_NAME, [{'REFPOT': ref_indices[radii] + 1} for radii in radii_keys]
 
 
 
 if __name__ == '__main__':
-    
+    import numpy as np
+
     norm = 1/np.sqrt(2)
 
     dict = {
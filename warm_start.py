@@ -0,0 +1,84 @@
+import pathlib as pl
+import json
+import numpy as np
+
+from potential_file import read_potential, load_potential, write_potential, transfer_potential
+
+_CONVERGED_NAME = 'CONVERGED'
+_POTIO_NAME = 'potio'
+_JSON_NAME = 'inputcard.json'
+
+# weights of the (relative) parameter differences in the distance between two points of a sweep
+# the k-mesh barely changes the potential, the geometry does (same lattice with another mesh beats a 1% other lattice constant)
+PARAMETER_WEIGHTS = {'lattice-constant': 1.0, 'c-over-a': 1.0, 'k-mesh': 1e-3}
+
+
+def sweep_parameters(lattice, k_points):
+    bravais = np.array(lattice['bravais-lattice'], dtype=float)
+    return {
+        'lattice-constant': float(lattice['lattice-constant']),
+        'c-over-a': float(np.linalg.norm(bravais[2]) / np.linalg.norm(bravais[0])),
+        'k-mesh': float(np.mean(k_points['KMAX']))
+    }
+
+
+def parameter_distance(parameters, other_parameters, weights=PARAMETER_WEIGHTS):
+    distance = 0
+    for key, weight in weights.items():
+        distance += weight * ((parameters[key] - other_parameters[key]) / parameters[key])**2
+    return np.sqrt(distance)
+
+
+def find_converged_neighbour(calc_path, inputcard):
+    """
+    searches the point calculations of the same sweep (<calc_path>/../* and <calc_path>/../../*/*) for the converged one
+    closest to inputcard in (lattice constant, c/a, k-mesh) - returns its path or None if there is none
+    --> only points with the same atoms (Z in the same order) are considered
+    """
+    calc_path = pl.Path(calc_path).resolve()
+    parameters = sweep_parameters(inputcard.get_parameter('lattice'), inputcard.get_parameter('k-points'))
+    atoms = [atom['Z'] for atom in inputcard.get_parameter('atominfo')]
+
+    candidates = set(calc_path.parent.glob(f'*/scf-calc/{_CONVERGED_NAME}'))
+    candidates |= set(calc_path.parent.parent.glob(f'*/*/scf-calc/{_CONVERGED_NAME}'))
+
+    neighbour = None
+    min_distance = np.inf
+    for converged_path in candidates:
+        point_path = converged_path.parent.parent
+        if point_path == calc_path or not (converged_path.parent / _POTIO_NAME).exists():
+            continue
+
+        with open(point_path / _JSON_NAME, 'r') as f:
+            point_dict = json.load(f)
+
+        if [atom['Z'] for atom in point_dict['atominfo']] != atoms:
+            continue
+
+        distance = parameter_distance(parameters, sweep_parameters(point_dict['lattice'], point_dict['k-points']))
+        if distance < min_distance:
+            neighbour = point_path
+            min_distance = distance
+
+    return neighbour
+
+
+def warm_start_potential(calc_path, inputcard, fresh_start_pot, out_path):
+    """
+    writes the converged potential of the closest neighbour, put on the radial meshes of fresh_start_pot (the start.pot
+    of old_voronoi for this geometry), to out_path
+    --> returns the path of the neighbour used, or None if no converged neighbour exists (nothing is written then)
+    """
+    neighbour = find_converged_neighbour(calc_path, inputcard)
+    if neighbour is None:
+        return None
+
+    # the converged neighbours are read again and again by the points of a sweep, through their binary sidecar
+    converged = load_potential(neighbour / 'scf-calc' / _POTIO_NAME)
+    fresh = read_potential(fresh_start_pot)
+    if len(converged) != len(fresh):
+        return None
+
+    write_potential([transfer_potential(source, target) for source, target in zip(converged, fresh)], out_path)
+
+    return neighbour
@@ -0,0 +1,298 @@
+import pathlib as pl
+import argparse
+import json
+import os
+import shlex
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from executor import LocalExecutor
+from results_db import ResultsDB
+from sweep_common import PLOT_LOCK, file_signature
+
+_STATE_NAME = 'workflow_state.json'
+_JSON_NAME = 'inputcard.json'
+_INPUTCARD_NAME = 'inputcard.scf'
+_CSV_NAME = 'output.csv'
+
+class Node:
+    """
+    one stage of a workflow, action() creates the outputs from the inputs once all deps are finished
+    --> actions signal a failure by raising
+    --> a node without action is external (e.g. an array task of a SLURM job), it is finished as soon as its outputs exist
+    """
+
+    def __init__(self, name, action=None, inputs=[], outputs=[], deps=[]):
+        self.name = name
+        self.action = action
+        self.inputs = [pl.Path(input_path) for input_path in inputs]
+        self.outputs = [pl.Path(output_path) for output_path in outputs]
+        self.deps = [dep.name for dep in deps]
+
+
+class Workflow:
+    """
+    runs the nodes of a DAG, every node as soon as its dependencies are finished (at most max_workers at a time)
+    --> ready nodes start in the order they were added, so a workflow added depth first finishes its first branches first
+    --> a node is skipped if its outputs exist and its inputs are unchanged since its last successful run (kept in state_path)
+    --> nodes depending on a failed node are not run
+    """
+
+    def __init__(self, state_path=None, max_workers=None, poll_interval=30, timeout=None):
+        self.state_path = pl.Path(state_path) if state_path else None
+        self.max_workers = max_workers or os.cpu_count()
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+        self.nodes = {}
+        self._state = {}
+        if self.state_path is not None and self.state_path.exists():
+            with open(self.state_path, 'r') as f:
+                self._state = json.load(f)
+
+    def add(self, node):
+        # dependencies have to be added first, which also keeps the graph free of cycles
+        if node.name in self.nodes:
+            raise ValueError(f"node {node.name} was already added")
+        for dep in node.deps:
+            if dep not in self.nodes:
+                raise ValueError(f"dependency {dep} of node {node.name} was not added")
+
+        self.nodes[node.name] = node
+        return node
+
+    def signature(self, node):
+        return {str(input_path): file_signature(input_path) for input_path in node.inputs}
+
+    def is_cached(self, node):
+        return (node.action is not None and all(output_path.exists() for output_path in node.outputs)
+                and self._state.get(node.name) == self.signature(node))
+
+    def _write_state(self):
+        if self.state_path is None:
+            return
+        tmp_path = self.state_path.with_name(f'.{self.state_path.name}.{os.getpid()}')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def run(self):
+        """
+        runs the workflow and returns the status of every node (done, cached, failed or blocked)
+        """
+        order = {name: idx for idx, name in enumerate(self.nodes)}
+        status = {}
+        remaining = list(self.nodes)
+        ready = []
+        waiting = []
+        running = {}
+        start = time.time()
+
+        def finish(node, node_status):
+            status[node.name] = node_status
+            print(f"[{len(status)}/{len(self.nodes)}] {node.name}: {node_status}", file=sys.stderr)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while remaining or ready or waiting or running:
+                # remaining is in the order the nodes were added, so a blocked node blocks its dependents in the same pass
+                for name in list(remaining):
+                    node = self.nodes[name]
+                    dep_status = [status.get(dep) for dep in node.deps]
+                    if any(dep in ['failed', 'blocked'] for dep in dep_status):
+                        remaining.remove(name)
+                        finish(node, 'blocked')
+                    elif all(dep in ['done', 'cached'] for dep in dep_status):
+                        remaining.remove(name)
+                        if node.action is None:
+                            waiting.append(node)
+                        elif self.is_cached(node):
+                            finish(node, 'cached')
+                        else:
+                            ready.append(node)
+
+                finished_external = [node for node in waiting if all(output_path.exists() for output_path in node.outputs)]
+                for node in finished_external:
+                    waiting.remove(node)
+                    finish(node, 'done')
+                if finished_external:
+                    continue
+
+                if waiting and self.timeout is not None and time.time() - start > self.timeout:
+                    for node in waiting:
+                        print(f"{node.name}: outputs still missing after {self.timeout} s", file=sys.stderr)
+                        finish(node, 'failed')
+                    waiting = []
+                    continue
+
+                ready.sort(key=lambda node: order[node.name])
+                while ready and len(running) < self.max_workers:
+                    node = ready.pop(0)
+                    running[pool.submit(node.action)] = node
+
+                if not running:
+                    if waiting:
+                        time.sleep(self.poll_interval)
+                    continue
+
+                finished, _ = wait(running, timeout=self.poll_interval if waiting else None, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        print(f"{node.name} failed:", file=sys.stderr)
+                        traceback.print_exc(file=sys.stderr)
+                        self._state.pop(node.name, None)
+                        finish(node, 'failed')
+                    else:
+                        # taken after the run, actions may touch their own inputs (e.g. the preprocessing its inputcard)
+                        self._state[node.name] = self.signature(node)
+                        finish(node, 'done')
+                    self._write_state()
+
+        return status
+
+
+def _stage_action(run_stage, free_slots, *args):
+    # runs one stage of a point calculation of the local executor on a free cpu slot
+    def action():
+        slot = free_slots.get()
+        try:
+            result = run_stage(*args, slot)
+        finally:
+            free_slots.put(slot)
+        if result.exit_code != 0:
+            raise RuntimeError(f"{result.stage} of {result.task_path} failed with exit code {result.exit_code}\n{result.message}")
+    return action
+
+
+def _fit_action(group_path, results_db):
+    def action():
+        from lattice_relaxation import lattice_relax_postprocessing
+        # pyplot keeps global state, so the fits and convergence checks (which plot) never run at the same time
+        with PLOT_LOCK:
+            lattice_relax_postprocessing(group_path, results_db)
+    return action
+
+
+def _check_action(path, groups, conv_parameter, lat_threshold, comparisons, results_db):
+    def action():
+        from convergence_check import determine_lat_convergence
+        with PLOT_LOCK:
+            # convergence.csv holds the data of the groups of the last check
+            determine_lat_convergence(path, conv_parameter, lat_threshold, comparisons=comparisons, groups=groups, results_db=results_db)
+    return action
+
+
+def _conv_value(group_path):
+    # conv_<value> directories are ordered by value
+    try:
+        return (0, float(group_path.name.split('_', 1)[1]), group_path.name)
+    except (IndexError, ValueError):
+        return (1, 0, group_path.name)
+
+
+def sweep_workflow(path, conv_parameter, lat_threshold, executor=None, weight_relation=[], comparisons=2, kkr_out_file='kkr.out',
+                   poll_interval=30, timeout=None, results_db=None):
+    """
+    workflow of a convergence sweep <path>/conv_*/<point>
+    --> every point is preprocessed, calculated and postprocessed by the local executor, without executor the points are
+        the array tasks of a SLURM job and are finished once their output.csv exists
+    --> the lattice fit of a conv_* group starts as soon as all of its points are finished
+    --> the convergence is checked as soon as comparisons + 1 groups are fitted and again after every further group
+    --> with results_db (a ResultsDB the points are recorded in) the fits and checks query it instead of reading the files
+    """
+    max_workers = executor.max_workers if executor is not None else 1
+    workflow = Workflow(path / _STATE_NAME, max_workers, poll_interval, timeout)
+    free_slots = executor.slot_queue() if executor is not None else None
+
+    groups = sorted((group_path for group_path in path.glob('conv_*') if group_path.is_dir()), key=_conv_value)
+    if not groups:
+        raise ValueError(f"{path} contains no conv_* directories")
+    fits = []
+    for group_path in groups:
+        posts = []
+        for task_path in sorted(task_path for task_path in group_path.iterdir() if task_path.is_dir()):
+            name = str(task_path.relative_to(path))
+            scf_path = task_path / 'scf-calc'
+            if executor is None:
+                posts.append(workflow.add(Node(f'post:{name}', outputs=[task_path / _CSV_NAME])))
+                continue
+
+            pre = workflow.add(Node(f'pre:{name}', _stage_action(executor.run_pre, free_slots, task_path, weight_relation),
+                                    inputs=[task_path / _JSON_NAME], outputs=[scf_path / _INPUTCARD_NAME]))
+            kkr = workflow.add(Node(f'kkr:{name}', _stage_action(executor.run_kkr, free_slots, task_path, scf_path),
+                                    inputs=[scf_path / _INPUTCARD_NAME], outputs=[scf_path / kkr_out_file], deps=[pre]))
+            posts.append(workflow.add(Node(f'post:{name}', _stage_action(executor.run_post, free_slots, task_path, scf_path),
+                                           inputs=[scf_path / kkr_out_file], outputs=[task_path / _CSV_NAME], deps=[kkr])))
+
+        fits.append(workflow.add(Node(f'fit:{group_path.name}', _fit_action(group_path, results_db),
+                                      inputs=[post.outputs[0] for post in posts],
+                                      outputs=[group_path / 'lat_rel.csv', group_path / 'lat_const_out.csv'], deps=posts)))
+
+    # every check also depends on the previous one, so they write convergence.csv one after the other
+    check = None
+    for idx in range(min(comparisons, len(fits) - 1), len(fits)):
+        deps = fits[:idx + 1] + ([check] if check is not None else [])
+        check = workflow.add(Node(f'check:{groups[idx].name}', _check_action(path, groups[:idx + 1], conv_parameter, lat_threshold, comparisons, results_db),
+                                  inputs=[output_path for fit in fits[:idx + 1] for output_path in fit.outputs],
+                                  outputs=[path / 'convergence.csv'], deps=deps))
+
+    return workflow
+
+
+def main():
+
+    parser = argparse.ArgumentParser("Runs the stages of a convergence sweep (point calculations, lattice fits, convergence check) as soon as their inputs are ready")
+
+    parser.add_argument('-p', '--path', dest='path',
+                        help='path of the sweep (containing the conv_* directories created by convergence_test.py)')
+    parser.add_argument('-c','--convergence_parameter', dest='conv_paras',
+                        help='parameter used for the convergence of the format <dict:parameter> [e.g <cluster:RCLUSTZ>]')
+    parser.add_argument('-b', '--conv_bound', dest='c_bound', type=float,
+                        help='bound on the lattice constant to achieve convergence, in atomic units')
+    parser.add_argument('--comparisons', dest='comparisons', type=int, default=2,
+                        help='number of previous groups a group has to agree with to be converged')
+
+    parser.add_argument('--executor', dest='executor', choices=['slurm', 'local'], default='slurm',
+                        help='<slurm> waits for the array tasks of an already submitted job (default), <local> runs the point calculations on this machine')
+    parser.add_argument('-w', '--weight_relation', dest='weight_rel', nargs='*', default=[],
+                        help='The indices of the atoms, from which the empty spheres should take the weights (local executor)')
+    parser.add_argument('--kkr_cmd', dest='kkr_cmd', default='kkr.x',
+                        help='command of the kkr code used by the local executor (inputcard.scf is appended)')
+    parser.add_argument('--max_workers', dest='max_workers', type=int, default=None,
+                        help='number of stages run at the same time by the local executor. Default is one per cpu slot')
+    parser.add_argument('--cpus_per_task', dest='cpus_per_task', type=int, default=1,
+                        help='cpus (OMP_NUM_THREADS) of every point calculation of the local executor')
+    parser.add_argument('--pin_cpus', dest='pin_cpus', action='store_true',
+                        help='pin every point calculation of the local executor to its own cpus')
+    parser.add_argument('--supervise', dest='supervise', action='store_true',
+                        help='run the kkr code of the local executor under scf_supervisor.py')
+
+    parser.add_argument('--results_db', dest='results_db', default=None,
+                        help='results database the points are recorded in (by the local executor or the job script), queried by the fits and checks')
+
+    parser.add_argument('--poll_interval', dest='poll_interval', type=float, default=30,
+                        help='seconds between two checks for the outputs of the array tasks')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=None,
+                        help='seconds after which array tasks without output count as failed. Default is to wait forever')
+
+    args = parser.parse_args()
+
+    executor = None
+    if args.executor == 'local':
+        executor = LocalExecutor(shlex.split(args.kkr_cmd), args.max_workers, args.cpus_per_task, args.pin_cpus, supervise=args.supervise,
+                                 results_db=args.results_db)
+    results_db = ResultsDB(args.results_db) if args.results_db else None
+
+    workflow = sweep_workflow(pl.Path(args.path), args.conv_paras.split(':'), args.c_bound, executor, args.weight_rel, args.comparisons,
+                              poll_interval=args.poll_interval, timeout=args.timeout, results_db=results_db)
+    status = workflow.run()
+
+    sys.exit(1 if any(node_status in ['failed', 'blocked'] for node_status in status.values()) else 0)
+
+
+if __name__ == '__main__':
+    main()